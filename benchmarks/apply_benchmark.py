@@ -0,0 +1,48 @@
+"""Стоимость apply_state_changes в зависимости от размера подземелья.
+
+Прежняя реализация начиналась с глубокой копии всего состояния - для
+сравнения она измеряется отдельно.
+
+Запуск: python -m benchmarks.apply_benchmark --rooms 10 100 300 1000
+"""
+import argparse
+import time
+
+from benchmarks.dungeon_factory import make_dungeon
+from models import StateChange
+from services.dnd_service import apply_state_changes
+
+
+def _timed(func, repeat: int) -> float:
+    """Среднее время вызова в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rooms", type=int, nargs="+", default=[10, 100, 300, 1000])
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'комнат':>6} {'ход, мкс':>10} {'бой, мкс':>10} {'без изменений комнаты, мкс':>28} {'глубокая копия, мкс':>21}")
+    for rooms in args.rooms:
+        state = make_dungeon(rooms)
+        room = state.dungeon.rooms[state.player.location]
+        target = next(iter(room.exits.values())).target_room
+        move = StateChange(player_location_change=target, last_action_description="Вы проходите дальше.")
+        fight = StateChange(player_hp_change=-2, room_enemies_remove=room.enemies[:1], room_items_add=["Трофей"],
+                            room_exits_unblock=[target], last_action_description="Вы побеждаете врага.")
+        talk = StateChange(inventory_add=["Записка"], last_action_description="Старик отдаёт вам записку.")
+
+        move_us = _timed(lambda: apply_state_changes(state, move), args.repeat)
+        fight_us = _timed(lambda: apply_state_changes(state, fight), args.repeat)
+        talk_us = _timed(lambda: apply_state_changes(state, talk), args.repeat)
+        deep_us = _timed(lambda: state.copy(deep=True), max(args.repeat // 10, 1))
+        print(f"{rooms:>6} {move_us:>10.1f} {fight_us:>10.1f} {talk_us:>28.1f} {deep_us:>21.0f}")
+
+
+if __name__ == "__main__":
+    main()
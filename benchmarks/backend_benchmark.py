@@ -0,0 +1,81 @@
+"""Распределение запросов между несколькими серверами Ollama.
+
+Поднимает заменители Ollama (benchmarks/fake_ollama.py) с заданными весами,
+гоняет ходы нескольких чатов через ollama_with_validation и показывает,
+сколько запросов получил каждый сервер и как часто ход чата попадал на
+сервер его прошлого хода. С --fail первый сервер на время отключается:
+его запросы должны уйти на остальные, а после восстановления он должен
+вернуться в работу.
+
+Запуск: python -m benchmarks.backend_benchmark --weights 1 1 2 --chats 12 --turns 10
+"""
+import argparse
+import threading
+import time
+
+from benchmarks.fake_ollama import FakeOllama
+from models import StateChange
+from services import ollama_service
+from services.llm_scheduler import llm_scheduler
+from services.ollama_backends import OLLAMA_BACKEND_REQUESTS, OllamaBackend, ollama_backends
+from services.ollama_session import SessionStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--weights", type=float, nargs="+", default=[1, 1, 2])
+    parser.add_argument("--chats", type=int, default=12)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.2, help="время генерации на сервере веса 1, секунды")
+    parser.add_argument("--fail", action="store_true", help="отключить первый сервер на треть прогона")
+    args = parser.parse_args()
+
+    # Сервер веса w вдвое мощнее сервера веса w/2: быстрее отвечает и держит больше запросов
+    fakes = [FakeOllama(delay=args.delay / weight, parallel=max(1, int(weight))).start() for weight in args.weights]
+    ollama_backends.backends = [OllamaBackend(fake.url, weight=weight) for fake, weight in zip(fakes, args.weights)]
+    llm_scheduler.max_concurrent = sum(max(1, int(weight)) for weight in args.weights)
+    ollama_service.OLLAMA_HEALTH_CHECK_INTERVAL = 0.5
+    ollama_service.start_health_monitor()
+    sessions = SessionStore()
+    failed = []
+
+    def play(chat_id: int):
+        for _ in range(args.turns):
+            try:
+                ollama_service.ollama_with_validation("осмотреться", StateChange, system_prompt="Ход игрока",
+                                                      session=sessions.get(chat_id), chat_id=chat_id)
+            except ollama_service.OllamaUnavailableError:
+                failed.append(chat_id)
+
+    def outage(duration: float):
+        fakes[0].failing = True
+        time.sleep(duration)
+        fakes[0].failing = False
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=play, args=(chat_id,)) for chat_id in range(args.chats)]
+    if args.fail:
+        expected = args.chats * args.turns * args.delay / sum(args.weights) / max(1, len(args.weights) - 1)
+        threads.append(threading.Thread(target=outage, args=(expected / 3,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    ollama_service.stop_health_monitor()
+
+    total = args.chats * args.turns
+    print(f"{total} ходов за {elapsed:.1f} с ({total / elapsed:.1f} ходов/с), отказов: {len(failed)}")
+    print(f"{'сервер':<32} {'вес':>4} {'запросов':>9} {'доля':>6} {'макс. параллельно':>18}")
+    for fake, weight in zip(fakes, args.weights):
+        print(f"{fake.url:<32} {weight:>4g} {fake.requests:>9} {fake.requests / total:>6.1%} {fake.max_in_flight:>18}")
+    routes = {}
+    for labels, value in OLLAMA_BACKEND_REQUESTS.items():
+        routes[labels["route"]] = routes.get(labels["route"], 0) + int(value)
+    print("выбор сервера: " + ", ".join(f"{route} {count}" for route, count in sorted(routes.items())))
+    for fake in fakes:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
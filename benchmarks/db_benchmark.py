@@ -0,0 +1,84 @@
+"""Сравнение скорости load_state/save_state: соединение на каждый вызов против постоянных соединений.
+
+Запуск: python -m benchmarks.db_benchmark --ops 2000 --rooms 30 --threads 4
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.dungeon_factory import make_dungeon
+from database import db_manager
+from models import GameStateModel
+
+
+def _naive_init(path: str):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS game_state (user_id INTEGER PRIMARY KEY, state_json TEXT)")
+    conn.commit()
+    conn.close()
+
+
+def _naive_save(path: str, user_id: int, state: GameStateModel):
+    """Прежняя реализация: новое соединение и журнал отката на каждый вызов"""
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("REPLACE INTO game_state (user_id, state_json) VALUES (?, ?)", (user_id, state.json(ensure_ascii=False)))
+    conn.commit()
+    conn.close()
+
+
+def _naive_load(path: str, user_id: int):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("SELECT state_json FROM game_state WHERE user_id = ?", (user_id,))
+    row = c.fetchone()
+    conn.close()
+    return GameStateModel.parse_raw(row[0]) if row else None
+
+
+def _run(ops: int, threads: int, users: int, save, load) -> float:
+    """Ход игрока = load + save; возвращает операций (load или save) в секунду"""
+    def turn(i: int):
+        user_id = i % users
+        state = load(user_id)
+        save(user_id, state)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(turn, range(ops // 2)))
+    return ops / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=30)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    state = make_dungeon(args.rooms)
+    with tempfile.TemporaryDirectory() as tmp:
+        naive_path = os.path.join(tmp, "naive.db")
+        _naive_init(naive_path)
+        for user_id in range(args.users):
+            _naive_save(naive_path, user_id, state)
+        naive = _run(args.ops, args.threads, args.users,
+                     lambda u, s: _naive_save(naive_path, u, s), lambda u: _naive_load(naive_path, u))
+
+        db_manager.init_db(os.path.join(tmp, "pooled.db"))
+        for user_id in range(args.users):
+            db_manager.save_state(user_id, state)
+        pooled = _run(args.ops, args.threads, args.users, db_manager.save_state, db_manager.load_state)
+        db_manager.close_connections()
+
+    print(f"Подземелье: {args.rooms} комнат, {len(state.json(ensure_ascii=False))} символов JSON, потоков: {args.threads}")
+    print(f"Соединение на вызов:      {naive:8.0f} оп/с")
+    print(f"Постоянные соединения+WAL: {pooled:8.0f} оп/с ({pooled / naive:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import random
+from models import CharacterModel, DungeonModel, ExitModel, GameStateModel, RoomModel
+
+# Фрагменты для описаний, по длине и составу похожих на то, что генерирует Ollama
+_PLACES = ["Сырой подвал", "Заброшенная библиотека", "Зал с колоннами", "Тесная келья", "Разрушенная часовня",
+           "Оружейная", "Подземное озеро", "Кладовая алхимика", "Тронный зал", "Склеп древнего рода"]
+_DETAILS = ["Со сводчатого потолка капает вода, и каждый звук гулко отражается от стен.",
+            "На полу лежит толстый слой пыли, в котором видны чьи-то свежие следы.",
+            "Вдоль стен тянутся полки с истлевшими книгами и свитками.",
+            "Тусклый свет факелов выхватывает из темноты ржавые цепи и обломки мебели.",
+            "В воздухе стоит запах серы и старого воска.",
+            "Из глубины зала доносится тихий шёпот, который то стихает, то становится громче."]
+_ITEMS = ["Факел", "Ржавый ключ", "Зелье лечения", "Старинная карта", "Серебряный кинжал", "Мешочек золота",
+          "Свиток огненного шара", "Верёвка", "Амулет защиты", "Кусок мела"]
+_ENEMIES = ["Скелет", "Гоблин", "Гигантская крыса", "Культист", "Зомби", "Тёмный маг"]
+_NPCS = ["Старый библиотекарь", "Раненый паладин", "Торговец-гном", "Призрак монаха"]
+_EXITS = ["Ржавая дверь", "Каменная арка", "Узкий лаз", "Винтовая лестница", "Секретный проход", "Дубовая дверь"]
+
+
+def make_room(rng: random.Random, exits: dict) -> RoomModel:
+    """Комната со случайным описанием и содержимым"""
+    items = rng.sample(_ITEMS, rng.randint(0, 3))
+    enemies = rng.sample(_ENEMIES, rng.randint(0, 2))
+    npcs = rng.sample(_NPCS, rng.randint(0, 1))
+    description = f"{rng.choice(_PLACES)}. " + " ".join(rng.sample(_DETAILS, 3))
+    if items:
+        description += f" Здесь можно найти: {', '.join(items).lower()}."
+    if enemies:
+        description += f" В тени притаились враги: {', '.join(enemies).lower()}."
+    return RoomModel(description=description, items=items, enemies=enemies, friendly_npcs=npcs, exits=exits)
+
+
+def make_dungeon(rooms: int = 10, seed: int = 0) -> GameStateModel:
+    """Подземелье из rooms комнат: цепочка переходов плюс случайные скрытые проходы"""
+    rng = random.Random(seed)
+    room_ids = [f"Room{i + 1}" for i in range(rooms)]
+    exits = {room_id: {} for room_id in room_ids}
+    for current, following in zip(room_ids, room_ids[1:]):
+        name = rng.choice(_EXITS)
+        exits[current][following] = ExitModel(target_room=following, name=name)
+        exits[following][current] = ExitModel(target_room=current, name=name)
+    for _ in range(rooms // 3):
+        source, target = rng.sample(room_ids, 2)
+        exits[source].setdefault(target, ExitModel(target_room=target, name="Секретный проход", is_hidden=True))
+
+    return GameStateModel(
+        player=CharacterModel(name="Герой", race="Человек", cls="Воин", hp=15,
+                              inventory=["Меч", "Щит", "Кольчуга"], location=room_ids[0]),
+        dungeon=DungeonModel(rooms={room_id: make_room(rng, exits[room_id]) for room_id in room_ids}),
+        adventure_description="Древнее зло пробудилось в катакомбах под городом. Найдите и уничтожьте источник тьмы.",
+        story_context="Вы спускаетесь по старой лестнице, и дверь за вами захлопывается.",
+    )
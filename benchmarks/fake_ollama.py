@@ -0,0 +1,170 @@
+"""Локальный заменитель сервера Ollama для нагрузочных проверок без модели.
+
+Отвечает на /api/tags и /api/chat (с потоковой передачей и без) готовыми
+корректными ответами: подземельем на запрос генерации подземелья и простым
+StateChange на ход. Время ответа, скорость генерации, доля испорченных
+ответов (обрезанный JSON), доступность и число параллельных слотов
+настраиваются, принятые запросы подсчитываются.
+
+Запуск отдельно: python -m benchmarks.fake_ollama --port 11434 --delay 0.5 --token-rate 40 --malformed 0.1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from benchmarks.dungeon_factory import make_dungeon
+from models import StateChange
+
+# Размер куска потокового ответа в символах
+_CHUNK_SIZE = 16
+
+
+class FakeOllama:
+    """Заменитель Ollama на 127.0.0.1:port (port=0 - свободный порт)"""
+
+    def __init__(self, port: int = 0, delay: float = 0.2, parallel: int = 1, rooms: int = 5,
+                 token_rate: float = 0, malformed_rate: float = 0, seed: int = 0):
+        # Без token_rate ответ целиком генерируется за delay, с ним delay - задержка до первого фрагмента,
+        # а дальше фрагменты идут со скоростью token_rate токенов (~4 символа) в секунду
+        self.delay = delay
+        self.token_rate = token_rate
+        # Доля ответов с обрезанным JSON, которые бот должен отбросить и запросить заново
+        self.malformed_rate = malformed_rate
+        self.malformed = 0
+        self._random = random.Random(seed)
+        # Сервер недоступен: /api/tags и /api/chat отвечают 503
+        self.failing = False
+        self.requests = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(parallel)
+        self._dungeon = make_dungeon(rooms).json(ensure_ascii=False)
+        self._change = StateChange(last_action_description="Вы осматриваетесь.").json(exclude_none=True,
+                                                                                      ensure_ascii=False)
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/chat"
+
+    def start(self) -> "FakeOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _content(self, body: dict) -> str:
+        """Подземелье, если запрошена схема состояния игры, иначе изменение состояния"""
+        schema = body.get("format") or {}
+        content = self._dungeon if "dungeon" in schema.get("properties", {}) else self._change
+        with self._lock:
+            if self._random.random() >= self.malformed_rate:
+                return content
+            self.malformed += 1
+        return content[:len(content) // 2]
+
+    def _generation_time(self, content: str) -> float:
+        if not self.token_rate:
+            return self.delay
+        return self.delay + len(content) / 4 / self.token_rate
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, data: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if fake.failing:
+                    self._send(503, b"{}")
+                else:
+                    self._send(200, b'{"models": []}')
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if fake.failing:
+                    self._send(503, b'{"error": "unavailable"}')
+                    return
+                with fake._slots:
+                    with fake._lock:
+                        fake.requests += 1
+                        fake._in_flight += 1
+                        fake.max_in_flight = max(fake.max_in_flight, fake._in_flight)
+                    try:
+                        self._reply(body)
+                    finally:
+                        with fake._lock:
+                            fake._in_flight -= 1
+
+            def _reply(self, body: dict):
+                content = fake._content(body)
+                generation = fake._generation_time(content)
+                final = {"done": True, "prompt_eval_count": 100, "prompt_eval_duration": 1_000_000,
+                         "eval_count": len(content) // 4, "eval_duration": int(generation * 1e9)}
+                if not body.get("stream"):
+                    time.sleep(generation)
+                    final["message"] = {"role": "assistant", "content": content}
+                    self._send(200, json.dumps(final).encode("utf-8"))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                chunks = [content[i:i + _CHUNK_SIZE] for i in range(0, len(content), _CHUNK_SIZE)]
+                if fake.token_rate:
+                    time.sleep(fake.delay)
+                    pause = _CHUNK_SIZE / 4 / fake.token_rate
+                else:
+                    pause = fake.delay / max(len(chunks), 1)
+                try:
+                    for chunk in chunks:
+                        time.sleep(pause)
+                        line = {"message": {"role": "assistant", "content": chunk}, "done": False}
+                        self.wfile.write((json.dumps(line) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                    final["message"] = {"role": "assistant", "content": ""}
+                    self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент закрыл соединение - генерация прервана
+                    pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--delay", type=float, default=0.5, help="время генерации ответа, секунды")
+    parser.add_argument("--parallel", type=int, default=1, help="сколько запросов обрабатывается одновременно")
+    parser.add_argument("--token-rate", type=float, default=0, help="токенов в секунду (0 - весь ответ за --delay)")
+    parser.add_argument("--malformed", type=float, default=0, help="доля ответов с испорченным JSON")
+    args = parser.parse_args()
+
+    fake = FakeOllama(args.port, args.delay, args.parallel, token_rate=args.token_rate,
+                      malformed_rate=args.malformed).start()
+    print(f"Заменитель Ollama: {fake.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
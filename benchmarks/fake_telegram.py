@@ -0,0 +1,82 @@
+"""Локальный заменитель Telegram Bot API для нагрузочных проверок.
+
+getUpdates работает как длинный опрос с offset и timeout, остальные методы
+(sendMessage, editMessageText, setWebhook...) отвечают ok и запоминаются.
+Сервер работает в event loop вызывающего кода (aiohttp.web).
+"""
+import asyncio
+import time
+from typing import Callable, List, Optional, Tuple
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    """Заменитель Bot API на 127.0.0.1:port (port=0 - свободный порт)"""
+
+    def __init__(self, token: str = "test", port: int = 0):
+        self.token = token
+        self.port = port
+        self.updates: List[dict] = []
+        # (время, метод, тело запроса) вызовов, кроме getUpdates
+        self.calls: List[Tuple[float, str, dict]] = []
+        # Вызываются с (время, метод, тело) на каждый вызов, кроме getUpdates
+        self.listeners: List[Callable[[float, str, dict], None]] = []
+        self._next_id = 1
+        self._changed: Optional[asyncio.Condition] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        """Значение для TelegramClient.base_url"""
+        return f"http://127.0.0.1:{self.port}/bot{self.token}"
+
+    async def start(self) -> "FakeTelegram":
+        self._changed = asyncio.Condition()
+        app = web.Application()
+        app.router.add_route("*", f"/bot{self.token}/{{method}}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def push(self, update: dict) -> dict:
+        """Новое обновление для getUpdates (update_id назначается по порядку)"""
+        update = dict(update, update_id=self._next_id)
+        self._next_id += 1
+        async with self._changed:
+            self.updates.append(update)
+            self._changed.notify_all()
+        return update
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(request)})
+        body = await request.json() if request.can_read_body else {}
+        call = (time.monotonic(), method, body)
+        self.calls.append(call)
+        for listener in self.listeners:
+            listener(*call)
+        return web.json_response({"ok": True, "result": {"message_id": len(self.calls)}})
+
+    async def _get_updates(self, request: web.Request) -> List[dict]:
+        offset = int(request.query.get("offset", 0))
+        timeout = float(request.query.get("timeout", 0))
+
+        def pending() -> List[dict]:
+            # Telegram забывает обновления до offset
+            return [update for update in self.updates if update["update_id"] >= offset]
+
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: bool(pending())), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return pending()
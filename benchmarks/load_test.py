@@ -0,0 +1,196 @@
+"""Нагрузочный тест бота целиком: N игроков одновременно проходят сценарий /new → /character → действия.
+
+Бот запускается отдельным процессом (python main.py) с настройками из
+переменных окружения DND_*: Bot API заменяет benchmarks/fake_telegram.py,
+Ollama - benchmarks/fake_ollama.py (задержка, скорость генерации и доля
+испорченных ответов задаются), база создаётся во временном каталоге, сеть
+не нужна. Каждый игрок отправляет следующую команду, только получив ответ
+на предыдущую. Задержка команды - от появления обновления в getUpdates до
+итогового ответа бота в чат (новое сообщение или последняя правка
+предпросмотра; уведомления о месте в очереди не считаются).
+
+Запуск: python -m benchmarks.load_test --players 50 --actions 5 --delay 0.5 --token-rate 40 --malformed 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.fake_ollama import FakeOllama
+from benchmarks.fake_telegram import FakeTelegram
+from handlers.message_handlers import GM_BUSY_MESSAGE, GM_UNAVAILABLE_MESSAGE
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Действия игроков по кругу: осмотр и инвентарь (кеш, правила), переходы и бой (Ollama)
+ACTIONS = ["осмотреться", "инвентарь", "взять факел", "идти в ржавую дверь", "атаковать скелета мечом",
+           "поговорить с библиотекарем", "осмотреть стены в поисках тайника"]
+COMMANDS = ("new", "character", "action")
+# Начало уведомления о месте в очереди (handlers/message_handlers.py) - это ещё не ответ
+_NOTICE_PREFIX = "⏳ Ведущий занят другими игроками"
+
+
+def _percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+class _Replies:
+    """Ожидание итогового ответа бота в чат по вызовам заменителя Bot API"""
+
+    def __init__(self):
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self.ready = asyncio.Event()
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[chat_id] = future
+        return future
+
+    def __call__(self, at: float, method: str, body: dict):
+        # Бот снимает webhook перед первым getUpdates - значит, запустился
+        self.ready.set()
+        if method not in ("sendMessage", "editMessageText"):
+            return
+        text = body.get("text", "")
+        # Предпросмотр потокового ответа заканчивается многоточием
+        if text.endswith(" …") or text.startswith(_NOTICE_PREFIX):
+            return
+        future = self._waiting.pop(body.get("chat_id"), None)
+        if future is not None and not future.done():
+            future.set_result((at, text))
+
+
+class _Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.refused: Dict[str, int] = defaultdict(int)
+        self.timeouts: Dict[str, int] = defaultdict(int)
+
+
+def _script(player: int, actions: int) -> List[Tuple[str, str]]:
+    return ([("new", "/new"), ("character", f"/character Игрок{player}")] +
+            [("action", ACTIONS[(player + i) % len(ACTIONS)]) for i in range(actions)])
+
+
+async def _play(player: int, telegram: FakeTelegram, replies: _Replies, results: _Results, args):
+    chat_id = 1000 + player
+    for command, text in _script(player, args.actions):
+        future = replies.expect(chat_id)
+        started = time.monotonic()
+        await telegram.push({"message": {"message_id": 1, "chat": {"id": chat_id}, "text": text}})
+        try:
+            replied_at, reply = await asyncio.wait_for(future, args.timeout)
+        except asyncio.TimeoutError:
+            # Запоздавший ответ сбил бы замер следующей команды - игрок выходит
+            results.timeouts[command] += 1
+            return
+        results.latencies[command].append(replied_at - started)
+        if reply in (GM_BUSY_MESSAGE, GM_UNAVAILABLE_MESSAGE):
+            results.refused[command] += 1
+        if args.think:
+            await asyncio.sleep(args.think)
+
+
+def _bot_env(args, telegram: FakeTelegram, ollama: FakeOllama, workdir: str) -> dict:
+    settings = {
+        "TELEGRAM_TOKEN": telegram.token,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{telegram.port}",
+        "OLLAMA_BACKENDS": [{"url": ollama.url, "models": [], "weight": 1}],
+        "DB_PATH": os.path.join(workdir, "dnd.db"),
+        "RUNTIME_MODE": args.mode,
+        "WORKER_PROCESSES": args.workers,
+        # Слотов планировщика столько же, сколько параллельных запросов у заменителя
+        "LLM_MAX_CONCURRENT": args.parallel,
+    }
+    for assignment in args.set:
+        name, _, value = assignment.partition("=")
+        settings[name] = value
+    env = dict(os.environ)
+    for name, value in settings.items():
+        env[f"DND_{name}"] = value if isinstance(value, str) else json.dumps(value)
+    return env
+
+
+async def run(args) -> Optional[_Results]:
+    telegram = await FakeTelegram().start()
+    ollama = FakeOllama(delay=args.delay, parallel=args.parallel, token_rate=args.token_rate,
+                        malformed_rate=args.malformed).start()
+    replies = _Replies()
+    telegram.listeners.append(replies)
+    results = _Results()
+    workdir = tempfile.mkdtemp(prefix="dnd-load-")
+    log_path = os.path.join(workdir, "bot.log")
+    with open(log_path, "wb") as log:
+        bot = await asyncio.create_subprocess_exec(sys.executable, "main.py", cwd=ROOT, stdout=log,
+                                                   stderr=asyncio.subprocess.STDOUT,
+                                                   env=_bot_env(args, telegram, ollama, workdir))
+    try:
+        launched = time.monotonic()
+        try:
+            await asyncio.wait_for(replies.ready.wait(), 30)
+        except asyncio.TimeoutError:
+            print(f"Бот не запустился, журнал: {log_path}")
+            return None
+        startup = time.monotonic() - launched
+
+        started = time.monotonic()
+        await asyncio.gather(*(_play(player, telegram, replies, results, args) for player in range(args.players)))
+        elapsed = time.monotonic() - started
+    finally:
+        bot.terminate()
+        try:
+            await asyncio.wait_for(bot.wait(), 60)
+        except asyncio.TimeoutError:
+            bot.kill()
+        ollama.stop()
+        await telegram.stop()
+
+    completed = sum(len(values) for values in results.latencies.values())
+    sends = sum(1 for _, method, _ in telegram.calls if method == "sendMessage")
+    edits = sum(1 for _, method, _ in telegram.calls if method == "editMessageText")
+    print(f"{args.players} игроков по {args.actions} действий, режим {args.mode}, процессов {args.workers}, "
+          f"Ollama: задержка {args.delay} с, {args.token_rate or '-'} ток./с, слотов {args.parallel}, "
+          f"испорченных {args.malformed:.0%}")
+    print(f"запуск бота {startup:.1f} с, команд {completed} за {elapsed:.1f} с ({completed / elapsed:.1f} в секунду)")
+    print(f"{'команда':<10} {'ответов':>8} {'отказов':>8} {'таймаутов':>10} {'p50, мс':>9} {'p95, мс':>9} "
+          f"{'p99, мс':>9} {'макс, мс':>9}")
+    for command in COMMANDS:
+        latencies = [latency * 1000 for latency in results.latencies[command]]
+        if not latencies:
+            print(f"{command:<10} {0:>8} {results.refused[command]:>8} {results.timeouts[command]:>10}")
+            continue
+        print(f"{command:<10} {len(latencies):>8} {results.refused[command]:>8} {results.timeouts[command]:>10} "
+              f"{_percentile(latencies, 0.5):>9.0f} {_percentile(latencies, 0.95):>9.0f} "
+              f"{_percentile(latencies, 0.99):>9.0f} {max(latencies):>9.0f}")
+    # Каждый испорченный ответ бот отбрасывает и запрашивает заново
+    print(f"запросов к Ollama {ollama.requests}, из них испорченных (повторы) {ollama.malformed}; "
+          f"Telegram: sendMessage {sends}, editMessageText {edits}")
+    print(f"журнал бота: {log_path}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--actions", type=int, default=5, help="действий каждого игрока после /character")
+    parser.add_argument("--think", type=float, default=0, help="пауза игрока между командами, секунды")
+    parser.add_argument("--timeout", type=float, default=120, help="сколько ждать ответа на команду, секунды")
+    parser.add_argument("--delay", type=float, default=0.5, help="задержка Ollama до первого фрагмента, секунды")
+    parser.add_argument("--token-rate", type=float, default=0, help="токенов в секунду (0 - весь ответ за --delay)")
+    parser.add_argument("--parallel", type=int, default=1, help="параллельных запросов у заменителя Ollama")
+    parser.add_argument("--malformed", type=float, default=0, help="доля ответов Ollama с испорченным JSON")
+    parser.add_argument("--mode", choices=("async", "sync"), default="async")
+    parser.add_argument("--workers", type=int, default=1, help="WORKER_PROCESSES бота")
+    parser.add_argument("--set", action="append", default=[], metavar="ИМЯ=ЗНАЧЕНИЕ",
+                        help="другие настройки бота (JSON или строка), можно несколько раз")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
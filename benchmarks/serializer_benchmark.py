@@ -0,0 +1,43 @@
+"""Размер сохранения и время кодирования/разбора для форматов database.serializers.
+
+Запуск: python -m benchmarks.serializer_benchmark --rooms 10 30 100
+"""
+import argparse
+import time
+
+from benchmarks.dungeon_factory import make_dungeon
+from database.serializers import FORMATS, encode_state, decode_state, decode_legacy_json
+
+
+def _timed(func, repeat: int) -> float:
+    """Среднее время вызова в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rooms", type=int, nargs="+", default=[10, 30, 100])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'комнат':>6} {'формат':<14} {'байт':>8} {'сжатие':>7} {'запись, мкс':>12} {'чтение, мкс':>12}")
+    for rooms in args.rooms:
+        state = make_dungeon(rooms)
+        legacy = state.json(ensure_ascii=False)
+        legacy_size = len(legacy.encode("utf-8"))
+        encode_us = _timed(lambda: state.json(ensure_ascii=False), args.repeat)
+        decode_us = _timed(lambda: decode_legacy_json(legacy), args.repeat)
+        print(f"{rooms:>6} {'state_json':<14} {legacy_size:>8} {1.0:>7.2f} {encode_us:>12.0f} {decode_us:>12.0f}")
+        for fmt in FORMATS:
+            blob = encode_state(state, fmt)
+            assert decode_state(blob) == state
+            encode_us = _timed(lambda: encode_state(state, fmt), args.repeat)
+            decode_us = _timed(lambda: decode_state(blob), args.repeat)
+            print(f"{rooms:>6} {fmt:<14} {len(blob):>8} {legacy_size / len(blob):>7.2f} {encode_us:>12.0f} {decode_us:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Стоимость операций одного сообщения для хранилищ snapshot и normalized в зависимости от размера подземелья.
+
+Кеш игр не используется - измеряется работа с БД при промахе кеша.
+
+Запуск: python -m benchmarks.storage_benchmark --rooms 10 100 500
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.dungeon_factory import make_dungeon
+from database import db_manager
+from models import StateChange
+
+
+def _timed(func, repeat: int) -> float:
+    """Среднее время вызова в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rooms", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'хранилище':<11} {'комнат':>6} {'/status, мкс':>13} {'загрузка, мкс':>14} {'ход, мкс':>10} {'снимок, мкс':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("snapshot", "normalized"):
+            db_manager.init_db(os.path.join(tmp, f"{backend}.db"), backend=backend)
+            for rooms in args.rooms:
+                user_id = rooms
+                state = make_dungeon(rooms)
+                db_manager.save_state(user_id, state)
+                seq = [db_manager.last_action_seq(user_id)]
+                change = StateChange(player_hp_change=-1, room_items_add=["Трофей"], room_items_remove=["Трофей"],
+                                     last_action_description="Вы поднимаете и бросаете трофей.")
+
+                def turn():
+                    seq[0] += 1
+                    db_manager.write_games([], [(user_id, seq[0], change)])
+
+                view_us = _timed(lambda: db_manager.load_view(user_id), args.repeat)
+                load_us = _timed(lambda: db_manager.load_game(user_id), max(args.repeat // 10, 1))
+                turn_us = _timed(turn, args.repeat)
+                snapshot_us = _timed(lambda: db_manager.save_state(user_id, state), max(args.repeat // 10, 1))
+                print(f"{backend:<11} {rooms:>6} {view_us:>13.0f} {load_us:>14.0f} {turn_us:>10.0f} {snapshot_us:>12.0f}")
+        db_manager.close_connections()
+
+
+if __name__ == "__main__":
+    main()
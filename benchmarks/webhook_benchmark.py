@@ -0,0 +1,168 @@
+"""Задержка и пропускная способность приёма обновлений: webhook против опроса getUpdates.
+
+Синтетические обновления поступают с заданной частотой. Для webhook они
+отправляются POST-запросами во встроенный сервер (services/webhook_server.py),
+для опроса - появляются в заменителе Bot API (benchmarks/fake_telegram.py),
+откуда их забирает клиент так же, как основной цикл бота: асинхронный -
+длинным опросом, синхронный - опросом с паузой в 1 с. Задержка приёма -
+время от появления обновления до его получения циклом бота; обработка
+(process_message) не измеряется.
+
+Запуск: python -m benchmarks.webhook_benchmark --updates 2000 --rate 500
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from typing import Dict, List
+
+import aiohttp
+
+from benchmarks.fake_telegram import FakeTelegram
+from services.telegram_client import AsyncTelegramClient, TelegramClient
+from services.webhook_server import SECRET_HEADER, AsyncWebhookServer
+
+SECRET = "benchmark-secret"
+
+
+def _update(chat_id: int) -> dict:
+    return {"message": {"message_id": 1, "chat": {"id": chat_id}, "text": "осмотреться"}}
+
+
+def _percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def _produce(count: int, rate: float, emit):
+    """count вызовов emit(i) с частотой rate в секунду (0 - без ограничения)"""
+    started = time.monotonic()
+    tasks = []
+    for i in range(count):
+        if rate:
+            delay = started + i / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(emit(i)))
+    await asyncio.gather(*tasks)
+
+
+async def bench_webhook(count: int, rate: float, concurrency: int) -> dict:
+    receiver = AsyncWebhookServer(host="127.0.0.1", port=0, secret_token=SECRET, max_queue=count)
+    await receiver.start()
+    url = f"http://127.0.0.1:{receiver.port}{receiver.path}"
+    sent: Dict[int, float] = {}
+    received: Dict[int, float] = {}
+    acks: List[float] = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def consume():
+        while len(received) < count:
+            for update in await receiver.get_updates():
+                received[update["update_id"]] = time.monotonic()
+
+    async with aiohttp.ClientSession(headers={SECRET_HEADER: SECRET}) as session:
+        async def emit(i: int):
+            update = dict(_update(i % 100), update_id=i)
+            async with limit:
+                sent[i] = time.monotonic()
+                async with session.post(url, json=update) as response:
+                    response.raise_for_status()
+                acks.append(time.monotonic() - sent[i])
+
+        consumer = asyncio.create_task(consume())
+        started = time.monotonic()
+        await _produce(count, rate, emit)
+        await consumer
+        elapsed = time.monotonic() - started
+    await receiver.stop()
+    return {"elapsed": elapsed, "latencies": [received[i] - sent[i] for i in sent], "acks": acks}
+
+
+async def bench_polling_async(count: int, rate: float) -> dict:
+    telegram = await FakeTelegram().start()
+    client = AsyncTelegramClient(telegram.token)
+    client.base_url = telegram.base_url
+    sent: Dict[int, float] = {}
+    received: Dict[int, float] = {}
+
+    async def consume():
+        while len(received) < count:
+            for update in await client.get_updates():
+                received[update["update_id"]] = time.monotonic()
+
+    async def emit(i: int):
+        created = time.monotonic()
+        update = await telegram.push(_update(i % 100))
+        sent[update["update_id"]] = created
+
+    consumer = asyncio.create_task(consume())
+    started = time.monotonic()
+    await _produce(count, rate, emit)
+    await consumer
+    elapsed = time.monotonic() - started
+    await client.close()
+    await telegram.stop()
+    return {"elapsed": elapsed, "latencies": [received[i] - sent[i] for i in sent]}
+
+
+async def bench_polling_sync(count: int, rate: float) -> dict:
+    telegram = await FakeTelegram().start()
+    client = TelegramClient(telegram.token)
+    client.base_url = telegram.base_url
+    sent: Dict[int, float] = {}
+    received: Dict[int, float] = {}
+
+    def consume():
+        # Как в run_sync_bot: запрос и пауза 1 с
+        while len(received) < count:
+            for update in client.get_updates():
+                received[update["update_id"]] = time.monotonic()
+            time.sleep(1)
+
+    async def emit(i: int):
+        created = time.monotonic()
+        update = await telegram.push(_update(i % 100))
+        sent[update["update_id"]] = created
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    started = time.monotonic()
+    await _produce(count, rate, emit)
+    await asyncio.to_thread(consumer.join)
+    elapsed = time.monotonic() - started
+    await telegram.stop()
+    return {"elapsed": elapsed, "latencies": [received[i] - sent[i] for i in sent]}
+
+
+async def run(args):
+    results = {
+        "webhook": await bench_webhook(args.updates, args.rate, args.concurrency),
+        "polling (async)": await bench_polling_async(args.updates, args.rate),
+    }
+    if not args.skip_sync:
+        results["polling (sync)"] = await bench_polling_sync(args.updates, args.rate)
+
+    print(f"{args.updates} обновлений, частота {args.rate or 'без ограничения'}/с")
+    print(f"{'режим':<16} {'обн./с':>8} {'задержка p50, мс':>17} {'p95, мс':>9} {'макс, мс':>9} {'ответ webhook p95, мс':>22}")
+    for mode, result in results.items():
+        latencies = [latency * 1000 for latency in result["latencies"]]
+        acks = [ack * 1000 for ack in result.get("acks", [])]
+        ack = f"{_percentile(acks, 0.95):.1f}" if acks else "-"
+        print(f"{mode:<16} {args.updates / result['elapsed']:>8.0f} {statistics.median(latencies):>17.1f} "
+              f"{_percentile(latencies, 0.95):>9.1f} {max(latencies):>9.1f} {ack:>22}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=500, help="обновлений в секунду, 0 - без ограничения")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных POST-запросов к webhook")
+    parser.add_argument("--skip-sync", action="store_true", help="не измерять синхронный опрос (он медленный)")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
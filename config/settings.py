@@ -1,9 +1,117 @@
 # ======== CONFIG ========
+import os
+import json
+
 TELEGRAM_TOKEN = "your_token"
+TELEGRAM_API_URL = "https://api.telegram.org"  # Адрес Bot API (локальный Bot API сервер или заменитель в нагрузочных тестах)
 OLLAMA_URL = "http://localhost/api/chat"
 OLLAMA_MODEL = "gpt-oss:20b"
 #OLLAMA_MODEL = "qwen3:8b"
+# Серверы Ollama: url (/api/chat), models - модели на сервере (пусто - любые), weight - относительная мощность.
+# Запрос идёт на сервер с наименьшим числом выполняемых запросов на единицу веса
+OLLAMA_BACKENDS = [
+    {"url": OLLAMA_URL, "models": [OLLAMA_MODEL], "weight": 1},
+]
+OLLAMA_STICKY_MAX_EXTRA = 1  # Ход остаётся на сервере чата (история в KV-кеше), пока там не больше чем на столько запросов больше, чем на самом свободном
 USE_OLLAMA = True
+OLLAMA_STRUCTURED_OUTPUT = True  # Передавать JSON Schema моделей в format (structured output, Ollama >= 0.5)
+OLLAMA_KEEP_ALIVE = "30m"  # Сколько модель остаётся загруженной после запроса
+OLLAMA_SESSION_MAX_TURNS = 6  # Сколько прошлых ходов чата передавать в запрос (0 - без истории)
+OLLAMA_SESSION_MAX_CHATS = 1000  # Сколько сессий чатов хранить в памяти
+OLLAMA_STREAM = True  # Потоковая генерация: предпросмотр ответа и досрочная остановка негодных ответов
+OLLAMA_STREAM_MAX_PREAMBLE = 200  # Сколько символов текста до начала JSON допускается
+STREAM_EDIT_INTERVAL = 1.5  # Минимальный интервал между правками сообщения с предпросмотром (секунды)
+
+# Проверка доступности Ollama и автомат защиты
+OLLAMA_HEALTH_CHECK_INTERVAL = 15  # Период фоновой проверки в секундах
+OLLAMA_HEALTH_TIMEOUT = 5  # Таймаут проверки в секундах
+OLLAMA_BREAKER_FAILURE_THRESHOLD = 3  # Сбоев подряд до отключения запросов
+OLLAMA_BREAKER_BACKOFF = 5  # Начальная пауза перед пробным запросом в секундах
+OLLAMA_BREAKER_MAX_BACKOFF = 300  # Максимальная пауза в секундах
+
+# Режим работы: "async" - asyncio (по умолчанию), "sync" - потоки (режим совместимости)
+RUNTIME_MODE = "async"
+TELEGRAM_POLL_TIMEOUT = 30  # Таймаут длинного опроса getUpdates в секундах
+# Отправка сообщений: очередь с ограничением частоты (лимиты Telegram - около 30 сообщений в секунду на бота и 1 в секунду в чат)
+TELEGRAM_MESSAGE_LIMIT = 4096  # Максимальная длина сообщения, длинные ответы делятся по строкам
+TELEGRAM_GLOBAL_RATE = 30  # Сообщений в секунду на всего бота
+TELEGRAM_CHAT_INTERVAL = 1.0  # Минимальный интервал между сообщениями в один чат, секунды
+TELEGRAM_SEND_WORKERS = 4  # Сколько запросов отправки выполняется одновременно
+TELEGRAM_SEND_MAX_ATTEMPTS = 5  # Попыток отправки при сбоях сети и ошибках 5xx
+TELEGRAM_SEND_BACKOFF = 1  # Пауза перед повтором в секундах, удваивается с каждой попыткой
+TELEGRAM_SEND_MAX_BACKOFF = 60
+# Получение обновлений: "polling" - длинный опрос getUpdates, "webhook" - Telegram сам присылает их встроенному серверу
+UPDATE_SOURCE = "polling"
+WEBHOOK_URL = ""  # Публичный HTTPS-адрес, который регистрируется в Telegram (ведёт на WEBHOOK_PORT и WEBHOOK_PATH)
+WEBHOOK_LISTEN_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET_TOKEN = ""  # Секрет, который Telegram передаёт в каждом запросе (пусто - без проверки)
+WEBHOOK_QUEUE_SIZE = 1000  # Сколько принятых обновлений может ждать обработки, дальше - 503 и повтор от Telegram
+# Журнал обновлений в БД: offset переживает перезапуск, повторно доставленное обновление получает сохранённый ответ
+UPDATE_JOURNAL_ENABLED = True
+PROCESSED_UPDATES_TTL = 86400  # Сколько секунд помнить обработанные обновления (Telegram хранит их сутки)
+ASYNC_MAX_CONCURRENT_UPDATES = 500  # Сколько обновлений одновременно в работе в асинхронном режиме
+
+# Очередь запросов к Ollama
+LLM_MAX_CONCURRENT = 1  # Одновременных генераций - сумма параллельных слотов (OLLAMA_NUM_PARALLEL) всех серверов
+LLM_MAX_QUEUE = 50  # Сколько запросов может ждать слота, дальше новые отклоняются
+LLM_QUEUE_NOTICE_AFTER = 5  # Через сколько секунд ожидания сообщить игроку его место в очереди
+
+# Параллельная обработка обновлений
+DISPATCHER_MAX_WORKERS = 4  # Сколько обновлений обрабатывается одновременно
+DISPATCHER_MAX_PENDING = 200  # Максимум обновлений в очереди, дальше опрос Telegram приостанавливается
+DISPATCHER_SHUTDOWN_TIMEOUT = 120  # Сколько секунд ждать завершения обработки при остановке
+# Несколько процессов: при WORKER_PROCESSES > 1 главный процесс только принимает обновления,
+# а обрабатывают их WORKER_PROCESSES процессов, каждый - свою часть чатов (по chat_id)
+WORKER_PROCESSES = 1
+WORKER_QUEUE_SIZE = 200  # Максимум обновлений в очереди одного процесса, дальше приём приостанавливается
+WORKER_RESTART_BACKOFF = 1  # Пауза перед перезапуском упавшего процесса, удваивается при падениях подряд
+WORKER_RESTART_MAX_BACKOFF = 60
+
+# Метрики в формате Prometheus на http://METRICS_LISTEN_HOST:METRICS_PORT/metrics (0 - отключены).
+# В режиме нескольких процессов обработчик i отдаёт свои метрики на METRICS_PORT + 1 + i
+METRICS_LISTEN_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Трассировка обновлений: дерево этапов каждого обновления в JSON Lines (пустой путь - не писать)
+TRACE_LOG_PATH = ""
+# Ход дольше SLOW_TURN_THRESHOLD секунд пишется в SLOW_TURN_LOG_PATH со сводкой
+# по промптам, попыткам Ollama и этапам (0 - журнал медленных ходов отключён)
+SLOW_TURN_THRESHOLD = 30
+SLOW_TURN_LOG_PATH = "slow_turns.jsonl"
+# Выборочный профилировщик обработки обновлений: интервал выборки стеков, секунды (0 - отключён).
+# Стеки пишутся при остановке в PROFILER_PATH ({pid} - номер процесса)
+PROFILER_INTERVAL = 0
+PROFILER_PATH = "profile-{pid}.folded"
+
+# Кеш ответов на одинаковые действия в одинаковом состоянии комнаты
+ACTION_CACHE_CATEGORIES = ("look", "inventory")  # Категории: "look", "inventory", "move", "take"; () - кеш отключён
+ACTION_CACHE_TTL = 600  # Сколько секунд хранить ответ
+ACTION_CACHE_MAX_ENTRIES = 5000
+
+# Простые действия (переход, взять предмет, инвентарь) решаются правилами без Ollama
+FAST_PATH_ENABLED = True
+
+# Пул заранее сгенерированных подземелий для /new без описания
+DUNGEON_POOL_SIZE = 5  # Сколько подземелий держать наготове (0 - пул отключён)
+DUNGEON_POOL_REFILL_INTERVAL = 60  # Не чаще одной фоновой генерации за столько секунд
+DUNGEON_POOL_IDLE_DELAY = 10  # Генерировать, только если столько секунд не было запросов игроков
+
+# База данных
+DB_PATH = "dnd.db"
+DB_BUSY_TIMEOUT = 30  # Сколько секунд ждать освобождения блокировки
+DB_CACHE_SIZE_KB = 16384  # Кеш страниц SQLite на соединение
+DB_SYNCHRONOUS = "NORMAL"  # В режиме WAL NORMAL безопасен при падении процесса
+# Формат сохранений: "msgpack+zlib", "msgpack", "json+zlib" или "json"
+DB_STATE_FORMAT = "msgpack+zlib"
+# Хранилище игр: "snapshot" - снимок игры целиком и журнал ходов, "normalized" -
+# отдельные таблицы игрока, комнат, выходов и содержимого с частичной загрузкой
+DB_BACKEND = "snapshot"
+# Кеш активных игр в памяти с отложенной записью
+STATE_CACHE_MAX_GAMES = 1000  # Сколько игр держать в памяти
+STATE_FLUSH_INTERVAL = 5  # Как часто (секунды) записывать изменённые игры в БД
+STATE_SNAPSHOT_INTERVAL = 20  # Полный снимок игры раз в столько действий, между ними - только журнал
 
 # DnD Game Constants
 RACES = ["Человек", "Эльф", "Дварф", "Тифлинг", "Полурослик"]
@@ -12,4 +120,20 @@ CLASSES = {
     "Маг": {"hit_die": 6, "items": ["Посох", "Книга заклинаний", "Мантия"]},
     "Разбойник": {"hit_die": 8, "items": ["Кинжал", "Лёгкий арбалет", "Кожаная броня"]},
     "Жрец": {"hit_die": 8, "items": ["Булава", "Священный символ", "Кольчуга"]}
-} 
+}
+
+# Любую настройку выше можно переопределить переменной окружения DND_<ИМЯ> (Docker, нагрузочные тесты):
+# значение разбирается как JSON (числа, списки, true/false), иначе берётся строкой.
+# Производные значения не пересчитываются: при DND_OLLAMA_URL задайте и DND_OLLAMA_BACKENDS
+def _override_from_env(prefix: str = "DND_"):
+    settings = globals()
+    for name in [name for name in settings if name.isupper()]:
+        value = os.environ.get(prefix + name)
+        if value is None:
+            continue
+        try:
+            settings[name] = json.loads(value)
+        except ValueError:
+            settings[name] = value
+
+_override_from_env()
@@ -1,36 +1,341 @@
+import time
+import json
 import sqlite3
-from typing import Optional
-from models import GameStateModel
+import logging
+import threading
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from models import GameStateModel, StateChange, apply_state_changes
+from database.serializers import (
+    encode_state,
+    decode_state,
+    encode_change,
+    decode_change,
+    decode_legacy_json,
+    resolve_format,
+)
+from database import normalized_store
+from services.tracing import span
+from config.settings import DB_PATH, DB_BUSY_TIMEOUT, DB_CACHE_SIZE_KB, DB_SYNCHRONOUS, DB_STATE_FORMAT, DB_BACKEND
 
-def init_db():
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+# Запросы - константы: sqlite3 кеширует подготовленные выражения по тексту запроса
+# game_state - снимки игр: state - сохранение с заголовком формата, state_json -
+# старые сохранения в JSON, seq - номер последнего действия, вошедшего в снимок.
+# action_log - журнал применённых изменений (StateChange) после снимков.
+SAVE_SNAPSHOT_SQL = "REPLACE INTO game_state (user_id, state, state_json, seq) VALUES (?, ?, NULL, ?)"
+# Снимок, включающий все записанные действия
+SAVE_STATE_SQL = ("REPLACE INTO game_state (user_id, state, state_json, seq) "
+                  "VALUES (?, ?, NULL, (SELECT COALESCE(MAX(seq), 0) FROM action_log WHERE user_id = ?))")
+LOAD_STATE_SQL = "SELECT state, state_json, seq FROM game_state WHERE user_id = ?"
+APPEND_ACTION_SQL = "REPLACE INTO action_log (user_id, seq, change) VALUES (?, ?, ?)"
+LOAD_ACTIONS_SQL = "SELECT seq, change FROM action_log WHERE user_id = ? AND seq > ? ORDER BY seq"
+# Заранее сгенерированные подземелья для /new без описания
+POOL_PUT_SQL = "INSERT INTO dungeon_pool (state, created_at) VALUES (?, ?)"
+POOL_OLDEST_SQL = "SELECT id, state FROM dungeon_pool ORDER BY id LIMIT 1"
+POOL_DELETE_SQL = "DELETE FROM dungeon_pool WHERE id = ?"
+POOL_SIZE_SQL = "SELECT COUNT(*) FROM dungeon_pool"
+LAST_ACTION_SQL = "SELECT COALESCE(MAX(seq), 0) FROM action_log WHERE user_id = ?"
+LOAD_HISTORY_SQL = "SELECT seq, change FROM action_log WHERE user_id = ? ORDER BY seq DESC LIMIT ?"
+# Обновления Telegram: offset следующего getUpdates и журнал принятых обновлений.
+# Пока обновление не обработано, в журнале лежит оно само (update), после - ответ (reply)
+LOAD_OFFSET_SQL = "SELECT next_offset FROM update_offset WHERE id = 0"
+SAVE_OFFSET_SQL = "REPLACE INTO update_offset (id, next_offset) VALUES (0, ?)"
+ACCEPT_UPDATE_SQL = ("INSERT OR IGNORE INTO processed_updates (update_id, chat_id, update_json, received_at) "
+                     "VALUES (?, ?, ?, ?)")
+LOAD_UPDATE_SQL = "SELECT done, reply FROM processed_updates WHERE update_id = ?"
+FINISH_UPDATE_SQL = "UPDATE processed_updates SET done = 1, reply = ?, update_json = NULL WHERE update_id = ?"
+LOAD_PENDING_UPDATES_SQL = "SELECT update_json FROM processed_updates WHERE done = 0 ORDER BY update_id"
+PRUNE_UPDATES_SQL = "DELETE FROM processed_updates WHERE done = 1 AND received_at < ?"
+
+_db_path = DB_PATH
+_state_format = resolve_format(DB_STATE_FORMAT)
+# "snapshot" - снимок игры целиком и журнал, "normalized" - таблицы normalized_store
+_backend = DB_BACKEND
+
+
+class LoadedGame(NamedTuple):
+    """Игра, восстановленная из снимка и журнала"""
+    state: GameStateModel
+    # Номер последнего применённого действия
+    seq: int
+    # Сколько действий журнала применено поверх снимка
+    replayed: int
+
+# У каждого потока своё постоянное соединение
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+# Меняется при закрытии соединений, чтобы потоки открыли новые
+_generation = 0
+
+def _configure(conn: sqlite3.Connection):
+    """Настройка соединения: WAL, синхронизация, кеш и ожидание блокировок"""
+    # WAL: чтения не блокируются записью, записи не ждут fsync всего журнала
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+def get_connection() -> sqlite3.Connection:
+    """Постоянное соединение текущего потока"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.generation != _generation:
+        conn = sqlite3.connect(_db_path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False, cached_statements=256)
+        _configure(conn)
+        _local.conn = conn
+        _local.generation = _generation
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_connections():
+    """Закрытие всех соединений (при остановке бота)"""
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка закрытия соединения с БД: {e}")
+        _connections.clear()
+
+def init_db(db_path: Optional[str] = None, state_format: Optional[str] = None, backend: Optional[str] = None):
     """Инициализация базы данных"""
-    conn = sqlite3.connect("dnd.db")
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS game_state (
-            user_id INTEGER PRIMARY KEY,
-            state_json TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+    global _db_path, _state_format, _backend
+    if db_path is not None and db_path != _db_path:
+        close_connections()
+        _db_path = db_path
+    if state_format is not None:
+        _state_format = resolve_format(state_format)
+    if backend is not None:
+        _backend = backend
+    if _backend not in ("snapshot", "normalized"):
+        raise ValueError(f"Неизвестное хранилище игр: {_backend}")
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS game_state (
+                user_id INTEGER PRIMARY KEY,
+                state BLOB,
+                state_json TEXT,
+                seq INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # Базы старых версий: новых колонок ещё нет
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(game_state)")]
+        if "state" not in columns:
+            conn.execute("ALTER TABLE game_state ADD COLUMN state BLOB")
+        if "seq" not in columns:
+            conn.execute("ALTER TABLE game_state ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS action_log (
+                user_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                change BLOB NOT NULL,
+                PRIMARY KEY (user_id, seq)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dungeon_pool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                state BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS update_offset (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                next_offset INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed_updates (
+                update_id INTEGER PRIMARY KEY,
+                chat_id INTEGER,
+                update_json TEXT,
+                reply TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                received_at REAL NOT NULL
+            )
+        """)
+        if _backend == "normalized":
+            normalized_store.init_schema(conn)
+
+def replays_action_log() -> bool:
+    """Восстанавливается ли игра из снимка и журнала (иначе журнал - только история)"""
+    return _backend == "snapshot"
 
 def save_state(user_id: int, state: GameStateModel):
-    """Сохранение состояния игры пользователя"""
-    conn = sqlite3.connect("dnd.db")
-    c = conn.cursor()
-    c.execute("REPLACE INTO game_state (user_id, state_json) VALUES (?, ?)",
-              (user_id, state.json(ensure_ascii=False)))
-    conn.commit()
-    conn.close()
+    """Сохранение игры пользователя целиком"""
+    conn = get_connection()
+    with conn:
+        if _backend == "normalized":
+            normalized_store.save_game(conn, user_id, state, last_action_seq(user_id))
+        else:
+            conn.execute(SAVE_STATE_SQL, (user_id, encode_state(state, _state_format), user_id))
+
+def write_games(snapshots: Iterable[Tuple[int, GameStateModel, int]], actions: Iterable[Tuple[int, int, StateChange]]):
+    """Запись действий (user_id, seq, изменения) и снимков (user_id, состояние, seq) одной транзакцией"""
+    actions = list(actions)
+    conn = get_connection()
+    with conn:
+        conn.executemany(APPEND_ACTION_SQL, ((user_id, seq, encode_change(changes, _state_format))
+                                             for user_id, seq, changes in actions))
+        if _backend == "normalized":
+            # Снимок уже содержит ходы до своего seq (новая игра и её первые ходы - в одной записи)
+            snapshot_seqs = {}
+            for user_id, state, seq in snapshots:
+                normalized_store.save_game(conn, user_id, state, seq)
+                snapshot_seqs[user_id] = seq
+            # Остальные ходы меняют только затронутые строки
+            for user_id, seq, changes in actions:
+                if seq <= snapshot_seqs.get(user_id, -1):
+                    continue
+                if not normalized_store.apply_change(conn, user_id, seq, changes):
+                    logger.warning(f"[DB] Ход {seq} игры {user_id} пропущен: игры нет в хранилище")
+        else:
+            conn.executemany(SAVE_SNAPSHOT_SQL, ((user_id, encode_state(state, _state_format), seq)
+                                                 for user_id, state, seq in snapshots))
+
+def _load_snapshot(conn: sqlite3.Connection, user_id: int) -> Optional[LoadedGame]:
+    """Загрузка игры из снимка и действий журнала после него"""
+    row = conn.execute(LOAD_STATE_SQL, (user_id,)).fetchone()
+    if not row:
+        return None
+    blob, legacy_json, seq = row
+    if blob is not None:
+        state = decode_state(blob)
+    elif legacy_json is not None:
+        # Старое сохранение: разбираем JSON и сразу перезаписываем в текущем формате
+        state = decode_legacy_json(legacy_json)
+        with conn:
+            conn.execute(SAVE_SNAPSHOT_SQL, (user_id, encode_state(state, _state_format), seq))
+        logger.info(f"[DB] Сохранение {user_id} переведено в формат {_state_format}")
+    else:
+        return None
+
+    replayed = 0
+    for seq, change in conn.execute(LOAD_ACTIONS_SQL, (user_id, seq)).fetchall():
+        state = apply_state_changes(state, decode_change(change))
+        replayed += 1
+    return LoadedGame(state, seq, replayed)
+
+def _load_normalized(conn: sqlite3.Connection, user_id: int) -> Optional[LoadedGame]:
+    """Загрузка игры из таблиц; игры, сохранённые снимком до переключения хранилища, переносятся"""
+    loaded = normalized_store.load_game(conn, user_id)
+    if loaded is not None:
+        return LoadedGame(loaded[0], loaded[1], 0)
+    game = _load_snapshot(conn, user_id)
+    if game is not None:
+        with conn:
+            normalized_store.save_game(conn, user_id, game.state, game.seq)
+        logger.info(f"[DB] Игра {user_id} перенесена в нормализованное хранилище")
+        game = LoadedGame(game.state, game.seq, 0)
+    return game
+
+@span("db.load_game")
+def load_game(user_id: int) -> Optional[LoadedGame]:
+    """Загрузка игры целиком"""
+    conn = get_connection()
+    if _backend == "normalized":
+        return _load_normalized(conn, user_id)
+    return _load_snapshot(conn, user_id)
 
 def load_state(user_id: int) -> Optional[GameStateModel]:
     """Загрузка состояния игры пользователя"""
-    conn = sqlite3.connect("dnd.db")
-    c = conn.cursor()
-    c.execute("SELECT state_json FROM game_state WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return GameStateModel.parse_raw(row[0])
-    return None 
\ No newline at end of file
+    game = load_game(user_id)
+    return game.state if game else None
+
+@span("db.load_view")
+def load_view(user_id: int) -> Optional[GameStateModel]:
+    """Загрузка для показа: в нормализованном хранилище - только игрок и текущая комната.
+
+    Результат нельзя сохранять: в нём может не быть остальных комнат.
+    """
+    if _backend == "normalized":
+        state = normalized_store.load_view(get_connection(), user_id)
+        if state is not None:
+            return state
+    return load_state(user_id)
+
+def last_action_seq(user_id: int) -> int:
+    """Номер последнего записанного действия пользователя"""
+    return get_connection().execute(LAST_ACTION_SQL, (user_id,)).fetchone()[0]
+
+@span("db.load_history")
+def load_history(user_id: int, limit: int = 20) -> List[Tuple[int, StateChange]]:
+    """Последние limit действий пользователя (seq, изменения) в хронологическом порядке"""
+    rows = get_connection().execute(LOAD_HISTORY_SQL, (user_id, limit)).fetchall()
+    return [(seq, decode_change(change)) for seq, change in reversed(rows)]
+
+def pool_put(state: GameStateModel):
+    """Добавление подземелья в пул"""
+    conn = get_connection()
+    with conn:
+        conn.execute(POOL_PUT_SQL, (encode_state(state, _state_format), time.time()))
+
+@span("db.pool_take")
+def pool_take() -> Optional[GameStateModel]:
+    """Извлечение самого старого подземелья из пула"""
+    conn = get_connection()
+    while True:
+        with conn:
+            row = conn.execute(POOL_OLDEST_SQL).fetchone()
+            if row is None:
+                return None
+            # Подземелье могли забрать из другого потока - тогда берём следующее
+            if conn.execute(POOL_DELETE_SQL, (row[0],)).rowcount:
+                return decode_state(row[1])
+
+def pool_size() -> int:
+    """Число подземелий в пуле"""
+    return get_connection().execute(POOL_SIZE_SQL).fetchone()[0]
+
+def load_update_offset() -> int:
+    """Сохранённый offset следующего getUpdates (0 - ещё не сохранялся)"""
+    row = get_connection().execute(LOAD_OFFSET_SQL).fetchone()
+    return row[0] if row else 0
+
+def accept_updates(updates: List[dict], chat_ids: List[Optional[int]],
+                   offset: Optional[int] = None) -> List[Optional[Tuple[bool, Optional[str]]]]:
+    """Запись принятых обновлений и offset одной транзакцией.
+
+    Для каждого обновления возвращает None, если оно новое, иначе
+    (обработано ли, сохранённый ответ) из журнала.
+    """
+    conn = get_connection()
+    now = time.time()
+    results = []
+    with conn:
+        for update, chat_id in zip(updates, chat_ids):
+            inserted = conn.execute(ACCEPT_UPDATE_SQL, (update["update_id"], chat_id,
+                                                        json.dumps(update, ensure_ascii=False), now)).rowcount
+            if inserted:
+                results.append(None)
+            else:
+                done, reply = conn.execute(LOAD_UPDATE_SQL, (update["update_id"],)).fetchone()
+                results.append((bool(done), reply))
+        if offset is not None:
+            conn.execute(SAVE_OFFSET_SQL, (offset,))
+    return results
+
+@span("db.finish_update")
+def finish_update(update_id: int, reply: Optional[str]):
+    """Отметка обновления обработанным вместе с ответом на него"""
+    conn = get_connection()
+    with conn:
+        conn.execute(FINISH_UPDATE_SQL, (reply, update_id))
+
+def load_pending_updates() -> List[dict]:
+    """Принятые, но не обработанные обновления (после падения) по порядку"""
+    return [json.loads(row[0]) for row in get_connection().execute(LOAD_PENDING_UPDATES_SQL)]
+
+def prune_processed_updates(before: float) -> int:
+    """Удаление обработанных обновлений, принятых раньше before"""
+    conn = get_connection()
+    with conn:
+        return conn.execute(PRUNE_UPDATES_SQL, (before,)).rowcount
@@ -0,0 +1,270 @@
+"""Нормализованное хранение игр: игрок, комнаты, выходы и содержимое - отдельные таблицы.
+
+Функции работают с переданным соединением и не управляют транзакциями -
+это делает db_manager. Изменения хода (StateChange) применяются точечными
+UPDATE/INSERT/DELETE в той же последовательности, что и apply_state_changes,
+поэтому стоимость хода и частичной загрузки не зависит от числа комнат.
+"""
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+from models import CharacterModel, DungeonModel, ExitModel, GameStateModel, RoomModel, StateChange
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS games (
+        user_id INTEGER PRIMARY KEY,
+        adventure_description TEXT,
+        last_action_description TEXT,
+        story_context TEXT,
+        is_adventure_completed INTEGER NOT NULL DEFAULT 0,
+        seq INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS players (
+        user_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        race TEXT NOT NULL,
+        cls TEXT NOT NULL,
+        hp INTEGER NOT NULL,
+        location TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rooms (
+        user_id INTEGER NOT NULL,
+        room_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        description TEXT NOT NULL,
+        PRIMARY KEY (user_id, room_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS exits (
+        user_id INTEGER NOT NULL,
+        room_id TEXT NOT NULL,
+        exit_key TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        target_room TEXT NOT NULL,
+        name TEXT NOT NULL,
+        is_hidden INTEGER NOT NULL DEFAULT 0,
+        is_blocked INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, room_id, exit_key)
+    )
+    """,
+    # Списки игрока и комнат: room_id = '' и kind = 'inventory' - инвентарь игрока,
+    # иначе kind - 'items', 'enemies' или 'friendly_npcs' комнаты room_id
+    """
+    CREATE TABLE IF NOT EXISTS contents (
+        user_id INTEGER NOT NULL,
+        room_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (user_id, room_id, kind, position)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS exits_by_target ON exits (user_id, room_id, target_room, position)",
+    "CREATE INDEX IF NOT EXISTS contents_by_value ON contents (user_id, room_id, kind, value, position)",
+)
+TABLES = ("games", "players", "rooms", "exits", "contents")
+PLAYER_ROOM = ""
+INVENTORY = "inventory"
+ROOM_LISTS = ("items", "enemies", "friendly_npcs")
+
+INSERT_GAME_SQL = ("INSERT INTO games (user_id, adventure_description, last_action_description, story_context, "
+                   "is_adventure_completed, seq) VALUES (?, ?, ?, ?, ?, ?)")
+INSERT_PLAYER_SQL = "INSERT INTO players (user_id, name, race, cls, hp, location) VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_ROOM_SQL = "INSERT INTO rooms (user_id, room_id, position, description) VALUES (?, ?, ?, ?)"
+INSERT_EXIT_SQL = ("INSERT INTO exits (user_id, room_id, exit_key, position, target_room, name, is_hidden, is_blocked) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+INSERT_CONTENT_SQL = "INSERT INTO contents (user_id, room_id, kind, position, value) VALUES (?, ?, ?, ?, ?)"
+
+LOAD_GAME_SQL = ("SELECT adventure_description, last_action_description, story_context, is_adventure_completed, seq "
+                 "FROM games WHERE user_id = ?")
+LOAD_PLAYER_SQL = "SELECT name, race, cls, hp, location FROM players WHERE user_id = ?"
+LOAD_ROOMS_SQL = "SELECT room_id, description FROM rooms WHERE user_id = ? ORDER BY position"
+LOAD_ROOM_SQL = "SELECT room_id, description FROM rooms WHERE user_id = ? AND room_id = ?"
+LOAD_EXITS_SQL = ("SELECT room_id, exit_key, target_room, name, is_hidden, is_blocked FROM exits "
+                  "WHERE user_id = ? ORDER BY room_id, position")
+LOAD_ROOM_EXITS_SQL = ("SELECT room_id, exit_key, target_room, name, is_hidden, is_blocked FROM exits "
+                       "WHERE user_id = ? AND room_id = ? ORDER BY position")
+LOAD_CONTENTS_SQL = "SELECT room_id, kind, value FROM contents WHERE user_id = ? ORDER BY room_id, kind, position"
+LOAD_ROOM_CONTENTS_SQL = ("SELECT room_id, kind, value FROM contents WHERE user_id = ? AND room_id IN (?, ?) "
+                          "ORDER BY room_id, kind, position")
+
+HAS_CONTENT_SQL = "SELECT 1 FROM contents WHERE user_id = ? AND room_id = ? AND kind = ? AND value = ? LIMIT 1"
+ADD_CONTENT_SQL = ("INSERT INTO contents (user_id, room_id, kind, position, value) "
+                   "SELECT ?1, ?2, ?3, COALESCE(MAX(position), -1) + 1, ?4 FROM contents "
+                   "WHERE user_id = ?1 AND room_id = ?2 AND kind = ?3")
+REMOVE_CONTENT_SQL = ("DELETE FROM contents WHERE user_id = ?1 AND room_id = ?2 AND kind = ?3 AND position = "
+                      "(SELECT MIN(position) FROM contents WHERE user_id = ?1 AND room_id = ?2 AND kind = ?3 AND value = ?4)")
+UPDATE_EXIT_SQL = ("UPDATE exits SET {flag} = ?4 WHERE user_id = ?1 AND room_id = ?2 AND position = "
+                   "(SELECT MIN(position) FROM exits WHERE user_id = ?1 AND room_id = ?2 AND target_room = ?3)")
+UPDATE_HP_SQL = "UPDATE players SET hp = hp + ? WHERE user_id = ?"
+LOAD_HP_SQL = "SELECT hp FROM players WHERE user_id = ?"
+UPDATE_LOCATION_SQL = "UPDATE players SET location = ? WHERE user_id = ?"
+LOAD_LOCATION_SQL = "SELECT location FROM players WHERE user_id = ?"
+UPDATE_DESCRIPTION_SQL = "UPDATE rooms SET description = ? WHERE user_id = ? AND room_id = ?"
+UPDATE_GAME_SQL = "UPDATE games SET {fields} WHERE user_id = ?"
+
+# Изменения выходов: поле StateChange -> (колонка, новое значение)
+EXIT_CHANGES = (
+    ("room_exits_reveal", "is_hidden", 0),
+    ("room_exits_hide", "is_hidden", 1),
+    ("room_exits_block", "is_blocked", 1),
+    ("room_exits_unblock", "is_blocked", 0),
+)
+
+
+def init_schema(conn: sqlite3.Connection):
+    """Создание таблиц нормализованного хранения"""
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+
+def delete_game(conn: sqlite3.Connection, user_id: int):
+    """Удаление всех строк игры пользователя"""
+    for table in TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+
+
+def save_game(conn: sqlite3.Connection, user_id: int, state: GameStateModel, seq: int):
+    """Полная запись игры вместо прежней"""
+    delete_game(conn, user_id)
+    conn.execute(INSERT_GAME_SQL, (user_id, state.adventure_description, state.last_action_description,
+                                   state.story_context, int(state.is_adventure_completed), seq))
+    player = state.player
+    conn.execute(INSERT_PLAYER_SQL, (user_id, player.name, player.race, player.cls, player.hp, player.location))
+    contents = [(user_id, PLAYER_ROOM, INVENTORY, position, item) for position, item in enumerate(player.inventory)]
+    rooms, exits = [], []
+    for room_position, (room_id, room) in enumerate(state.dungeon.rooms.items()):
+        rooms.append((user_id, room_id, room_position, room.description))
+        for position, (exit_key, exit_info) in enumerate(room.exits.items()):
+            exits.append((user_id, room_id, exit_key, position, exit_info.target_room, exit_info.name,
+                          int(exit_info.is_hidden), int(exit_info.is_blocked)))
+        for kind in ROOM_LISTS:
+            contents.extend((user_id, room_id, kind, position, value) for position, value in enumerate(getattr(room, kind)))
+    conn.executemany(INSERT_ROOM_SQL, rooms)
+    conn.executemany(INSERT_EXIT_SQL, exits)
+    conn.executemany(INSERT_CONTENT_SQL, contents)
+
+
+def _update_list(conn: sqlite3.Connection, user_id: int, room_id: str, kind: str,
+                 add: Optional[List[str]], remove: Optional[List[str]]):
+    """Добавление отсутствующих значений и удаление одного вхождения каждого удаляемого"""
+    for value in add or []:
+        if conn.execute(HAS_CONTENT_SQL, (user_id, room_id, kind, value)).fetchone() is None:
+            conn.execute(ADD_CONTENT_SQL, (user_id, room_id, kind, value))
+    for value in remove or []:
+        conn.execute(REMOVE_CONTENT_SQL, (user_id, room_id, kind, value))
+
+
+def apply_change(conn: sqlite3.Connection, user_id: int, seq: int, changes: StateChange) -> bool:
+    """Применение хода к сохранённой игре точечными изменениями строк; False - игры нет в таблицах"""
+    row = conn.execute(LOAD_LOCATION_SQL, (user_id,)).fetchone()
+    if row is None:
+        return False
+    game = {"seq": seq}
+    if changes.ignore_action:
+        game["last_action_description"] = changes.last_action_description or "Ничего не происходит."
+        _update_game(conn, user_id, game)
+        return True
+
+    if changes.player_hp_change is not None:
+        conn.execute(UPDATE_HP_SQL, (changes.player_hp_change, user_id))
+        hp = conn.execute(LOAD_HP_SQL, (user_id,)).fetchone()[0]
+        # Проверяем смерть персонажа
+        if hp <= 0:
+            game["is_adventure_completed"] = 1
+
+    if changes.player_location_change is not None:
+        conn.execute(UPDATE_LOCATION_SQL, (changes.player_location_change, user_id))
+        location = changes.player_location_change
+    else:
+        location = row[0]
+
+    _update_list(conn, user_id, PLAYER_ROOM, INVENTORY, changes.inventory_add, changes.inventory_remove)
+    _update_list(conn, user_id, location, "items", changes.room_items_add, changes.room_items_remove)
+    _update_list(conn, user_id, location, "enemies", changes.room_enemies_add, changes.room_enemies_remove)
+    if changes.room_description_change:
+        conn.execute(UPDATE_DESCRIPTION_SQL, (changes.room_description_change, user_id, location))
+    _update_list(conn, user_id, location, "friendly_npcs", changes.room_friendly_npcs_add, changes.room_friendly_npcs_remove)
+
+    for field, flag, value in EXIT_CHANGES:
+        for target_room in getattr(changes, field) or []:
+            conn.execute(UPDATE_EXIT_SQL.format(flag=flag), (user_id, location, target_room, value))
+
+    if changes.is_adventure_completed is not None:
+        game["is_adventure_completed"] = int(changes.is_adventure_completed)
+    if changes.last_action_description:
+        game["last_action_description"] = changes.last_action_description
+    _update_game(conn, user_id, game)
+    return True
+
+
+def _update_game(conn: sqlite3.Connection, user_id: int, fields: Dict[str, object]):
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    conn.execute(UPDATE_GAME_SQL.format(fields=assignments), (*fields.values(), user_id))
+
+
+def _build_rooms(room_rows, exit_rows, content_rows) -> Tuple[Dict[str, RoomModel], List[str]]:
+    """Комнаты из строк таблиц и инвентарь игрока"""
+    lists: Dict[Tuple[str, str], List[str]] = {}
+    for room_id, kind, value in content_rows:
+        lists.setdefault((room_id, kind), []).append(value)
+    exits: Dict[str, Dict[str, ExitModel]] = {}
+    for room_id, exit_key, target_room, name, is_hidden, is_blocked in exit_rows:
+        exits.setdefault(room_id, {})[exit_key] = ExitModel.construct(
+            target_room=target_room, name=name, is_hidden=bool(is_hidden), is_blocked=bool(is_blocked))
+    rooms = {
+        room_id: RoomModel.construct(
+            description=description,
+            items=lists.get((room_id, "items"), []),
+            enemies=lists.get((room_id, "enemies"), []),
+            friendly_npcs=lists.get((room_id, "friendly_npcs"), []),
+            exits=exits.get(room_id, {}),
+        )
+        for room_id, description in room_rows
+    }
+    return rooms, lists.get((PLAYER_ROOM, INVENTORY), [])
+
+
+def _load(conn: sqlite3.Connection, user_id: int, view: bool) -> Optional[Tuple[GameStateModel, int]]:
+    game = conn.execute(LOAD_GAME_SQL, (user_id,)).fetchone()
+    player = conn.execute(LOAD_PLAYER_SQL, (user_id,)).fetchone()
+    if game is None or player is None:
+        return None
+    adventure_description, last_action_description, story_context, is_completed, seq = game
+    name, race, cls, hp, location = player
+    if view:
+        room_rows = conn.execute(LOAD_ROOM_SQL, (user_id, location)).fetchall()
+        exit_rows = conn.execute(LOAD_ROOM_EXITS_SQL, (user_id, location)).fetchall()
+        content_rows = conn.execute(LOAD_ROOM_CONTENTS_SQL, (user_id, PLAYER_ROOM, location)).fetchall()
+    else:
+        room_rows = conn.execute(LOAD_ROOMS_SQL, (user_id,)).fetchall()
+        exit_rows = conn.execute(LOAD_EXITS_SQL, (user_id,)).fetchall()
+        content_rows = conn.execute(LOAD_CONTENTS_SQL, (user_id,)).fetchall()
+    rooms, inventory = _build_rooms(room_rows, exit_rows, content_rows)
+    # Строки записаны из проверенных моделей - повторная валидация не нужна
+    state = GameStateModel.construct(
+        # Поле cls совпадает с параметром construct(), а модель игрока маленькая - обычная проверка
+        player=CharacterModel(name=name, race=race, cls=cls, hp=hp, inventory=inventory, location=location),
+        dungeon=DungeonModel.construct(rooms=rooms),
+        adventure_description=adventure_description,
+        last_action_description=last_action_description,
+        story_context=story_context,
+        is_adventure_completed=bool(is_completed),
+    )
+    return state, seq
+
+
+def load_game(conn: sqlite3.Connection, user_id: int) -> Optional[Tuple[GameStateModel, int]]:
+    """Полная загрузка игры и номер последнего применённого действия"""
+    return _load(conn, user_id, view=False)
+
+
+def load_view(conn: sqlite3.Connection, user_id: int) -> Optional[GameStateModel]:
+    """Частичная загрузка: игрок и только текущая комната (для показа, не для сохранения)"""
+    loaded = _load(conn, user_id, view=True)
+    return loaded[0] if loaded else None
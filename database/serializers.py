@@ -0,0 +1,113 @@
+import json
+import zlib
+import logging
+from typing import Callable, Dict, Tuple
+from models import GameStateModel, StateChange
+
+try:
+    import msgpack
+except ImportError:  # msgpack необязателен: без него используется JSON со сжатием
+    msgpack = None
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+# Заголовок сохранения: MAGIC, версия схемы состояния, код формата
+MAGIC = b"GS"
+HEADER_SIZE = len(MAGIC) + 2
+
+# Версия структуры GameStateModel в сохранениях. При несовместимом изменении
+# моделей увеличьте её и добавьте в STATE_MIGRATIONS функцию перевода словаря
+# состояния из предыдущей версии.
+STATE_SCHEMA_VERSION = 1
+STATE_MIGRATIONS: Dict[int, Callable[[dict], dict]] = {}
+# То же для записей журнала действий (StateChange)
+CHANGE_MIGRATIONS: Dict[int, Callable[[dict], dict]] = {}
+
+
+def _json_dumps(data: dict) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _json_loads(payload: bytes) -> dict:
+    return json.loads(payload)
+
+
+def _compressed(dumps: Callable[[dict], bytes], loads: Callable[[bytes], dict], level: int = 6):
+    return (lambda data: zlib.compress(dumps(data), level)), (lambda payload: loads(zlib.decompress(payload)))
+
+
+# Форматы: имя -> (код в заголовке, кодирование, декодирование)
+FORMATS: Dict[str, Tuple[int, Callable[[dict], bytes], Callable[[bytes], dict]]] = {
+    "json": (1, _json_dumps, _json_loads),
+    "json+zlib": (2, *_compressed(_json_dumps, _json_loads)),
+}
+if msgpack is not None:
+    FORMATS["msgpack"] = (3, lambda data: msgpack.packb(data, use_bin_type=True),
+                          lambda payload: msgpack.unpackb(payload, raw=False))
+    FORMATS["msgpack+zlib"] = (4, *_compressed(FORMATS["msgpack"][1], FORMATS["msgpack"][2]))
+_FORMATS_BY_CODE = {code: (name, loads) for name, (code, _, loads) in FORMATS.items()}
+
+
+def resolve_format(name: str) -> str:
+    """Имя доступного формата; msgpack без установленного пакета заменяется на json"""
+    if name in FORMATS:
+        return name
+    fallback = name.replace("msgpack", "json")
+    if fallback in FORMATS:
+        logger.warning(f"[DB] Формат {name} недоступен (не установлен msgpack), используется {fallback}")
+        return fallback
+    raise ValueError(f"Неизвестный формат сохранения: {name}")
+
+
+def _encode(data: dict, fmt: str) -> bytes:
+    code, dumps, _ = FORMATS[fmt]
+    return MAGIC + bytes((STATE_SCHEMA_VERSION, code)) + dumps(data)
+
+
+def _decode(blob: bytes) -> Tuple[int, dict]:
+    """Версия схемы и данные сохранения любого известного формата"""
+    if blob[:len(MAGIC)] != MAGIC or len(blob) < HEADER_SIZE:
+        raise ValueError("Повреждённое сохранение: нет заголовка")
+    version, code = blob[len(MAGIC)], blob[len(MAGIC) + 1]
+    if code not in _FORMATS_BY_CODE:
+        raise ValueError(f"Сохранение в неизвестном или недоступном формате {code}")
+    if version > STATE_SCHEMA_VERSION:
+        raise ValueError(f"Сохранение новой версии {version}, поддерживается до {STATE_SCHEMA_VERSION}")
+    _, loads = _FORMATS_BY_CODE[code]
+    return version, loads(blob[HEADER_SIZE:])
+
+
+def encode_state(state: GameStateModel, fmt: str) -> bytes:
+    """Сохранение: заголовок и состояние в формате fmt"""
+    return _encode(state.dict(), fmt)
+
+
+def decode_state(blob: bytes) -> GameStateModel:
+    """Разбор сохранения любого известного формата и версии"""
+    version, data = _decode(blob)
+    return GameStateModel.parse_obj(_migrate(data, version, STATE_MIGRATIONS))
+
+
+def encode_change(changes: StateChange, fmt: str) -> bytes:
+    """Запись журнала действий: только заданные поля, без сжатия - записи маленькие"""
+    return _encode(changes.dict(exclude_none=True), fmt.replace("+zlib", ""))
+
+
+def decode_change(blob: bytes) -> StateChange:
+    """Разбор записи журнала действий"""
+    version, data = _decode(blob)
+    return StateChange.parse_obj(_migrate(data, version, CHANGE_MIGRATIONS))
+
+
+def decode_legacy_json(text: str) -> GameStateModel:
+    """Разбор старого сохранения - JSON-текста без заголовка (версия схемы 1)"""
+    return GameStateModel.parse_obj(_migrate(json.loads(text), 1, STATE_MIGRATIONS))
+
+
+def _migrate(data: dict, version: int, migrations: Dict[int, Callable[[dict], dict]]) -> dict:
+    """Перевод данных версии version в текущую"""
+    while version < STATE_SCHEMA_VERSION:
+        data = migrations[version](data)
+        version += 1
+    return data
@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from models import GameStateModel, StateChange
+from database import db_manager
+from services.metrics import Counter, STAGE_SECONDS
+from services.tracing import span
+from config.settings import STATE_CACHE_MAX_GAMES, STATE_FLUSH_INTERVAL, STATE_SNAPSHOT_INTERVAL
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+STATE_CACHE_REQUESTS = Counter("state_cache_requests_total", "Загрузки игр из кеша", ("result",))
+STATE_CACHE_WRITES = Counter("state_cache_writes_total", "Записи игр из кеша в БД", ("reason",))
+STATE_LOG_RECORDS = Counter("state_log_records_total", "Записи в БД по типу", ("kind",))
+
+
+class _Entry:
+    __slots__ = ("state", "seq", "pending", "since_snapshot", "needs_snapshot", "version")
+
+    def __init__(self, state: GameStateModel, seq: int, since_snapshot: int = 0, needs_snapshot: bool = False):
+        self.state = state
+        # Номер последнего действия, применённого к state
+        self.seq = seq
+        # Действия (seq, изменения), ещё не записанные в журнал
+        self.pending: List[Tuple[int, StateChange]] = []
+        # Действий после последнего записанного снимка
+        self.since_snapshot = since_snapshot
+        # Состояние изменено не действием (новая игра, персонаж) - нужен снимок
+        self.needs_snapshot = needs_snapshot
+        # Растёт при каждом таком изменении: флаг сбрасывается, только если игру не меняли во время записи
+        self.version = 0
+
+    @property
+    def dirty(self) -> bool:
+        return self.needs_snapshot or bool(self.pending)
+
+
+class GameStateCache:
+    """LRU активных игр с отложенной записью в БД.
+
+    load() отдаёт живой объект из памяти без разбора сохранения. Ход игрока
+    (save_action) добавляет в журнал только его StateChange, а полный снимок
+    игры пишется раз в snapshot_interval действий или после изменений не
+    через действие (save). Фоновый поток раз в flush_interval записывает
+    накопленное одной транзакцией; вытесняемые изменённые игры записываются
+    сразу. Пока поток не запущен, всё пишется в БД сразу.
+    """
+
+    def __init__(self, max_games: int = STATE_CACHE_MAX_GAMES, flush_interval: float = STATE_FLUSH_INTERVAL,
+                 snapshot_interval: int = STATE_SNAPSHOT_INTERVAL):
+        self.max_games = max_games
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # Вытесненные, но ещё не записанные игры - load() берёт их отсюда, а не из БД
+        self._evicting: Dict[int, _Entry] = {}
+        self._lock = threading.Lock()
+        # Упорядочивает записи в БД: запись старой версии не может обогнать новую
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self, chat_id: int) -> Optional[GameStateModel]:
+        """Игра чата из памяти или из БД"""
+        entry = self._get(chat_id)
+        if entry is not None:
+            STATE_CACHE_REQUESTS.inc(result="hit")
+            return entry.state
+
+        STATE_CACHE_REQUESTS.inc(result="miss")
+        game = db_manager.load_game(chat_id)
+        if game is None:
+            return None
+        with self._lock:
+            # Пока читали БД, игру могли сохранить - она новее прочитанной
+            entry = self._entries.get(chat_id) or self._evicting.get(chat_id)
+            if entry is not None:
+                return entry.state
+            evicted = self._put(chat_id, _Entry(game.state, game.seq, since_snapshot=game.replayed))
+        self._write_evicted(evicted)
+        return game.state
+
+    def load_view(self, chat_id: int) -> Optional[GameStateModel]:
+        """Игра чата только для показа: из памяти или частичной загрузкой без кеширования"""
+        entry = self._get(chat_id)
+        if entry is not None:
+            STATE_CACHE_REQUESTS.inc(result="hit")
+            return entry.state
+        if db_manager.replays_action_log():
+            return self.load(chat_id)
+        STATE_CACHE_REQUESTS.inc(result="view")
+        return db_manager.load_view(chat_id)
+
+    def save(self, chat_id: int, state: GameStateModel):
+        """Сохранение игры чата целиком (снимок - при следующей записи)"""
+        with self._lock:
+            entry = self._entries.get(chat_id) or self._evicting.get(chat_id)
+        # Игры нет в кеше (новая игра) - продолжаем нумерацию действий журнала
+        last_seq = db_manager.last_action_seq(chat_id) if entry is None else 0
+        with self._lock:
+            entry = self._entries.get(chat_id) or self._evicting.get(chat_id)
+            if entry is None:
+                evicted = self._put(chat_id, _Entry(state, last_seq, needs_snapshot=True))
+            else:
+                entry.state = state
+                entry.needs_snapshot = True
+                entry.version += 1
+                evicted = self._touch(chat_id, entry)
+        self._after_save(chat_id, evicted)
+
+    def save_action(self, chat_id: int, state: GameStateModel, changes: StateChange):
+        """Сохранение хода: state получено применением changes к текущей игре чата"""
+        with self._lock:
+            entry = self._entries.get(chat_id) or self._evicting.get(chat_id)
+            if entry is not None:
+                entry.state = state
+                entry.seq += 1
+                entry.pending.append((entry.seq, changes))
+                entry.since_snapshot += 1
+                evicted = self._touch(chat_id, entry)
+        if entry is None:
+            # Игра не из кеша - журнал не к чему привязать
+            self.save(chat_id, state)
+            return
+        self._after_save(chat_id, evicted)
+
+    def in_memory(self, chat_id: int, saving: bool = False) -> bool:
+        """Обойдётся ли load() (при saving - и save_action()) без обращения к БД.
+
+        Ответ - подсказка для event loop: игру могут вытеснить сразу после
+        проверки, и тогда вызов всё же прочитает или запишет БД.
+        """
+        if saving and self._thread is None:
+            return False
+        with self._lock:
+            return chat_id in self._entries
+
+    def _get(self, chat_id: int) -> Optional[_Entry]:
+        """Запись кеша с возвратом вытесняемой игры обратно в LRU"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                self._entries.move_to_end(chat_id)
+                return entry
+            entry = self._evicting.get(chat_id)
+            if entry is None:
+                return None
+            evicted = self._touch(chat_id, entry)
+        self._write_evicted(evicted)
+        return entry
+
+    def _touch(self, chat_id: int, entry: _Entry) -> List[int]:
+        """Перемещение игры в конец LRU под self._lock (в том числе из вытесняемых)"""
+        if chat_id in self._entries:
+            self._entries.move_to_end(chat_id)
+            return []
+        self._evicting.pop(chat_id, None)
+        return self._put(chat_id, entry)
+
+    def _put(self, chat_id: int, entry: _Entry) -> List[int]:
+        """Добавление в LRU под self._lock; возвращает вытесненные изменённые игры"""
+        self._entries[chat_id] = entry
+        self._entries.move_to_end(chat_id)
+        evicted = []
+        while len(self._entries) > self.max_games:
+            old_id, old_entry = self._entries.popitem(last=False)
+            if old_entry.dirty:
+                self._evicting[old_id] = old_entry
+                evicted.append(old_id)
+        return evicted
+
+    def _after_save(self, chat_id: int, evicted: List[int]):
+        self._write_evicted(evicted)
+        if self._thread is None:
+            self._write([chat_id], reason="direct")
+
+    def _write_evicted(self, evicted: List[int]):
+        """Запись вытесненных изменённых игр (вне self._lock)"""
+        if evicted:
+            self._write(evicted, reason="evict", evicting=True)
+
+    def _write(self, chat_ids: List[int], reason: str, evicting: bool = False) -> int:
+        """Запись накопленных действий и нужных снимков игр chat_ids"""
+        # Нормализованному хранилищу периодические снимки не нужны: ход пишется точечно
+        periodic = db_manager.replays_action_log()
+        with self._write_lock:
+            batch = []
+            with self._lock:
+                source = self._evicting if evicting else self._entries
+                for chat_id in chat_ids:
+                    entry = source.get(chat_id)
+                    # Вытесняемую игру могли вернуть в кеш - её запишет следующая запись кеша
+                    if entry is None:
+                        continue
+                    if not entry.dirty:
+                        # Уже записана общей записью кеша
+                        if evicting:
+                            del self._evicting[chat_id]
+                        continue
+                    snapshot = entry.needs_snapshot or (periodic and entry.since_snapshot >= self.snapshot_interval)
+                    batch.append((chat_id, entry, entry.state, entry.seq, list(entry.pending), snapshot, entry.version))
+            if not batch:
+                return 0
+
+            actions = [(chat_id, seq, changes) for chat_id, _, _, _, pending, _, _ in batch for seq, changes in pending]
+            snapshots = [(chat_id, state, seq) for chat_id, _, state, seq, _, snapshot, _ in batch if snapshot]
+            with STAGE_SECONDS.time(stage="db_write"):
+                db_manager.write_games(snapshots, actions)
+            STATE_CACHE_WRITES.inc(len(batch), reason=reason)
+            STATE_LOG_RECORDS.inc(len(actions), kind="action")
+            STATE_LOG_RECORDS.inc(len(snapshots), kind="snapshot")
+
+            with self._lock:
+                for chat_id, entry, _, seq, pending, snapshot, version in batch:
+                    del entry.pending[:len(pending)]
+                    if snapshot:
+                        entry.since_snapshot = len(entry.pending)
+                        if entry.version == version:
+                            entry.needs_snapshot = False
+                    if evicting and self._evicting.get(chat_id) is entry:
+                        del self._evicting[chat_id]
+        return len(batch)
+
+    def flush(self) -> int:
+        """Запись всех изменённых игр одной транзакцией; возвращает число записанных"""
+        with self._lock:
+            chat_ids = [chat_id for chat_id, entry in self._entries.items() if entry.dirty]
+        return self._write(chat_ids, reason="flush") if chat_ids else 0
+
+    def clear(self):
+        """Запись изменений и очистка кеша"""
+        self.flush()
+        with self._lock:
+            self._entries.clear()
+
+    def start(self):
+        """Запуск фоновой записи"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="state-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка фоновой записи с записью всех изменений"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[StateCache] Ошибка записи игр в БД: {e}")
+
+
+# Общий кеш игр процесса
+state_cache = GameStateCache()
+
+
+@STAGE_SECONDS.time(stage="load_state")
+@span("load_state")
+def load_state(chat_id: int) -> Optional[GameStateModel]:
+    """Загрузка состояния игры через кеш"""
+    return state_cache.load(chat_id)
+
+
+@STAGE_SECONDS.time(stage="load_state")
+@span("load_view")
+def load_view(chat_id: int) -> Optional[GameStateModel]:
+    """Загрузка игры только для показа (игрок и текущая комната); сохранять результат нельзя"""
+    return state_cache.load_view(chat_id)
+
+
+@STAGE_SECONDS.time(stage="save_state")
+@span("save_state")
+def save_state(chat_id: int, state: GameStateModel):
+    """Сохранение состояния игры через кеш"""
+    state_cache.save(chat_id, state)
+
+
+@STAGE_SECONDS.time(stage="save_state")
+@span("save_action")
+def save_action(chat_id: int, state: GameStateModel, changes: StateChange):
+    """Сохранение хода игрока через кеш: в БД попадает только changes"""
+    state_cache.save_action(chat_id, state, changes)
+
+
+async def load_state_async(chat_id: int) -> Optional[GameStateModel]:
+    """load_state для event loop: игра из памяти - сразу, промах кеша читает БД в потоке"""
+    if state_cache.in_memory(chat_id):
+        return load_state(chat_id)
+    return await asyncio.to_thread(load_state, chat_id)
+
+
+async def save_action_async(chat_id: int, state: GameStateModel, changes: StateChange):
+    """save_action для event loop: запись в БД (без фоновой записи или при вытеснении) - в потоке"""
+    if state_cache.in_memory(chat_id, saving=True):
+        save_action(chat_id, state, changes)
+    else:
+        await asyncio.to_thread(save_action, chat_id, state, changes)
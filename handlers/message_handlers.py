@@ -1,5 +1,42 @@
-from services.dnd_service import generate_character, generate_dungeon, process_player_action
-from database.db_manager import save_state, load_state
+import asyncio
+from services.dnd_service import (
+    generate_character,
+    generate_dungeon,
+    generate_dungeon_async,
+    process_player_action,
+    process_player_action_async,
+)
+from services.ollama_service import OllamaUnavailableError
+from services.llm_scheduler import LlmQueueFullError
+from services.progressive_reply import ProgressiveReply, AsyncProgressiveReply
+from services.ollama_session import chat_sessions
+from services.dungeon_pool import dungeon_pool
+from services.tracing import span
+from config.settings import OLLAMA_STREAM
+from database.state_cache import (
+    save_state,
+    save_action,
+    load_state,
+    load_view,
+    load_state_async,
+    save_action_async,
+)
+
+GM_UNAVAILABLE_MESSAGE = "🛑 Ведущий сейчас недоступен. Попробуйте повторить чуть позже."
+GM_BUSY_MESSAGE = "⏳ Ведущий перегружен, слишком много игроков ждут ответа. Попробуйте повторить чуть позже."
+
+def _queue_notice(position: int) -> str:
+    return f"⏳ Ведущий занят другими игроками. Вы {position}-й в очереди, ответ скоро будет."
+
+def _queue_notifier(chat_id: int, telegram_client):
+    """Сообщение игроку о месте в очереди к ведущему"""
+    return lambda position: telegram_client.send_message(chat_id, _queue_notice(position))
+
+def _queue_notifier_async(chat_id: int, telegram_client):
+    """Асинхронное сообщение игроку о месте в очереди к ведущему"""
+    async def notify(position: int):
+        await telegram_client.send_message(chat_id, _queue_notice(position))
+    return notify
 
 def get_room_description(state):
     """Получение описания текущей комнаты"""
@@ -43,11 +80,12 @@ def handle_start_command(chat_id: int, telegram_client) -> str:
     """Обработчик команды /start"""
     return "🎲 Привет! Я DnD бот.\n\nКоманды:\n/new [описание приключения] — начать новую игру\n/character [имя] — создать персонажа\n/status — показать статус\n/story — история приключения\n\nПросто пишите действия на русском языке!"
 
-def handle_new_game_command(chat_id: int, adventure_prompt: str, telegram_client) -> str:
-    """Обработчик команды /new"""
-    dungeon = generate_dungeon(adventure_prompt)
+def _new_game_response(chat_id: int, dungeon) -> str:
+    """Сохранение нового подземелья и ответ на /new"""
     if dungeon:
         save_state(chat_id, dungeon)
+        # История ходов прошлой игры новой игре не нужна
+        chat_sessions.reset(chat_id)
         adventure_info = get_adventure_info(dungeon)
         status = get_player_status(dungeon)
         room_desc = get_room_description(dungeon)
@@ -55,6 +93,40 @@ def handle_new_game_command(chat_id: int, adventure_prompt: str, telegram_client
     else:
         return "❌ Ошибка генерации подземелья."
 
+@span("handle_new_game")
+def handle_new_game_command(chat_id: int, adventure_prompt: str, telegram_client) -> str:
+    """Обработчик команды /new"""
+    # Без описания приключения подходит готовое подземелье из пула
+    dungeon = dungeon_pool.take() if not adventure_prompt else None
+    if dungeon is not None:
+        return _new_game_response(chat_id, dungeon)
+    try:
+        dungeon = generate_dungeon(adventure_prompt, chat_id=chat_id,
+                                   on_queued=_queue_notifier(chat_id, telegram_client))
+    except OllamaUnavailableError:
+        return GM_UNAVAILABLE_MESSAGE
+    except LlmQueueFullError:
+        return GM_BUSY_MESSAGE
+    return _new_game_response(chat_id, dungeon)
+
+@span("handle_new_game")
+async def handle_new_game_command_async(chat_id: int, adventure_prompt: str, telegram_client) -> str:
+    """Асинхронный обработчик команды /new"""
+    # Без описания приключения подходит готовое подземелье из пула (он хранится в SQLite)
+    dungeon = await asyncio.to_thread(dungeon_pool.take) if not adventure_prompt else None
+    if dungeon is not None:
+        return await asyncio.to_thread(_new_game_response, chat_id, dungeon)
+    try:
+        dungeon = await generate_dungeon_async(adventure_prompt, chat_id=chat_id,
+                                               on_queued=_queue_notifier_async(chat_id, telegram_client))
+    except OllamaUnavailableError:
+        return GM_UNAVAILABLE_MESSAGE
+    except LlmQueueFullError:
+        return GM_BUSY_MESSAGE
+    # Новая игра записывается в БД сразу - не в потоке event loop
+    return await asyncio.to_thread(_new_game_response, chat_id, dungeon)
+
+@span("handle_character")
 def handle_character_command(chat_id: int, text: str, telegram_client) -> str:
     """Обработчик команды /character"""
     parts = text.split(maxsplit=1)
@@ -71,9 +143,10 @@ def handle_character_command(chat_id: int, text: str, telegram_client) -> str:
     else:
         return "❌ Сначала начните игру: /new"
 
+@span("handle_status")
 def handle_status_command(chat_id: int, telegram_client) -> str:
     """Обработчик команды /status"""
-    state = load_state(chat_id)
+    state = load_view(chat_id)
     if state:
         adventure_info = get_adventure_info(state)
         status = get_player_status(state)
@@ -92,9 +165,10 @@ def handle_status_command(chat_id: int, telegram_client) -> str:
     else:
         return "❌ Сначала начните игру: /new"
 
+@span("handle_story")
 def handle_story_command(chat_id: int, telegram_client) -> str:
     """Обработчик команды /story"""
-    state = load_state(chat_id)
+    state = load_view(chat_id)
     if state:
         story = "📚 История приключения:\n\n"
         
@@ -122,16 +196,15 @@ def handle_story_command(chat_id: int, telegram_client) -> str:
     else:
         return "❌ Сначала начните игру: /new"
 
-def handle_player_action(chat_id: int, text: str, telegram_client) -> str:
-    """Обработчик действий игрока"""
-    state = load_state(chat_id)
-    if not state:
-        return "❌ Сначала начните игру: /new"
+def _player_action_response(chat_id: int, text: str, updated_state, changes) -> str:
+    """Сохранение результата действия и ответ игроку"""
+    if updated_state:
+        save_action(chat_id, updated_state, changes)
+    return _action_response(text, updated_state)
 
-    updated_state = process_player_action(state, text)
+def _action_response(text: str, updated_state) -> str:
+    """Ответ игроку на действие"""
     if updated_state:
-        save_state(chat_id, updated_state)
-        
         # Формируем ответ
         response = f"🎯 Действие: {text}\n\n"
         
@@ -156,6 +229,62 @@ def handle_player_action(chat_id: int, text: str, telegram_client) -> str:
     else:
         return "❌ Ошибка обработки действия."
 
+@span("handle_player_action")
+def handle_player_action(chat_id: int, text: str, telegram_client) -> str:
+    """Обработчик действий игрока"""
+    state = load_state(chat_id)
+    if not state:
+        return "❌ Сначала начните игру: /new"
+
+    # Описание действия показывается игроку ещё во время генерации
+    reply = ProgressiveReply(telegram_client, chat_id, header=f"🎯 Действие: {text}\n\n📝 ") if OLLAMA_STREAM else None
+    try:
+        updated_state, changes = process_player_action(state, text, on_partial=reply.update if reply else None,
+                                                       chat_id=chat_id,
+                                                       on_queued=_queue_notifier(chat_id, telegram_client))
+    except OllamaUnavailableError:
+        return GM_UNAVAILABLE_MESSAGE
+    except LlmQueueFullError:
+        return GM_BUSY_MESSAGE
+    response = _player_action_response(chat_id, text, updated_state, changes)
+    if reply and reply.finish(response):
+        # Итоговый ответ уже на месте предпросмотра
+        return ""
+    return response
+
+@span("handle_player_action")
+async def handle_player_action_async(chat_id: int, text: str, telegram_client) -> str:
+    """Асинхронный обработчик действий игрока"""
+    state = await load_state_async(chat_id)
+    if not state:
+        return "❌ Сначала начните игру: /new"
+
+    # Описание действия показывается игроку ещё во время генерации
+    reply = AsyncProgressiveReply(telegram_client, chat_id, header=f"🎯 Действие: {text}\n\n📝 ") if OLLAMA_STREAM else None
+    try:
+        updated_state, changes = await process_player_action_async(state, text,
+                                                                   on_partial=reply.update if reply else None,
+                                                                   chat_id=chat_id,
+                                                                   on_queued=_queue_notifier_async(chat_id, telegram_client))
+    except OllamaUnavailableError:
+        return GM_UNAVAILABLE_MESSAGE
+    except LlmQueueFullError:
+        return GM_BUSY_MESSAGE
+    if updated_state:
+        await save_action_async(chat_id, updated_state, changes)
+    response = _action_response(text, updated_state)
+    if reply and await reply.finish(response):
+        # Итоговый ответ уже на месте предпросмотра
+        return ""
+    return response
+
+def _new_game_prompt(text: str):
+    """Описание приключения из команды /new"""
+    if len(text) < 5 or text[5:].strip() == "":
+        return None
+    return text[5:].strip()
+
+@span("process_message")
 def process_message(update: dict, telegram_client) -> str:
     """Основной обработчик сообщений"""
     message = update.get("message", {})
@@ -169,10 +298,7 @@ def process_message(update: dict, telegram_client) -> str:
     if text.startswith("/start"):
         return handle_start_command(chat_id, telegram_client)
     elif text.startswith("/new"):
-        if len(text) < 5 or text[5:].strip() == "":
-            return handle_new_game_command(chat_id, None, telegram_client)
-        else:
-            return handle_new_game_command(chat_id, text[5:].strip(), telegram_client)
+        return handle_new_game_command(chat_id, _new_game_prompt(text), telegram_client)
     elif text.startswith("/character"):
         return handle_character_command(chat_id, text, telegram_client)
     elif text.startswith("/status"):
@@ -180,4 +306,29 @@ def process_message(update: dict, telegram_client) -> str:
     elif text.startswith("/story"):
         return handle_story_command(chat_id, telegram_client)
     else:
-        return handle_player_action(chat_id, text, telegram_client) 
\ No newline at end of file
+        return handle_player_action(chat_id, text, telegram_client) 
+
+@span("process_message")
+async def process_message_async(update: dict, telegram_client) -> str:
+    """Основной обработчик сообщений для асинхронного режима"""
+    message = update.get("message", {})
+    chat_id = message.get("chat", {}).get("id")
+    text = message.get("text", "")
+
+    if not chat_id or not text:
+        return ""
+
+    # Запросы к Ollama выполняются асинхронно, а команды, которые читают и пишут БД, - в потоке,
+    # чтобы не останавливать event loop
+    if text.startswith("/start"):
+        return handle_start_command(chat_id, telegram_client)
+    elif text.startswith("/new"):
+        return await handle_new_game_command_async(chat_id, _new_game_prompt(text), telegram_client)
+    elif text.startswith("/character"):
+        return await asyncio.to_thread(handle_character_command, chat_id, text, telegram_client)
+    elif text.startswith("/status"):
+        return await asyncio.to_thread(handle_status_command, chat_id, telegram_client)
+    elif text.startswith("/story"):
+        return await asyncio.to_thread(handle_story_command, chat_id, telegram_client)
+    else:
+        return await handle_player_action_async(chat_id, text, telegram_client)
@@ -1,7 +1,7 @@
 from telegram import Update
 from telegram.ext import CallbackContext
 from services.dnd_service import generate_character, generate_dungeon, process_player_action
-from database.db_manager import save_state, load_state
+from database.state_cache import save_state, save_action, load_state
 
 def start_cmd(update: Update, context: CallbackContext):
     """Обработчик команды /start"""
@@ -36,9 +36,9 @@ def player_action(update: Update, context: CallbackContext):
         update.message.reply_text("Сначала начните игру: /new")
         return
 
-    updated_state = process_player_action(state, update.message.text)
+    updated_state, changes = process_player_action(state, update.message.text)
     if updated_state:
-        save_state(update.effective_user.id, updated_state)
+        save_action(update.effective_user.id, updated_state, changes)
         update.message.reply_text("Действие выполнено!")
     else:
         update.message.reply_text("Ошибка обработки действия.") 
\ No newline at end of file
@@ -1,9 +1,46 @@
 import time
+import queue
+import signal
+import asyncio
 import logging
-from services.telegram_client import TelegramClient
-from handlers.message_handlers import process_message
-from config.settings import TELEGRAM_TOKEN
-from database.db_manager import init_db
+import multiprocessing
+from typing import Optional
+from services.telegram_client import TelegramClient, AsyncTelegramClient
+from services.send_queue import SendQueue, AsyncSendQueue
+from services.dispatcher import UpdateDispatcher, AsyncUpdateDispatcher, get_update_chat_id
+from services.webhook_server import WebhookServer, AsyncWebhookServer
+from services.update_journal import update_journal
+from services.supervisor import Supervisor, spawn_context, worker_share
+from services.metrics_server import MetricsServer
+from services.tracing import trace_update, profiler
+from services.llm_scheduler import llm_scheduler
+from services.ollama_backends import ollama_backends, shared_load_table, reset_worker_load
+from services.ollama_service import (
+    close_async_session,
+    start_health_monitor,
+    stop_health_monitor,
+    log_generation_stats,
+)
+from handlers.message_handlers import process_message, process_message_async
+from config.settings import (
+    TELEGRAM_TOKEN,
+    TELEGRAM_GLOBAL_RATE,
+    RUNTIME_MODE,
+    UPDATE_SOURCE,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET_TOKEN,
+    ASYNC_MAX_CONCURRENT_UPDATES,
+    DISPATCHER_MAX_WORKERS,
+    DISPATCHER_MAX_PENDING,
+    DISPATCHER_SHUTDOWN_TIMEOUT,
+    WORKER_PROCESSES,
+    LLM_MAX_CONCURRENT,
+    METRICS_PORT,
+)
+from database.db_manager import init_db, close_connections
+from database.state_cache import state_cache
+from services.dungeon_pool import dungeon_pool
+from services.action_cache import log_cache_stats
 
 # Настройка логирования
 logging.basicConfig(
@@ -14,43 +51,379 @@ logging.basicConfig(
 # Получаем логгер для main модуля
 logger = logging.getLogger(__name__)
 
-def main():
-    """Основная функция запуска бота"""
-    # Инициализация базы данных
-    init_db()
-    
+def handle_update(update: dict, client: SendQueue):
+    """Обработка одного обновления и постановка ответа в очередь отправки"""
+    with trace_update(update):
+        try:
+            response = process_message(update, client)
+        except Exception:
+            # Обновление, на котором обработка падает, после перезапуска не повторяем
+            update_journal.finish(update, None)
+            raise
+        update_journal.finish(update, response)
+
+        if response:
+            # Отправка ответа
+            chat_id = get_update_chat_id(update)
+            if chat_id:
+                client.send_message(chat_id, response)
+
+async def handle_update_async(update: dict, client: AsyncSendQueue):
+    """Асинхронная обработка одного обновления и отправка ответа"""
+    with trace_update(update):
+        try:
+            response = await process_message_async(update, client)
+        except Exception:
+            await asyncio.to_thread(update_journal.finish, update, None)
+            raise
+        # Журнал - запись в SQLite, не в потоке event loop
+        await asyncio.to_thread(update_journal.finish, update, response)
+
+        if response:
+            chat_id = get_update_chat_id(update)
+            if chat_id:
+                await client.send_message(chat_id, response)
+
+def _accept_updates(updates: list, offset, send_reply) -> list:
+    """Запись обновлений в журнал: новые возвращаются, на повторно доставленные уходит сохранённый ответ"""
+    updates, replies = update_journal.accept(updates, offset)
+    for chat_id, reply in replies:
+        send_reply(chat_id, reply)
+    return updates
+
+async def _accept_updates_async(updates: list, offset, outbound: AsyncSendQueue) -> list:
+    """Асинхронный _accept_updates"""
+    updates, replies = await asyncio.to_thread(update_journal.accept, updates, offset)
+    for chat_id, reply in replies:
+        await outbound.send_message(chat_id, reply)
+    return updates
+
+def _stop_on_sigterm(signum, frame):
+    """SIGTERM (docker stop) останавливает бота так же, как Ctrl+C"""
+    raise KeyboardInterrupt
+
+def _start_webhook(client: TelegramClient) -> WebhookServer:
+    """Запуск приёма обновлений по webhook и его регистрация в Telegram"""
+    receiver = WebhookServer()
+    receiver.start()
+    if WEBHOOK_URL:
+        client.set_webhook(WEBHOOK_URL, WEBHOOK_SECRET_TOKEN)
+    else:
+        logger.warning("WEBHOOK_URL не задан, webhook должен быть зарегистрирован в Telegram заранее")
+    return receiver
+
+async def _start_webhook_async(client: AsyncTelegramClient) -> AsyncWebhookServer:
+    """Асинхронный _start_webhook"""
+    receiver = AsyncWebhookServer()
+    await receiver.start()
+    if WEBHOOK_URL:
+        await client.set_webhook(WEBHOOK_URL, WEBHOOK_SECRET_TOKEN)
+    else:
+        logger.warning("WEBHOOK_URL не задан, webhook должен быть зарегистрирован в Telegram заранее")
+    return receiver
+
+def run_sync_bot():
+    """Синхронный режим (режим совместимости): опрос Telegram или webhook и пул потоков"""
+    signal.signal(signal.SIGTERM, _stop_on_sigterm)
+
     # Создание Telegram клиента
     client = TelegramClient(TELEGRAM_TOKEN)
-    
-    logger.info("Бот запущен...")
+    if UPDATE_SOURCE == "webhook":
+        receiver = _start_webhook(client)
+    else:
+        receiver = None
+        # Пока установлен webhook, getUpdates не работает
+        client.delete_webhook()
+    # Ответы отправляются фоновыми потоками с учётом лимитов Telegram, обработчик их не ждёт
+    outbound = SendQueue(client)
+    outbound.start()
+
+    # Обновления разных чатов обрабатываются параллельно, одного чата - по порядку
+    dispatcher = UpdateDispatcher(
+        lambda update: handle_update(update, outbound),
+        max_workers=DISPATCHER_MAX_WORKERS,
+        max_pending=DISPATCHER_MAX_PENDING
+    )
+
+    logger.info("Бот запущен (синхронный режим)...")
+    # Обновления, принятые до падения, но не обработанные
+    for update in update_journal.restore(client if receiver is None else None):
+        dispatcher.submit(update)
     logger.info("Ожидание сообщений...")
-    
+
     # Основной цикл бота
     while True:
         try:
             # Получение обновлений
-            updates = client.get_updates()
-            
-            # Обработка каждого обновления
+            if receiver is not None:
+                # Обновления уже приняты встроенным сервером, ждём только новые
+                updates = receiver.get_updates()
+            else:
+                updates = client.get_updates()
+            # offset сохраняется вместе с принятыми обновлениями
+            updates = _accept_updates(updates, client.offset if receiver is None else None, outbound.send_message)
+
+            # Передача обновлений диспетчеру
             for update in updates:
-                response = process_message(update, client)
-                
-                if response:
-                    # Отправка ответа
-                    message = update.get("message", {})
-                    chat_id = message.get("chat", {}).get("id")
-                    if chat_id:
-                        client.send_message(chat_id, response)
-            
+                dispatcher.submit(update)
+
             # Небольшая пауза между запросами
-            time.sleep(1)
-            
+            if receiver is None:
+                time.sleep(1)
+
         except KeyboardInterrupt:
+            logger.info("Остановка бота, ожидание обработки принятых сообщений...")
+            if receiver is not None:
+                # Подтверждённые Telegram обновления повторно не придут - обрабатываем их
+                receiver.stop()
+                for update in _accept_updates(receiver.get_updates(timeout=0), None, outbound.send_message):
+                    dispatcher.submit(update)
+            dispatcher.shutdown(timeout=DISPATCHER_SHUTDOWN_TIMEOUT)
+            outbound.stop(timeout=DISPATCHER_SHUTDOWN_TIMEOUT)
             logger.info("Бот остановлен.")
             break
         except Exception as e:
             logger.error(f"Ошибка в основном цикле: {e}")
             time.sleep(5)  # Пауза при ошибке
 
+async def run_async_bot():
+    """Асинхронный режим: длинный опрос или webhook, запросы к Ollama и отправка в одном event loop"""
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    client = AsyncTelegramClient(TELEGRAM_TOKEN)
+    if UPDATE_SOURCE == "webhook":
+        receiver = await _start_webhook_async(client)
+    else:
+        receiver = None
+        # Пока установлен webhook, getUpdates не работает
+        await client.delete_webhook()
+    outbound = AsyncSendQueue(client)
+    outbound.start()
+    dispatcher = AsyncUpdateDispatcher(
+        lambda update: handle_update_async(update, outbound),
+        max_concurrent=ASYNC_MAX_CONCURRENT_UPDATES,
+        max_pending=DISPATCHER_MAX_PENDING
+    )
+
+    logger.info("Бот запущен (асинхронный режим)...")
+    for update in await asyncio.to_thread(update_journal.restore, client if receiver is None else None):
+        await dispatcher.submit(update)
+    logger.info("Ожидание сообщений...")
+
+    try:
+        while True:
+            try:
+                # Длинный опрос и webhook сами ждут новых сообщений, пауза не нужна
+                updates = await (receiver.get_updates() if receiver is not None else client.get_updates())
+                updates = await _accept_updates_async(updates, client.offset if receiver is None else None, outbound)
+                for update in updates:
+                    await dispatcher.submit(update)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка в основном цикле: {e}")
+                await asyncio.sleep(5)  # Пауза при ошибке
+    except asyncio.CancelledError:
+        logger.info("Остановка бота, ожидание обработки принятых сообщений...")
+    finally:
+        if receiver is not None:
+            # Подтверждённые Telegram обновления повторно не придут - обрабатываем их
+            await receiver.stop()
+            for update in await _accept_updates_async(receiver.get_pending(), None, outbound):
+                await dispatcher.submit(update)
+        await dispatcher.shutdown(timeout=DISPATCHER_SHUTDOWN_TIMEOUT)
+        await outbound.stop(timeout=DISPATCHER_SHUTDOWN_TIMEOUT)
+        await client.close()
+        await close_async_session()
+        logger.info("Бот остановлен.")
+
+def _read_inbox(inbox) -> tuple:
+    """Следующее сообщение главного процесса; None - пора остановиться"""
+    while True:
+        try:
+            return inbox.get(timeout=1)
+        except queue.Empty:
+            # Главный процесс убит и остановить обработчик уже не сможет
+            if not multiprocessing.parent_process().is_alive():
+                return None
+
+def _run_worker_sync(inbox):
+    """Обработка обновлений из очереди главного процесса пулом потоков"""
+    client = TelegramClient(TELEGRAM_TOKEN)
+    # Лимит Telegram общий для бота - делим его между процессами
+    outbound = SendQueue(client, global_rate=TELEGRAM_GLOBAL_RATE / WORKER_PROCESSES)
+    outbound.start()
+    dispatcher = UpdateDispatcher(
+        lambda update: handle_update(update, outbound),
+        max_workers=DISPATCHER_MAX_WORKERS,
+        max_pending=DISPATCHER_MAX_PENDING
+    )
+    while True:
+        item = _read_inbox(inbox)
+        if item is None:
+            break
+        if item[0] == "update":
+            dispatcher.submit(item[1])
+        else:
+            outbound.send_message(item[1], item[2])
+    dispatcher.shutdown(timeout=DISPATCHER_SHUTDOWN_TIMEOUT)
+    outbound.stop(timeout=DISPATCHER_SHUTDOWN_TIMEOUT)
+
+async def _run_worker_async(inbox):
+    """Обработка обновлений из очереди главного процесса в event loop"""
+    client = AsyncTelegramClient(TELEGRAM_TOKEN)
+    outbound = AsyncSendQueue(client, global_rate=TELEGRAM_GLOBAL_RATE / WORKER_PROCESSES)
+    outbound.start()
+    dispatcher = AsyncUpdateDispatcher(
+        lambda update: handle_update_async(update, outbound),
+        max_concurrent=ASYNC_MAX_CONCURRENT_UPDATES,
+        max_pending=DISPATCHER_MAX_PENDING
+    )
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, _read_inbox, inbox)
+            if item is None:
+                break
+            if item[0] == "update":
+                await dispatcher.submit(item[1])
+            else:
+                await outbound.send_message(item[1], item[2])
+    finally:
+        await dispatcher.shutdown(timeout=DISPATCHER_SHUTDOWN_TIMEOUT)
+        await outbound.stop(timeout=DISPATCHER_SHUTDOWN_TIMEOUT)
+        await client.close()
+        await close_async_session()
+
+def run_worker(index: int, inbox, backend_load):
+    """Процесс-обработчик: обновления своей части чатов из очереди главного процесса"""
+    # Ctrl+C получает вся группа процессов, а останавливает обработчики главный процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Слоты Ollama общие для бота - у процесса своя доля, а загрузку серверов видят все процессы
+    llm_scheduler.max_concurrent = worker_share(LLM_MAX_CONCURRENT, index, WORKER_PROCESSES)
+    ollama_backends.share_load(backend_load, index)
+    # Пул подземелий общий (в БД), пополняет его один процесс
+    _start_services(dungeons=index == 0)
+    metrics = _start_metrics(METRICS_PORT + 1 + index)
+    try:
+        if RUNTIME_MODE == "sync":
+            _run_worker_sync(inbox)
+        else:
+            asyncio.run(_run_worker_async(inbox))
+    finally:
+        _stop_metrics(metrics)
+        _stop_services()
+
+def run_sharded_bot():
+    """Несколько процессов: здесь только приём обновлений, обработка - в WORKER_PROCESSES процессах по chat_id"""
+    signal.signal(signal.SIGTERM, _stop_on_sigterm)
+
+    client = TelegramClient(TELEGRAM_TOKEN)
+    if UPDATE_SOURCE == "webhook":
+        receiver = _start_webhook(client)
+    else:
+        receiver = None
+        client.delete_webhook()
+    if LLM_MAX_CONCURRENT < WORKER_PROCESSES:
+        logger.warning(f"LLM_MAX_CONCURRENT ({LLM_MAX_CONCURRENT}) меньше WORKER_PROCESSES ({WORKER_PROCESSES}): "
+                       f"у каждого процесса будет один слот, всего генераций - до {WORKER_PROCESSES}")
+    backends = len(ollama_backends.backends)
+    backend_load = shared_load_table(spawn_context(), WORKER_PROCESSES, backends)
+    supervisor = Supervisor(run_worker, shared=(backend_load,),
+                            before_spawn=lambda index: reset_worker_load(backend_load, index, backends))
+    supervisor.start()
+
+    logger.info(f"Бот запущен (процессов-обработчиков: {WORKER_PROCESSES})...")
+    for update in update_journal.restore(client if receiver is None else None):
+        supervisor.submit(update)
+    logger.info("Ожидание сообщений...")
+
+    while True:
+        try:
+            if receiver is not None:
+                updates = receiver.get_updates()
+            else:
+                updates = client.get_updates()
+            for update in _accept_updates(updates, client.offset if receiver is None else None,
+                                          supervisor.send_reply):
+                supervisor.submit(update)
+        except KeyboardInterrupt:
+            logger.info("Остановка бота, ожидание обработки принятых сообщений...")
+            if receiver is not None:
+                receiver.stop()
+                for update in _accept_updates(receiver.get_updates(timeout=0), None, supervisor.send_reply):
+                    supervisor.submit(update)
+            # Обработчику нужно дождаться и диспетчера, и очереди отправки
+            supervisor.stop(timeout=2 * DISPATCHER_SHUTDOWN_TIMEOUT)
+            logger.info("Бот остановлен.")
+            break
+        except Exception as e:
+            logger.error(f"Ошибка в основном цикле: {e}")
+            time.sleep(5)  # Пауза при ошибке
+
+def _start_services(dungeons: bool = True):
+    """Инициализация БД и фоновых служб процесса, который обрабатывает обновления"""
+    # Инициализация базы данных
+    init_db()
+    # Изменённые игры пишутся в БД пакетами в фоне
+    state_cache.start()
+
+    # Доступность Ollama проверяется в фоне, а не перед каждым запросом
+    start_health_monitor()
+    # Подземелья для /new без описания генерируются заранее, пока Ollama свободен
+    if dungeons:
+        dungeon_pool.start()
+    profiler.start()
+
+def _start_metrics(port: int) -> Optional[MetricsServer]:
+    """Сервер /metrics процесса, если метрики включены"""
+    if not METRICS_PORT:
+        return None
+    server = MetricsServer(port=port)
+    server.start()
+    return server
+
+def _stop_metrics(server: Optional[MetricsServer]):
+    if server is not None:
+        server.stop()
+
+def _stop_services():
+    """Остановка фоновых служб и запись несохранённых игр"""
+    profiler.stop()
+    dungeon_pool.stop()
+    stop_health_monitor()
+    state_cache.stop()
+    close_connections()
+    log_generation_stats()
+    log_cache_stats()
+
+def main():
+    """Основная функция запуска бота"""
+    if WORKER_PROCESSES > 1:
+        # Главному процессу нужна только БД для журнала обновлений
+        init_db()
+        metrics = _start_metrics(METRICS_PORT)
+        try:
+            run_sharded_bot()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            _stop_metrics(metrics)
+            close_connections()
+        return
+
+    _start_services()
+    metrics = _start_metrics(METRICS_PORT)
+    try:
+        if RUNTIME_MODE == "sync":
+            run_sync_bot()
+        else:
+            asyncio.run(run_async_bot())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _stop_metrics(metrics)
+        _stop_services()
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
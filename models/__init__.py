@@ -4,6 +4,8 @@ from .room_model import RoomModel
 from .dungeon_model import DungeonModel
 from .game_state_model import GameStateModel
 from .state_change import StateChange
+from .projection_model import ProjectionModel, RoomSummaryModel
+from .state_transition import apply_state_changes
 
 __all__ = [
     'CharacterModel',
@@ -11,5 +13,8 @@ __all__ = [
     'RoomModel',
     'DungeonModel',
     'GameStateModel',
-    'StateChange'
+    'StateChange',
+    'ProjectionModel',
+    'RoomSummaryModel',
+    'apply_state_changes'
 ] 
\ No newline at end of file
@@ -0,0 +1,20 @@
+from typing import Dict, Optional
+from pydantic import BaseModel
+from .character_model import CharacterModel
+from .room_model import RoomModel
+
+class RoomSummaryModel(BaseModel):
+    """Краткое описание соседней комнаты"""
+    summary: str
+    has_enemies: bool = False
+
+class ProjectionModel(BaseModel):
+    """Часть состояния игры, нужная для обработки одного действия"""
+    player: CharacterModel
+    current_room_id: str
+    current_room: RoomModel
+    # Соседние комнаты (на один переход через видимые выходы)
+    neighbour_rooms: Dict[str, RoomSummaryModel] = {}
+    adventure_description: Optional[str] = None
+    story_context: Optional[str] = None
+    last_action_description: Optional[str] = None
@@ -1,5 +1,5 @@
-from typing import List, Dict
-from pydantic import BaseModel
+from typing import List, Dict, Optional
+from pydantic import BaseModel, PrivateAttr
 from .exit_model import ExitModel
 
 class RoomModel(BaseModel):
@@ -7,4 +7,18 @@ class RoomModel(BaseModel):
     items: List[str]
     enemies: List[str]
     friendly_npcs: List[str] = []  # Дружественные NPC в комнате
-    exits: Dict[str, ExitModel]  # Словарь выходов с их описаниями 
\ No newline at end of file
+    exits: Dict[str, ExitModel]  # Словарь выходов с их описаниями
+
+    # Индекс target_room -> ключ выхода, строится по первому запросу для текущего словаря exits
+    _exit_index: Optional[Dict[str, str]] = PrivateAttr(default=None)
+    _exit_index_source: Optional[dict] = PrivateAttr(default=None)
+
+    def exit_key(self, target_room: str) -> Optional[str]:
+        """Ключ первого выхода в комнату target_room"""
+        if self._exit_index_source is not self.exits:
+            index = {}
+            for key, exit_info in self.exits.items():
+                index.setdefault(exit_info.target_room, key)
+            self._exit_index = index
+            self._exit_index_source = self.exits
+        return self._exit_index.get(target_room)
@@ -0,0 +1,57 @@
+from functools import lru_cache
+from typing import Type
+from pydantic import BaseModel
+
+# Служебные ключи pydantic, которые не нужны для ограничения генерации
+_DROPPED_KEYS = {"title", "default"}
+
+
+def _inline(schema, definitions: dict):
+    """Подстановка $ref и удаление служебных ключей"""
+    if isinstance(schema, list):
+        return [_inline(item, definitions) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if "$ref" in schema:
+        name = schema["$ref"].split("/")[-1]
+        return _inline(definitions[name], definitions)
+    return {key: _inline(value, definitions) for key, value in schema.items()
+            if key not in _DROPPED_KEYS and key != "definitions"}
+
+
+def _nullable_and_required(schema: dict, model: Type[BaseModel]) -> dict:
+    """Необязательные поля модели допускают null, но ключи присутствуют всегда"""
+    properties = schema.get("properties", {})
+    for name, field in model.__fields__.items():
+        prop_schema = properties.get(field.alias)
+        if prop_schema is None:
+            continue
+        if field.allow_none:
+            properties[field.alias] = {"anyOf": [prop_schema, {"type": "null"}]}
+        sub_model = field.type_ if isinstance(field.type_, type) and issubclass(field.type_, BaseModel) else None
+        if sub_model is not None:
+            target = prop_schema
+            # Dict[str, Model] и List[Model] описывают вложенную модель в additionalProperties/items
+            while target.get("type") in ("object", "array") and "properties" not in target:
+                target = target.get("additionalProperties") or target.get("items") or {}
+            if target:
+                _nullable_and_required(target, sub_model)
+    if properties:
+        schema["required"] = list(properties)
+    return schema
+
+
+@lru_cache(maxsize=None)
+def _cached_schema(model: Type[BaseModel]) -> dict:
+    raw = model.schema()
+    schema = _inline(raw, raw.get("definitions", {}))
+    return _nullable_and_required(schema, model)
+
+
+def ollama_format_schema(model: Type[BaseModel]) -> dict:
+    """JSON Schema модели для параметра format Ollama (structured output).
+
+    Ссылки $ref раскрыты, все ключи обязательны (как в структуре из промптов),
+    Optional-поля допускают null.
+    """
+    return _cached_schema(model)
@@ -0,0 +1,121 @@
+from collections import Counter
+from typing import Dict, List, Optional
+from .exit_model import ExitModel
+from .room_model import RoomModel
+from .game_state_model import GameStateModel
+from .state_change import StateChange
+
+def _copy(model, **update):
+    """Поверхностная копия модели с заменой полей (вложенные объекты общие)"""
+    try:
+        return model.model_copy(update=update)
+    except AttributeError:
+        # Для старых версий Pydantic
+        return model.copy(update=update)
+
+def _updated_list(values: List[str], add: Optional[List[str]], remove: Optional[List[str]]) -> Optional[List[str]]:
+    """Новый список с добавлениями (без повторов) и удалениями или None, если ничего не изменилось"""
+    if not add and not remove:
+        return None
+    counts = Counter(values)
+    result = list(values)
+    for value in add or []:
+        if not counts[value]:
+            result.append(value)
+            counts[value] += 1
+    for value in remove or []:
+        if counts[value]:
+            result.remove(value)
+            counts[value] -= 1
+    return result if result != values else None
+
+# Изменения выходов: поле StateChange -> (флаг выхода, новое значение)
+EXIT_CHANGES = (
+    ("room_exits_reveal", "is_hidden", False),
+    ("room_exits_hide", "is_hidden", True),
+    ("room_exits_block", "is_blocked", True),
+    ("room_exits_unblock", "is_blocked", False),
+)
+
+def _updated_exits(room: RoomModel, changes: StateChange) -> Optional[Dict[str, ExitModel]]:
+    """Новый словарь выходов с изменёнными флагами или None, если выходы не менялись"""
+    exits = None
+    for field, flag, value in EXIT_CHANGES:
+        for target_room in getattr(changes, field) or []:
+            # Ищем выход по имени комнаты назначения
+            exit_key = room.exit_key(target_room)
+            if exit_key is None:
+                continue
+            if exits is None:
+                exits = dict(room.exits)
+            exits[exit_key] = _copy(exits[exit_key], **{flag: value})
+    return exits
+
+def apply_state_changes(state: GameStateModel, changes: StateChange) -> GameStateModel:
+    """Применение изменений к состоянию игры.
+
+    Исходное состояние не меняется. Новое копирует только игрока и изменённую
+    комнату, остальные комнаты общие с исходным, поэтому стоимость не зависит
+    от размера подземелья.
+    """
+    # Если действие игнорируется, просто добавляем описание
+    if changes.ignore_action:
+        return _copy(state, last_action_description=changes.last_action_description or "Ничего не происходит.")
+
+    update = {}
+
+    # Применяем изменения персонажа
+    player_update = {}
+    if changes.player_hp_change is not None:
+        player_update["hp"] = state.player.hp + changes.player_hp_change
+        # Проверяем смерть персонажа
+        if player_update["hp"] <= 0:
+            update["is_adventure_completed"] = True
+
+    if changes.player_location_change is not None:
+        player_update["location"] = changes.player_location_change
+
+    # Применяем изменения инвентаря
+    inventory = _updated_list(state.player.inventory, changes.inventory_add, changes.inventory_remove)
+    if inventory is not None:
+        player_update["inventory"] = inventory
+
+    player = _copy(state.player, **player_update) if player_update else state.player
+    if player_update:
+        update["player"] = player
+
+    # Применяем изменения текущей комнаты
+    location = player.location
+    current_room = state.dungeon.rooms[location]
+    room_update = {}
+    for field, add, remove in (
+        ("items", changes.room_items_add, changes.room_items_remove),
+        ("enemies", changes.room_enemies_add, changes.room_enemies_remove),
+        ("friendly_npcs", changes.room_friendly_npcs_add, changes.room_friendly_npcs_remove),
+    ):
+        values = _updated_list(getattr(current_room, field), add, remove)
+        if values is not None:
+            room_update[field] = values
+
+    # Применяем изменения описания комнаты
+    if changes.room_description_change:
+        room_update["description"] = changes.room_description_change
+
+    # Применяем изменения выходов
+    exits = _updated_exits(current_room, changes)
+    if exits is not None:
+        room_update["exits"] = exits
+
+    if room_update:
+        rooms = dict(state.dungeon.rooms)
+        rooms[location] = _copy(current_room, **room_update)
+        update["dungeon"] = _copy(state.dungeon, rooms=rooms)
+
+    # Применяем общие изменения
+    if changes.is_adventure_completed is not None:
+        update["is_adventure_completed"] = changes.is_adventure_completed
+
+    if changes.last_action_description:
+        update["last_action_description"] = changes.last_action_description
+
+    return _copy(state, **update)
@@ -0,0 +1,137 @@
+import re
+import time
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from models import ProjectionModel, StateChange
+from services.metrics import Counter
+from config.settings import ACTION_CACHE_CATEGORIES, ACTION_CACHE_TTL, ACTION_CACHE_MAX_ENTRIES
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+ACTION_CACHE_REQUESTS = Counter("action_cache_requests_total", "Поиск ответа на действие в кеше", ("category", "result"))
+
+# Категории действий и их нормальная форма. Ответ на действие зависит только
+# от игрока и текущей комнаты, поэтому для одинакового состояния его можно
+# переиспользовать. Бой, диалоги и прочие действия не кешируются.
+_LOOK = re.compile(r"^(?:осмотреться|оглядеться|осмотреть(?:ся)?|оглядеть|смотреть|посмотреть|осмотр)"
+                   r"(?: (?:вокруг|по сторонам|комнату|помещение|зал|всё|все))?$")
+_INVENTORY = re.compile(r"^(?:(?:проверить|посмотреть|открыть|показать) )?(?:инвентарь|рюкзак|сумку)$"
+                        r"|^что у меня (?:есть|в (?:инвентаре|рюкзаке|сумке))$")
+_MOVE = re.compile(r"^(?:идти|пойти|иди|войти|перейти|зайти|отправиться|направиться)"
+                   r"(?: (?:в|во|к|ко|через|на))? (?P<target>.+)$")
+_TAKE = re.compile(r"^(?:взять|возьми|взяв|подобрать|подбери|поднять|подними|забрать|забери|схватить)"
+                   r" (?P<target>.+)$")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_action(action: str) -> str:
+    """Действие без регистра, знаков препинания и лишних пробелов"""
+    text = action.lower().replace("ё", "е")
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def classify_action(action: str) -> Optional[Tuple[str, str]]:
+    """Категория и нормальная форма действия или None, если действие не кешируется"""
+    text = normalize_action(action)
+    if _LOOK.match(text):
+        return "look", "осмотреться"
+    if _INVENTORY.match(text):
+        return "inventory", "инвентарь"
+    match = _MOVE.match(text)
+    if match:
+        return "move", f"идти {match.group('target')}"
+    match = _TAKE.match(text)
+    if match:
+        return "take", f"взять {match.group('target')}"
+    return None
+
+
+def projection_fingerprint(projection: ProjectionModel) -> str:
+    """Отпечаток игрока и текущей комнаты - всего, что видит ведущий в этой комнате"""
+    relevant = projection.json(include={"player", "current_room_id", "current_room", "neighbour_rooms"},
+                               ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(relevant.encode("utf-8")).hexdigest()
+
+
+class ActionCache:
+    """LRU с ограничением времени жизни: (категория, действие, отпечаток состояния) -> StateChange"""
+
+    def __init__(self, categories=ACTION_CACHE_CATEGORIES, ttl: float = ACTION_CACHE_TTL,
+                 max_entries: int = ACTION_CACHE_MAX_ENTRIES):
+        self.categories = frozenset(categories)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Tuple[float, StateChange]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, projection: ProjectionModel, action: str) -> Optional[Tuple[str, tuple]]:
+        classified = classify_action(action)
+        if classified is None:
+            return None
+        category, normalized = classified
+        if category not in self.categories:
+            return None
+        return category, (category, normalized, projection_fingerprint(projection))
+
+    def get(self, projection: ProjectionModel, action: str) -> Optional[StateChange]:
+        """Сохранённый ответ на такое же действие в таком же состоянии"""
+        key = self._key(projection, action)
+        if key is None:
+            ACTION_CACHE_REQUESTS.inc(category="other", result="skip")
+            return None
+        category, key = key
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        ACTION_CACHE_REQUESTS.inc(category=category, result="hit" if entry is not None else "miss")
+        return entry[1] if entry is not None else None
+
+    def put(self, projection: ProjectionModel, action: str, changes: StateChange):
+        """Сохранение проверенного ответа"""
+        key = self._key(projection, action)
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key[1]] = (time.monotonic(), changes)
+            self._entries.move_to_end(key[1])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def cache_stats() -> dict:
+    """Попадания по категориям: каждое попадание - не сделанный запрос к Ollama"""
+    stats = {}
+    for labels, value in ACTION_CACHE_REQUESTS.items():
+        entry = stats.setdefault(labels["category"], {"hit": 0, "miss": 0, "skip": 0})
+        entry[labels["result"]] = int(value)
+    for entry in stats.values():
+        lookups = entry["hit"] + entry["miss"]
+        entry["hit_rate"] = entry["hit"] / lookups if lookups else 0.0
+    return stats
+
+
+def log_cache_stats():
+    """Вывод статистики кеша действий в лог"""
+    for category, entry in cache_stats().items():
+        if category == "other":
+            continue
+        logger.info(f"[ActionCache] {category}: попаданий {entry['hit']} ({entry['hit_rate']:.1%}), "
+                    f"сэкономлено запросов к Ollama: {entry['hit']}")
+
+
+# Общий кеш ответов на действия
+action_cache = ActionCache()
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional, Set, Tuple
+from services.metrics import STAGE_SECONDS
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+
+class DispatcherClosedError(Exception):
+    """Диспетчер остановлен и больше не принимает обновления"""
+
+
+def get_update_chat_id(update: dict) -> Optional[int]:
+    """Извлечение chat_id из обновления Telegram"""
+    message = update.get("message", {})
+    return message.get("chat", {}).get("id")
+
+
+def _queue_key(update: dict) -> Hashable:
+    """Ключ очереди: чат, а для обновлений без чата - само обновление"""
+    chat_id = get_update_chat_id(update)
+    if chat_id is not None:
+        return chat_id
+    # Обновления без чата независимы друг от друга
+    return ("update", update.get("update_id"))
+
+
+class UpdateDispatcher:
+    """Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления разных чатов обрабатываются пулом потоков, а обновления
+    одного чата - строго по очереди, поэтому load_state/save_state одной
+    игры никогда не выполняются одновременно.
+    """
+
+    def __init__(self, handler: Callable[[dict], None], max_workers: int = 4, max_pending: int = 200):
+        self._handler = handler
+        self._max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dispatcher")
+        self._cond = threading.Condition()
+        # Ключ очереди -> (обновление, время приёма)
+        self._chat_queues: Dict[Hashable, Deque[Tuple[dict, float]]] = {}
+        self._pending = 0
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        """Количество принятых, но ещё не обработанных обновлений"""
+        with self._cond:
+            return self._pending
+
+    def submit(self, update: dict):
+        """Постановка обновления в очередь его чата.
+
+        Блокируется, если в очереди уже max_pending обновлений.
+        """
+        key = _queue_key(update)
+        with self._cond:
+            while self._pending >= self._max_pending and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise DispatcherClosedError("Диспетчер остановлен")
+            self._pending += 1
+            queue = self._chat_queues.get(key)
+            if queue is not None:
+                # Чат уже обрабатывается - обновление дождётся своей очереди
+                queue.append((update, time.monotonic()))
+                return
+            self._chat_queues[key] = deque([(update, time.monotonic())])
+        self._executor.submit(self._run_next, key)
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """Остановка с дожиданием обработки уже принятых обновлений"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            drained = self._cond.wait_for(lambda: self._pending == 0, timeout=timeout)
+        if not drained:
+            logger.warning(f"Не дождались обработки {self.pending} обновлений при остановке")
+        self._executor.shutdown(wait=drained, cancel_futures=not drained)
+        return drained
+
+    def _run_next(self, key: Hashable):
+        """Обработка одного обновления чата и передача очереди дальше"""
+        with self._cond:
+            update, submitted_at = self._chat_queues[key][0]
+
+        started = time.monotonic()
+        STAGE_SECONDS.observe(started - submitted_at, stage="dispatch_wait")
+        try:
+            self._handler(update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+        STAGE_SECONDS.observe(time.monotonic() - started, stage="update")
+
+        with self._cond:
+            queue = self._chat_queues[key]
+            queue.popleft()
+            self._pending -= 1
+            self._cond.notify_all()
+            if not queue:
+                del self._chat_queues[key]
+                return
+        # Следующее обновление чата встаёт в конец общей очереди,
+        # чтобы активный чат не занимал поток целиком
+        try:
+            self._executor.submit(self._run_next, key)
+        except RuntimeError:
+            logger.warning(f"Пул остановлен, очередь чата {key} не обработана")
+
+
+class AsyncUpdateDispatcher:
+    """Асинхронный аналог UpdateDispatcher для event loop.
+
+    Каждый чат обслуживается своей задачей asyncio, число одновременно
+    выполняемых обработчиков ограничено семафором.
+    """
+
+    def __init__(self, handler: Callable[[dict], Awaitable[None]], max_concurrent: int = 500, max_pending: int = 1000):
+        self._handler = handler
+        self._max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._cond = asyncio.Condition()
+        # Ключ очереди -> (обновление, время приёма)
+        self._chat_queues: Dict[Hashable, Deque[Tuple[dict, float]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._pending = 0
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        """Количество принятых, но ещё не обработанных обновлений"""
+        return self._pending
+
+    async def submit(self, update: dict):
+        """Постановка обновления в очередь его чата (ждёт, если очередь заполнена)"""
+        key = _queue_key(update)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._pending < self._max_pending or self._closed)
+            if self._closed:
+                raise DispatcherClosedError("Диспетчер остановлен")
+            self._pending += 1
+
+        queue = self._chat_queues.get(key)
+        if queue is not None:
+            queue.append((update, time.monotonic()))
+            return
+        self._chat_queues[key] = deque([(update, time.monotonic())])
+        task = asyncio.create_task(self._run_chat(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """Остановка с дожиданием обработки уже принятых обновлений"""
+        async with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        tasks = set(self._tasks)
+        if not tasks:
+            return True
+        done, not_done = await asyncio.wait(tasks, timeout=timeout)
+        if not_done:
+            logger.warning(f"Не дождались обработки {self._pending} обновлений при остановке")
+            for task in not_done:
+                task.cancel()
+            await asyncio.gather(*not_done, return_exceptions=True)
+        return not not_done
+
+    async def _run_chat(self, key: Hashable):
+        """Последовательная обработка очереди одного чата"""
+        queue = self._chat_queues[key]
+        try:
+            while queue:
+                update, submitted_at = queue[0]
+                try:
+                    async with self._semaphore:
+                        started = time.monotonic()
+                        STAGE_SECONDS.observe(started - submitted_at, stage="dispatch_wait")
+                        try:
+                            await self._handler(update)
+                        finally:
+                            STAGE_SECONDS.observe(time.monotonic() - started, stage="update")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+
+                queue.popleft()
+                async with self._cond:
+                    self._pending -= 1
+                    self._cond.notify_all()
+        finally:
+            # И при отмене задачи: иначе новые обновления чата попали бы в очередь, которую никто не обрабатывает
+            if self._chat_queues.get(key) is queue:
+                del self._chat_queues[key]
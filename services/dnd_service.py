@@ -1,38 +1,25 @@
 import random
 import logging
-from models import CharacterModel, GameStateModel, RoomModel, DungeonModel, StateChange, ExitModel
-from services.ollama_service import ollama_with_validation
-from config.settings import RACES, CLASSES, USE_OLLAMA
+from typing import Dict, List, Optional, Tuple
+from models import CharacterModel, GameStateModel, RoomModel, StateChange, ProjectionModel
+from models import apply_state_changes as _apply_state_changes
+from services.llm_scheduler import PRIORITY_ACTION, PRIORITY_NEW_GAME
+from services.ollama_service import ollama_with_validation, ollama_with_validation_async
+from services.state_projection import build_projection, check_state_change_scope
+from services.ollama_session import chat_sessions
+from services.action_cache import action_cache, classify_action, normalize_action
+from services import metrics
+from services.tracing import annotate
+from config.settings import RACES, CLASSES, USE_OLLAMA, FAST_PATH_ENABLED
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
-def roll_hp(hit_die: int, con_mod: int) -> int:
-    """Бросок здоровья персонажа"""
-    return hit_die + con_mod
-
-def generate_character(user_id: int, name: str) -> CharacterModel:
-    """Генерация персонажа"""
-    race = random.choice(RACES)
-    cls = random.choice(list(CLASSES.keys()))
-    con_mod = random.randint(0, 3)
-    hp = roll_hp(CLASSES[cls]["hit_die"], con_mod)
-    items = CLASSES[cls]["items"]
-
-    char = CharacterModel(
-        name=name,
-        race=race,
-        cls=cls,
-        hp=hp,
-        inventory=items,
-        location="Room1"
-    )
-    return char
+FAST_PATH_ACTIONS = metrics.Counter("fast_path_actions_total", "Действия, решённые правилами без Ollama", ("intent", "result"))
 
-def generate_dungeon(adventure_prompt: str) -> GameStateModel:
-    """Генерация подземелья"""
-    if USE_OLLAMA:
-        system_prompt = f"""Ты создаешь DnD приключения в формате JSON. 
+# Системные промпты не меняются между запросами: Ollama переиспользует
+# уже обработанный префикс и не тратит время на его повторный prefill
+DUNGEON_SYSTEM_PROMPT = f"""Ты создаешь DnD приключения в формате JSON. 
 
 ПРАВИЛА:
 1. Первая комната (Room1) не должна содержать врагов
@@ -82,145 +69,8 @@ def generate_dungeon(adventure_prompt: str) -> GameStateModel:
 Доступные рассы: {RACES}
 Доступные классы: {CLASSES}
 """
-        user_prompt = "Создай DnD приключение по указанной структуре."
-        
-        if adventure_prompt:
-            user_prompt += f"\n\nПользователь хочет примерно такое описание приключения: {adventure_prompt}"
-        
-        logger.debug(f"[DEBUG] Длина системного промпта: {len(system_prompt)}")
-        logger.debug(f"[DEBUG] Длина пользовательского промпта: {len(user_prompt)}")
-        
-        result = ollama_with_validation(user_prompt, GameStateModel, system_prompt=system_prompt)
-        
-        # Если Ollama не смог сгенерировать, используем подземелье по умолчанию
-        if result is None:
-            logger.warning("Ollama не смог сгенерировать подземелье, используем подземелье по умолчанию")
-            return None
-        
-        return result
-    else:
-        logger.info("Используем подземелье по умолчанию (режим без Ollama)")
-        return None
 
-def apply_state_changes(state: GameStateModel, changes: StateChange) -> GameStateModel:
-    """Применение изменений к состоянию игры"""
-    # Создаем копию состояния
-    try:
-        new_state = state.model_copy(deep=True)
-    except AttributeError:
-        # Для старых версий Pydantic
-        new_state = state.copy(deep=True)
-    
-    # Если действие игнорируется, просто добавляем описание
-    if changes.ignore_action:
-        new_state.last_action_description = changes.last_action_description or "Ничего не происходит."
-        return new_state
-    
-    # Применяем изменения персонажа
-    if changes.player_hp_change is not None:
-        new_state.player.hp += changes.player_hp_change
-        # Проверяем смерть персонажа
-        if new_state.player.hp <= 0:
-            new_state.is_adventure_completed = True
-    
-    if changes.player_location_change is not None:
-        new_state.player.location = changes.player_location_change
-    
-    # Применяем изменения инвентаря
-    if changes.inventory_add:
-        for item in changes.inventory_add:
-            if item not in new_state.player.inventory:
-                new_state.player.inventory.append(item)
-    
-    if changes.inventory_remove:
-        for item in changes.inventory_remove:
-            if item in new_state.player.inventory:
-                new_state.player.inventory.remove(item)
-    
-    # Применяем изменения текущей комнаты
-    current_room = new_state.dungeon.rooms[new_state.player.location]
-    
-    if changes.room_items_add:
-        for item in changes.room_items_add:
-            if item not in current_room.items:
-                current_room.items.append(item)
-    
-    if changes.room_items_remove:
-        for item in changes.room_items_remove:
-            if item in current_room.items:
-                current_room.items.remove(item)
-    
-    if changes.room_enemies_add:
-        for enemy in changes.room_enemies_add:
-            if enemy not in current_room.enemies:
-                current_room.enemies.append(enemy)
-    
-    if changes.room_enemies_remove:
-        for enemy in changes.room_enemies_remove:
-            if enemy in current_room.enemies:
-                current_room.enemies.remove(enemy)
-    
-    # Применяем изменения описания комнаты
-    if changes.room_description_change:
-        current_room.description = changes.room_description_change
-    
-    # Применяем изменения дружественных NPC
-    if changes.room_friendly_npcs_add:
-        for npc in changes.room_friendly_npcs_add:
-            if npc not in current_room.friendly_npcs:
-                current_room.friendly_npcs.append(npc)
-    
-    if changes.room_friendly_npcs_remove:
-        for npc in changes.room_friendly_npcs_remove:
-            if npc in current_room.friendly_npcs:
-                current_room.friendly_npcs.remove(npc)
-    
-    # Применяем изменения выходов
-    if changes.room_exits_reveal:
-        for exit_name in changes.room_exits_reveal:
-            # Ищем выход по имени комнаты назначения
-            for exit_key, exit_info in current_room.exits.items():
-                if exit_info.target_room == exit_name:
-                    current_room.exits[exit_key].is_hidden = False
-                    break
-    
-    if changes.room_exits_hide:
-        for exit_name in changes.room_exits_hide:
-            # Ищем выход по имени комнаты назначения
-            for exit_key, exit_info in current_room.exits.items():
-                if exit_info.target_room == exit_name:
-                    current_room.exits[exit_key].is_hidden = True
-                    break
-    
-    if changes.room_exits_block:
-        for exit_name in changes.room_exits_block:
-            # Ищем выход по имени комнаты назначения
-            for exit_key, exit_info in current_room.exits.items():
-                if exit_info.target_room == exit_name:
-                    current_room.exits[exit_key].is_blocked = True
-                    break
-    
-    if changes.room_exits_unblock:
-        for exit_name in changes.room_exits_unblock:
-            # Ищем выход по имени комнаты назначения
-            for exit_key, exit_info in current_room.exits.items():
-                if exit_info.target_room == exit_name:
-                    current_room.exits[exit_key].is_blocked = False
-                    break
-    
-    # Применяем общие изменения
-    if changes.is_adventure_completed is not None:
-        new_state.is_adventure_completed = changes.is_adventure_completed
-    
-    if changes.last_action_description:
-        new_state.last_action_description = changes.last_action_description
-    
-    return new_state
-
-def process_player_action(state: GameStateModel, action: str) -> GameStateModel:
-    """Обработка действий игрока"""
-    if USE_OLLAMA:
-        system_prompt = """Ты ведущий DnD. Обрабатываешь действия игрока и возвращаешь только ИЗМЕНЕНИЯ состояния в JSON.
+ACTION_SYSTEM_PROMPT = """Ты ведущий DnD. Обрабатываешь действия игрока и возвращаешь только ИЗМЕНЕНИЯ состояния в JSON.
 
 ВАЖНЫЕ ПРАВИЛА:
 1. Вместо изменения всего состояния игры, опиши только ИЗМЕНЕНИЯ в формате JSON.
@@ -278,42 +128,282 @@ def process_player_action(state: GameStateModel, action: str) -> GameStateModel:
 
 Отвечай ТОЛЬКО в формате JSON, без дополнительного текста."""
 
-        user_prompt = f"""Действие игрока: "{action}"
-
-Текущее состояние игры:
-{state.json(ensure_ascii=False)}"""
-        
-        logger.debug(f"[DEBUG] Длина системного промпта: {len(system_prompt)}")
-        logger.debug(f"[DEBUG] Длина пользовательского промпта: {len(user_prompt)}")
-        
-        result = ollama_with_validation(user_prompt, StateChange, system_prompt=system_prompt)
-        logger.debug(f"[DEBUG] Результат: {result}")
-        # Если Ollama не смог обработать действие, возвращаем исходное состояние
-        if result is None:
-            logger.warning(f"Ollama не смог обработать действие: {action}")
-            # Создаем простое изменение состояния для отладки
-            changes = StateChange(
-                last_action_description=f"Действие '{action}' не было обработано.",
-                ignore_action=True
-            )
-            return apply_state_changes(state, changes)
-        
-        # Проверяем, что результат является StateChange
-        if not isinstance(result, StateChange):
-            logger.error(f"Ollama вернул некорректный тип данных: {type(result)}")
-            changes = StateChange(
-                last_action_description=f"Ошибка обработки действия '{action}'.",
-                ignore_action=True
-            )
-            return apply_state_changes(state, changes)
-        
-        # Применяем изменения к состоянию
-        return apply_state_changes(state, result)
+def roll_hp(hit_die: int, con_mod: int) -> int:
+    """Бросок здоровья персонажа"""
+    return hit_die + con_mod
+
+def generate_character(user_id: int, name: str) -> CharacterModel:
+    """Генерация персонажа"""
+    race = random.choice(RACES)
+    cls = random.choice(list(CLASSES.keys()))
+    con_mod = random.randint(0, 3)
+    hp = roll_hp(CLASSES[cls]["hit_die"], con_mod)
+    items = CLASSES[cls]["items"]
+
+    char = CharacterModel(
+        name=name,
+        race=race,
+        cls=cls,
+        hp=hp,
+        inventory=items,
+        location="Room1"
+    )
+    return char
+
+@metrics.STAGE_SECONDS.time(stage="prompt")
+def _build_dungeon_prompts(adventure_prompt: str) -> tuple:
+    """Системный и пользовательский промпты для генерации подземелья"""
+    system_prompt = DUNGEON_SYSTEM_PROMPT
+    user_prompt = "Создай DnD приключение по указанной структуре."
+
+    if adventure_prompt:
+        user_prompt += f"\n\nПользователь хочет примерно такое описание приключения: {adventure_prompt}"
+
+    logger.debug(f"[DEBUG] Длина системного промпта: {len(system_prompt)}")
+    logger.debug(f"[DEBUG] Длина пользовательского промпта: {len(user_prompt)}")
+    return system_prompt, user_prompt
+
+def _dungeon_result(result: GameStateModel) -> GameStateModel:
+    """Обработка результата генерации подземелья"""
+    # Если Ollama не смог сгенерировать, используем подземелье по умолчанию
+    if result is None:
+        logger.warning("Ollama не смог сгенерировать подземелье, используем подземелье по умолчанию")
+        return None
+
+    return result
+
+def generate_dungeon(adventure_prompt: str, chat_id: int = None, on_queued=None) -> GameStateModel:
+    """Генерация подземелья (on_queued - сообщение о месте в очереди к Ollama)"""
+    if USE_OLLAMA:
+        system_prompt, user_prompt = _build_dungeon_prompts(adventure_prompt)
+        result = ollama_with_validation(user_prompt, GameStateModel, system_prompt=system_prompt, chat_id=chat_id,
+                                        priority=PRIORITY_NEW_GAME, on_queued=on_queued)
+        return _dungeon_result(result)
+    else:
+        logger.info("Используем подземелье по умолчанию (режим без Ollama)")
+        return None
+
+def pregenerate_dungeon(abort_if=None) -> Optional[GameStateModel]:
+    """Фоновая генерация подземелья без пожеланий игрока (для пула /new).
+
+    Запрос не считается запросом игрока и прерывается, когда abort_if() возвращает True.
+    """
+    if not USE_OLLAMA:
+        return None
+    system_prompt, user_prompt = _build_dungeon_prompts("")
+    result = ollama_with_validation(user_prompt, GameStateModel, system_prompt=system_prompt,
+                                    background=True, abort_if=abort_if)
+    return result
+
+async def generate_dungeon_async(adventure_prompt: str, chat_id: int = None, on_queued=None) -> GameStateModel:
+    """Асинхронная генерация подземелья (on_queued - корутина)"""
+    if USE_OLLAMA:
+        system_prompt, user_prompt = _build_dungeon_prompts(adventure_prompt)
+        result = await ollama_with_validation_async(user_prompt, GameStateModel, system_prompt=system_prompt,
+                                                    chat_id=chat_id, priority=PRIORITY_NEW_GAME, on_queued=on_queued)
+        return _dungeon_result(result)
+    else:
+        logger.info("Используем подземелье по умолчанию (режим без Ollama)")
+        return None
+
+# Применение изменений живёт в models (им же БД восстанавливает игру из журнала), здесь - с замером этапа
+apply_state_changes = metrics.STAGE_SECONDS.time(stage="apply")(_apply_state_changes)
+
+# Служебные слова, которые не участвуют в сопоставлении названий
+_NAME_STOP_WORDS = {"в", "во", "к", "ко", "на", "через", "комнату", "комната", "комнате", "сторону", "этот", "эту", "тот", "ту"}
+
+def _stems(text: str) -> List[str]:
+    """Грубые основы слов: без окончаний, чтобы «ржавой двери» совпало с «Ржавая дверь»"""
+    return [word[:max(3, len(word) - 2)] for word in normalize_action(text).split() if word not in _NAME_STOP_WORDS]
+
+def _match_name(target: str, candidates: Dict[str, object]) -> Optional[object]:
+    """Единственный кандидат, чьё название совпадает с target или содержит все его слова"""
+    target_stems = _stems(target)
+    if not target_stems:
+        return None
+    exact = [value for name, value in candidates.items() if _stems(name) == target_stems]
+    if len(exact) == 1:
+        return exact[0]
+    partial = [value for name, value in candidates.items() if set(target_stems) <= set(_stems(name))]
+    return partial[0] if len(partial) == 1 and not exact else None
+
+def _fast_move(state: GameStateModel, room: RoomModel, target: str) -> Optional[StateChange]:
+    """Переход через видимый незаблокированный выход (правило 2)"""
+    # Враги могут не выпустить игрока (правила 20-21) - это решает ведущий
+    if room.enemies:
+        return None
+    normalized = normalize_action(target)
+    exit_info = next((exit_info for exit_info in room.exits.values()
+                      if normalize_action(exit_info.target_room) == normalized), None)
+    if exit_info is None:
+        candidates = {exit_info.name: exit_info for exit_info in room.exits.values()}
+        exit_info = _match_name(target, candidates)
+    # Скрытые и заблокированные выходы, а также непонятные цели - к ведущему
+    if exit_info is None or exit_info.is_hidden or exit_info.is_blocked:
+        return None
+    next_room = state.dungeon.rooms.get(exit_info.target_room)
+    if next_room is None:
+        return None
+    return StateChange(
+        player_location_change=exit_info.target_room,
+        last_action_description=f"Вы проходите: {exit_info.name}. {next_room.description}"
+    )
+
+def _fast_take(room: RoomModel, target: str) -> Optional[StateChange]:
+    """Взять предмет, который лежит в комнате (правило 3)"""
+    # При врагах в комнате и для несуществующих предметов (правило 7) решает ведущий
+    if room.enemies:
+        return None
+    item = _match_name(target, {item: item for item in room.items})
+    if item is None:
+        return None
+    return StateChange(
+        inventory_add=[item],
+        room_items_remove=[item],
+        last_action_description=f"Вы подбираете: {item}."
+    )
+
+def _fast_inventory(state: GameStateModel) -> StateChange:
+    """Просмотр инвентаря - состояние не меняется"""
+    inventory = state.player.inventory
+    description = f"В вашем инвентаре: {', '.join(inventory)}." if inventory else "Ваш инвентарь пуст."
+    return StateChange(last_action_description=description)
+
+def resolve_simple_action(state: GameStateModel, action: str) -> Optional[StateChange]:
+    """Изменения для простого действия по правилам игры или None, если нужен ведущий.
+
+    Решаются переход через видимый свободный выход, взятие лежащего в комнате
+    предмета и просмотр инвентаря. Всё, что требует описания или может
+    закончиться по-разному, уходит в Ollama.
+    """
+    classified = classify_action(action)
+    if classified is None or state.is_adventure_completed:
+        return None
+    intent, normalized = classified
+    room = state.dungeon.rooms.get(state.player.location)
+    if room is None:
+        return None
+    target = normalized.split(" ", 1)[1] if " " in normalized else ""
+    if intent == "move":
+        changes = _fast_move(state, room, target)
+    elif intent == "take":
+        changes = _fast_take(room, target)
+    elif intent == "inventory":
+        changes = _fast_inventory(state)
     else:
-        logger.info(f"Ollama отключен, действие не обработано: {action}")
+        return None
+    FAST_PATH_ACTIONS.inc(intent=intent, result="resolved" if changes is not None else "fallback")
+    return changes
+
+@metrics.STAGE_SECONDS.time(stage="prompt")
+def _build_action_prompts(projection: ProjectionModel, action: str) -> tuple:
+    """Системный и пользовательский промпты для обработки действия игрока"""
+    system_prompt = ACTION_SYSTEM_PROMPT
+    user_prompt = f"""Действие игрока: "{action}"
+
+Текущее состояние игры (игрок, текущая комната и соседние комнаты):
+{projection.json(ensure_ascii=False)}"""
+
+    logger.debug(f"[DEBUG] Длина системного промпта: {len(system_prompt)}")
+    logger.debug(f"[DEBUG] Длина пользовательского промпта: {len(user_prompt)}")
+    return system_prompt, user_prompt
+
+def _apply_action_result(state: GameStateModel, action: str, result: StateChange) -> Tuple[GameStateModel, StateChange]:
+    """Применение ответа Ollama на действие игрока; возвращает новое состояние и применённые изменения"""
+    logger.debug(f"[DEBUG] Результат: {result}")
+    # Если Ollama не смог обработать действие, возвращаем исходное состояние
+    if result is None:
+        logger.warning(f"Ollama не смог обработать действие: {action}")
         # Создаем простое изменение состояния для отладки
         changes = StateChange(
-            last_action_description=f"Действие '{action}' не обработано (Ollama отключен).",
+            last_action_description=f"Действие '{action}' не было обработано.",
+            ignore_action=True
+        )
+        return apply_state_changes(state, changes), changes
+
+    # Проверяем, что результат является StateChange
+    if not isinstance(result, StateChange):
+        logger.error(f"Ollama вернул некорректный тип данных: {type(result)}")
+        changes = StateChange(
+            last_action_description=f"Ошибка обработки действия '{action}'.",
             ignore_action=True
         )
-        return apply_state_changes(state, changes) 
\ No newline at end of file
+        return apply_state_changes(state, changes), changes
+
+    # Применяем изменения к состоянию
+    return apply_state_changes(state, result), result
+
+def _skip_action(state: GameStateModel, action: str) -> Tuple[GameStateModel, StateChange]:
+    """Действие без Ollama не обрабатывается"""
+    logger.info(f"Ollama отключен, действие не обработано: {action}")
+    # Создаем простое изменение состояния для отладки
+    changes = StateChange(
+        last_action_description=f"Действие '{action}' не обработано (Ollama отключен).",
+        ignore_action=True
+    )
+    return apply_state_changes(state, changes), changes
+
+def process_player_action(state: GameStateModel, action: str, on_partial=None, chat_id: int = None,
+                          on_queued=None) -> Tuple[GameStateModel, StateChange]:
+    """Обработка действий игрока (on_partial - показ описания действия по мере генерации,
+    on_queued - сообщение о месте в очереди к Ollama).
+
+    Возвращает новое состояние и применённые изменения - их записывает журнал действий.
+    """
+    # Переходы, подбор предметов и инвентарь решаются правилами без Ollama
+    changes = resolve_simple_action(state, action) if FAST_PATH_ENABLED else None
+    if changes is not None:
+        annotate(route="fast_path")
+        return apply_state_changes(state, changes), changes
+    if USE_OLLAMA:
+        # В промпт попадает только окрестность игрока, а не всё подземелье
+        projection = build_projection(state)
+        # Такое же действие в таком же состоянии уже обрабатывалось
+        cached = action_cache.get(projection, action)
+        if cached is not None:
+            annotate(route="cache")
+            return apply_state_changes(state, cached), cached
+        annotate(route="ollama")
+        system_prompt, user_prompt = _build_action_prompts(projection, action)
+        session = chat_sessions.get(chat_id)
+        result = ollama_with_validation(user_prompt, StateChange, system_prompt=system_prompt, on_partial=on_partial,
+                                        validator=lambda changes: check_state_change_scope(projection, changes),
+                                        session=session, chat_id=chat_id,
+                                        priority=PRIORITY_ACTION, on_queued=on_queued)
+        if isinstance(result, StateChange):
+            action_cache.put(projection, action, result)
+            if session is not None:
+                session.record(action, result.last_action_description)
+        return _apply_action_result(state, action, result)
+    else:
+        return _skip_action(state, action)
+
+async def process_player_action_async(state: GameStateModel, action: str, on_partial=None, chat_id: int = None,
+                                      on_queued=None) -> Tuple[GameStateModel, StateChange]:
+    """Асинхронная обработка действий игрока (on_partial и on_queued - корутины)"""
+    changes = resolve_simple_action(state, action) if FAST_PATH_ENABLED else None
+    if changes is not None:
+        annotate(route="fast_path")
+        return apply_state_changes(state, changes), changes
+    if USE_OLLAMA:
+        # В промпт попадает только окрестность игрока, а не всё подземелье
+        projection = build_projection(state)
+        # Такое же действие в таком же состоянии уже обрабатывалось
+        cached = action_cache.get(projection, action)
+        if cached is not None:
+            annotate(route="cache")
+            return apply_state_changes(state, cached), cached
+        annotate(route="ollama")
+        system_prompt, user_prompt = _build_action_prompts(projection, action)
+        session = chat_sessions.get(chat_id)
+        result = await ollama_with_validation_async(user_prompt, StateChange, system_prompt=system_prompt, on_partial=on_partial,
+                                                    validator=lambda changes: check_state_change_scope(projection, changes),
+                                                    session=session, chat_id=chat_id,
+                                                    priority=PRIORITY_ACTION, on_queued=on_queued)
+        if isinstance(result, StateChange):
+            action_cache.put(projection, action, result)
+            if session is not None:
+                session.record(action, result.last_action_description)
+        return _apply_action_result(state, action, result)
+    else:
+        return _skip_action(state, action)
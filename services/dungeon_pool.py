@@ -0,0 +1,103 @@
+import time
+import logging
+import threading
+from typing import Callable, Optional
+from models import GameStateModel
+from database import db_manager
+from services.dnd_service import pregenerate_dungeon
+from services.ollama_service import live_requests_in_flight, seconds_since_live_request
+from services.ollama_backends import ollama_backends
+from services.metrics import Counter
+from config.settings import DUNGEON_POOL_SIZE, DUNGEON_POOL_REFILL_INTERVAL, DUNGEON_POOL_IDLE_DELAY
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+DUNGEON_POOL_REQUESTS = Counter("dungeon_pool_requests_total", "Запросы подземелья из пула", ("result",))
+DUNGEON_POOL_GENERATIONS = Counter("dungeon_pool_generations_total", "Фоновые генерации подземелий", ("outcome",))
+
+
+class DungeonPool:
+    """Пул подземелий, заранее сгенерированных в фоне, пока Ollama свободен.
+
+    Подземелья хранятся в SQLite и переживают перезапуск. Фоновая генерация
+    начинается, только если idle_delay секунд не было запросов игроков, и
+    прерывается, как только приходит новый запрос игрока.
+    """
+
+    def __init__(self, generate: Callable[[Callable[[], bool]], Optional[GameStateModel]] = pregenerate_dungeon,
+                 target_depth: int = DUNGEON_POOL_SIZE, refill_interval: float = DUNGEON_POOL_REFILL_INTERVAL,
+                 idle_delay: float = DUNGEON_POOL_IDLE_DELAY):
+        self._generate = generate
+        self.target_depth = target_depth
+        self.refill_interval = refill_interval
+        self.idle_delay = idle_delay
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_generation: Optional[float] = None
+
+    def take(self) -> Optional[GameStateModel]:
+        """Готовое подземелье или None, если пул пуст"""
+        if self.target_depth <= 0:
+            return None
+        dungeon = db_manager.pool_take()
+        DUNGEON_POOL_REQUESTS.inc(result="hit" if dungeon is not None else "miss")
+        self._wake.set()
+        return dungeon
+
+    def start(self):
+        """Запуск фонового пополнения"""
+        if self.target_depth <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="dungeon-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка фонового пополнения (текущая генерация прерывается)"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _is_idle(self) -> bool:
+        return ollama_backends.available() and seconds_since_live_request() >= self.idle_delay
+
+    def _should_abort(self) -> bool:
+        return self._stop.is_set() or live_requests_in_flight() > 0
+
+    def refill_once(self) -> bool:
+        """Одна фоновая генерация, если пул неполон и Ollama свободен; True - подземелье добавлено"""
+        started = time.monotonic()
+        if self._last_generation is not None and started - self._last_generation < self.refill_interval:
+            return False
+        if db_manager.pool_size() >= self.target_depth or not self._is_idle():
+            return False
+        self._last_generation = started
+        dungeon = self._generate(self._should_abort)
+        if dungeon is None:
+            outcome = "preempted" if self._should_abort() else "failed"
+            DUNGEON_POOL_GENERATIONS.inc(outcome=outcome)
+            logger.info(f"[DungeonPool] Фоновая генерация не удалась ({outcome})")
+            return False
+        db_manager.pool_put(dungeon)
+        DUNGEON_POOL_GENERATIONS.inc(outcome="success")
+        logger.info(f"[DungeonPool] Подземелье добавлено в пул за {time.monotonic() - started:.1f} с, "
+                    f"в пуле {db_manager.pool_size()}")
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refill_once()
+            except Exception as e:
+                logger.error(f"[DungeonPool] Ошибка фоновой генерации: {e}")
+            # Проверяем снова через время простоя или сразу после выдачи подземелья
+            self._wake.wait(max(min(self.idle_delay, self.refill_interval), 1))
+            self._wake.clear()
+
+
+# Общий пул подземелий
+dungeon_pool = DungeonPool()
@@ -0,0 +1,137 @@
+import json
+import re
+from typing import Optional, Tuple
+
+# Признаки того, что модель отвечает текстом, а не JSON
+SIMPLE_RESPONSE_MARKERS = ["okay", "the user sent", "empty message", "just the word"]
+
+
+class StreamingJsonScanner:
+    """Инкрементальный разбор JSON-ответа, приходящего кусками.
+
+    Следит за глубиной вложенности, чтобы понять, когда объект закончен,
+    вытаскивает строковое поле верхнего уровня по мере генерации и
+    распознаёт заведомо негодный ответ до конца генерации.
+    """
+
+    def __init__(self, preview_field: Optional[str] = None, max_preamble: int = 200):
+        self.text = ""
+        self.max_preamble = max_preamble
+        self.invalid_reason: Optional[str] = None
+        self._start: Optional[int] = None
+        self._end: Optional[int] = None
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._field_pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(preview_field)) if preview_field else None
+        self._field_start: Optional[int] = None
+        self._field_value = ""
+        self._field_complete = False
+
+    @property
+    def is_complete(self) -> bool:
+        """Объект верхнего уровня полностью получен"""
+        return self._end is not None
+
+    @property
+    def is_invalid(self) -> bool:
+        return self.invalid_reason is not None
+
+    @property
+    def json_text(self) -> Optional[str]:
+        """Текст завершённого JSON-объекта"""
+        if self._end is None:
+            return None
+        return self.text[self._start:self._end]
+
+    def feed(self, chunk: str):
+        """Добавление очередного куска ответа"""
+        if not chunk or self.is_complete or self.is_invalid:
+            return
+        self.text += chunk
+        self._scan()
+        if self._start is None:
+            self._check_preamble()
+        elif self._field_pattern is not None and not self._field_complete:
+            self._scan_field()
+
+    def preview(self) -> Tuple[str, bool]:
+        """Уже сгенерированная часть поля предпросмотра и признак его завершения"""
+        return self._field_value, self._field_complete
+
+    def _scan(self):
+        """Отслеживание глубины вложенности по новым символам"""
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._start is None:
+                if ch == '{':
+                    self._start = i
+                    self._depth = 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end = i + 1
+                    self._pos = len(text)
+                    return
+        self._pos = len(text)
+
+    def _check_preamble(self):
+        """Текст до начала JSON: болтовня модели вместо ответа"""
+        preamble = self.text.strip().lower()
+        if any(marker in preamble for marker in SIMPLE_RESPONSE_MARKERS):
+            self.invalid_reason = f"простой ответ вместо JSON: {self.text.strip()[:100]}"
+        elif len(preamble) > self.max_preamble:
+            self.invalid_reason = f"JSON не начался за {self.max_preamble} символов: {self.text.strip()[:100]}..."
+
+    def _scan_field(self):
+        """Декодирование строкового значения поля предпросмотра по мере поступления"""
+        if self._field_start is None:
+            match = self._field_pattern.search(self.text, self._start)
+            if not match:
+                return
+            self._field_start = match.end()
+
+        raw = self.text[self._field_start:]
+        i = 0
+        while i < len(raw):
+            ch = raw[i]
+            if ch == '"':
+                self._field_complete = True
+                break
+            if ch == '\\':
+                # Неполная escape-последовательность - ждём следующий кусок
+                if i + 1 >= len(raw):
+                    break
+                if raw[i + 1] == 'u':
+                    if i + 6 > len(raw):
+                        break
+                    # Суррогатная пара (эмодзи) декодируется целиком
+                    length = 12 if raw[i + 2:i + 4].lower() in ('d8', 'd9', 'da', 'db') else 6
+                    if i + length > len(raw):
+                        break
+                    escaped = raw[i:i + length]
+                else:
+                    escaped = raw[i:i + 2]
+                try:
+                    self._field_value += json.loads(f'"{escaped}"')
+                except json.JSONDecodeError:
+                    pass
+                i += len(escaped)
+                continue
+            self._field_value += ch
+            i += 1
+        self._field_start += i
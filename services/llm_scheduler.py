@@ -0,0 +1,270 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional
+from services.metrics import Counter, Gauge, STAGE_SECONDS
+from services.tracing import record_span
+from config.settings import LLM_MAX_CONCURRENT, LLM_MAX_QUEUE, LLM_QUEUE_NOTICE_AFTER
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше - важнее
+PRIORITY_ACTION = 0  # Ход игрока
+PRIORITY_NEW_GAME = 1  # /new с описанием приключения
+PRIORITY_BACKGROUND = 2  # Фоновая работа (пул подземелий)
+PRIORITY_NAMES = {PRIORITY_ACTION: "action", PRIORITY_NEW_GAME: "new_game", PRIORITY_BACKGROUND: "background"}
+
+# Как часто ожидающий в потоке запрос проверяет abort_if и время до уведомления
+_POLL_INTERVAL = 0.25
+
+LLM_SCHEDULER_REQUESTS = Counter("llm_scheduler_requests_total", "Запросы слота Ollama", ("priority", "result"))
+LLM_QUEUE_WAIT_SECONDS = Counter("llm_queue_wait_seconds_total", "Время ожидания слота Ollama", ("priority",))
+
+
+class LlmQueueFullError(Exception):
+    """Очередь к Ollama переполнена, запрос отклонён без ожидания"""
+
+
+class _Ticket:
+    """Запрос слота; в потоке ждёт event, в event loop - future"""
+    __slots__ = ("key", "priority", "granted", "event", "future", "loop")
+
+    def __init__(self, key: Hashable, priority: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.key = key
+        self.priority = priority
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+
+class LlmScheduler:
+    """Общая очередь запросов к Ollama с ограничением параллельности.
+
+    Одновременно выполняется не больше max_concurrent генераций (по числу
+    параллельных слотов сервера). Остальные ждут: сначала более важный класс
+    приоритета, внутри класса - по кругу между чатами, так что серия запросов
+    одного чата не задерживает остальные чаты. Если в очереди уже max_queue
+    запросов, новый запрос игрока отклоняется LlmQueueFullError, а фоновый -
+    просто не выполняется. Работает и из потоков, и из event loop.
+    """
+
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENT, max_queue: int = LLM_MAX_QUEUE,
+                 notice_after: float = LLM_QUEUE_NOTICE_AFTER):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.notice_after = notice_after
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        # Приоритет -> чат -> запросы чата; порядок чатов - очередь обхода по кругу
+        self._queues: Dict[int, "OrderedDict[Hashable, Deque[_Ticket]]"] = {}
+
+    @property
+    def active(self) -> int:
+        """Сколько генераций выполняется сейчас"""
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        """Сколько запросов ждёт слота"""
+        return self._waiting
+
+    @contextmanager
+    def slot(self, chat_id: Optional[int], priority: int = PRIORITY_ACTION,
+             on_queued: Callable[[int], None] = None, abort_if: Callable[[], bool] = None):
+        """Слот генерации на время блока; в блок передаётся False, если фоновый запрос не дождался слота.
+
+        on_queued(position) вызывается один раз, если ожидание длится дольше notice_after.
+        """
+        ticket = self._enqueue(chat_id, priority, None)
+        if ticket is None:
+            yield False
+            return
+        if not ticket.granted:
+            started = time.monotonic()
+            if not self._wait(ticket, started, on_queued, abort_if):
+                yield False
+                return
+            waited = time.monotonic() - started
+            LLM_QUEUE_WAIT_SECONDS.inc(waited, priority=PRIORITY_NAMES[priority])
+            STAGE_SECONDS.observe(waited, stage="llm_queue")
+            record_span("llm_queue", waited, priority=PRIORITY_NAMES[priority])
+        else:
+            STAGE_SECONDS.observe(0, stage="llm_queue")
+        try:
+            yield True
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def slot_async(self, chat_id: Optional[int], priority: int = PRIORITY_ACTION,
+                         on_queued: Callable[[int], Awaitable[None]] = None):
+        """Асинхронный slot(); on_queued - корутина"""
+        ticket = self._enqueue(chat_id, priority, asyncio.get_running_loop())
+        if ticket is None:
+            yield False
+            return
+        if not ticket.granted:
+            started = time.monotonic()
+            await self._wait_async(ticket, on_queued)
+            waited = time.monotonic() - started
+            LLM_QUEUE_WAIT_SECONDS.inc(waited, priority=PRIORITY_NAMES[priority])
+            STAGE_SECONDS.observe(waited, stage="llm_queue")
+            record_span("llm_queue", waited, priority=PRIORITY_NAMES[priority])
+        else:
+            STAGE_SECONDS.observe(0, stage="llm_queue")
+        try:
+            yield True
+        finally:
+            self._release()
+
+    def position(self, ticket: _Ticket) -> int:
+        """Место запроса в очереди (1 - следующий)"""
+        with self._lock:
+            return self._position(ticket)
+
+    def _enqueue(self, chat_id: Optional[int], priority: int, loop) -> Optional[_Ticket]:
+        """Новый запрос: сразу со слотом, в очереди или None, если фоновый запрос не поместился"""
+        name = PRIORITY_NAMES[priority]
+        ticket = _Ticket(None, priority, loop)
+        # Запросы без чата независимы друг от друга
+        ticket.key = chat_id if chat_id is not None else ("request", id(ticket))
+        with self._lock:
+            if self._active < self.max_concurrent and self._waiting == 0:
+                self._active += 1
+                ticket.granted = True
+                LLM_SCHEDULER_REQUESTS.inc(priority=name, result="immediate")
+                return ticket
+            if self._waiting >= self.max_queue:
+                LLM_SCHEDULER_REQUESTS.inc(priority=name, result="rejected")
+                if priority == PRIORITY_BACKGROUND:
+                    return None
+                logger.warning(f"[LLM] Очередь переполнена ({self._waiting}), запрос чата {chat_id} отклонён")
+                raise LlmQueueFullError(self._waiting)
+            chats = self._queues.setdefault(priority, OrderedDict())
+            chats.setdefault(ticket.key, deque()).append(ticket)
+            self._waiting += 1
+        LLM_SCHEDULER_REQUESTS.inc(priority=name, result="queued")
+        return ticket
+
+    def _wait(self, ticket: _Ticket, started: float, on_queued, abort_if) -> bool:
+        """Ожидание слота в потоке; False - ожидание прервано abort_if"""
+        notified = on_queued is None
+        while not ticket.event.wait(_POLL_INTERVAL if abort_if is not None or not notified else None):
+            if abort_if is not None and abort_if():
+                if self._abandon(ticket):
+                    LLM_SCHEDULER_REQUESTS.inc(priority=PRIORITY_NAMES[ticket.priority], result="aborted")
+                    return False
+                # Слот выдан одновременно с отменой - он уже наш
+                return True
+            if not notified and time.monotonic() - started >= self.notice_after:
+                notified = True
+                try:
+                    on_queued(self.position(ticket))
+                except Exception as e:
+                    logger.error(f"[LLM] Ошибка уведомления о месте в очереди: {e}")
+        return True
+
+    async def _wait_async(self, ticket: _Ticket, on_queued):
+        """Ожидание слота в event loop; при отмене задачи запрос убирается из очереди"""
+        try:
+            if on_queued is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket.future), self.notice_after)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    await on_queued(self.position(ticket))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"[LLM] Ошибка уведомления о месте в очереди: {e}")
+            await ticket.future
+        except asyncio.CancelledError:
+            if not self._abandon(ticket):
+                # Слот уже выдан отменённой задаче - передаём его дальше
+                self._release()
+            raise
+
+    def _abandon(self, ticket: _Ticket) -> bool:
+        """Удаление ждущего запроса из очереди; False, если слот ему уже выдан"""
+        with self._lock:
+            if ticket.granted:
+                return False
+            chats = self._queues[ticket.priority]
+            queue = chats[ticket.key]
+            queue.remove(ticket)
+            if not queue:
+                del chats[ticket.key]
+            self._waiting -= 1
+            return True
+
+    def _release(self):
+        """Освобождение слота и выдача его следующему запросу"""
+        with self._lock:
+            ticket = self._next()
+            if ticket is None:
+                self._active -= 1
+                return
+            # Слот переходит следующему запросу, число занятых не меняется
+            ticket.granted = True
+        if ticket.loop is None:
+            ticket.event.set()
+        else:
+            ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+
+    def _next(self) -> Optional[_Ticket]:
+        """Следующий запрос под self._lock: важнейший класс, внутри - следующий по кругу чат"""
+        for priority in sorted(self._queues):
+            chats = self._queues[priority]
+            if not chats:
+                continue
+            key, queue = next(iter(chats.items()))
+            ticket = queue.popleft()
+            if queue:
+                # Остальные запросы чата ждут, пока до него снова дойдёт очередь
+                chats.move_to_end(key)
+            else:
+                del chats[key]
+            self._waiting -= 1
+            return ticket
+        return None
+
+    def _position(self, ticket: _Ticket) -> int:
+        """Место запроса при обходе очереди по кругу (под self._lock)"""
+        if ticket.granted:
+            return 0
+        ahead = 0
+        for priority in sorted(self._queues):
+            chats = self._queues[priority]
+            if priority < ticket.priority:
+                ahead += sum(len(queue) for queue in chats.values())
+                continue
+            if priority > ticket.priority:
+                break
+            keys = list(chats)
+            own_index = keys.index(ticket.key)
+            depth = chats[ticket.key].index(ticket)
+            # Чаты впереди по кругу успеют получить depth + 1 слотов, остальные - depth
+            for index, key in enumerate(keys):
+                ahead += min(len(chats[key]), depth + (1 if index < own_index else 0))
+        return ahead + 1
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+# Общий планировщик запросов к Ollama
+llm_scheduler = LlmScheduler()
+
+# Текущая загрузка читается при каждом запросе /metrics
+LLM_ACTIVE = Gauge("llm_active", "Генерации Ollama, занявшие слот планировщика", func=lambda: llm_scheduler.active)
+LLM_WAITING = Gauge("llm_queue_length", "Запросы, ждущие слота Ollama", func=lambda: llm_scheduler.waiting)
@@ -0,0 +1,217 @@
+import time
+import bisect
+import asyncio
+import functools
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Все созданные метрики процесса
+_registry: List["_Metric"] = []
+
+# Границы корзин гистограмм по умолчанию, секунды: от кеша и SQLite до генерации Ollama
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class _Metric:
+    """Общее для метрик: имя, описание, метки и регистрация"""
+
+    type = ""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """Значения для экспорта: (суффикс имени, метки, значение)"""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонный счётчик с метками"""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """Увеличение счётчика"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Текущее значение для набора меток"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def items(self) -> List[Tuple[Dict[str, str], float]]:
+        """Все значения в виде (метки, значение)"""
+        with self._lock:
+            return [(dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        return [("", labels, value) for labels, value in self.items()]
+
+
+class Gauge(_Metric):
+    """Текущее значение (в работе, в очереди); func - значение читается при экспорте"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 func: Optional[Callable[[], float]] = None):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._func = func
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        if self._func is not None:
+            return self._func()
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        if self._func is not None:
+            return [("", {}, self._func())]
+        with self._lock:
+            return [("", dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+
+class _Timer:
+    """Замер длительности в гистограмму: контекстный менеджер и декоратор (в том числе корутин)"""
+
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self._histogram = histogram
+        self._labels = labels
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, **self._labels)
+
+    def __call__(self, func):
+        histogram, labels = self._histogram, self._labels
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed_async(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, **labels)
+            return timed_async
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return timed
+
+
+class Histogram(_Metric):
+    """Распределение длительностей по корзинам (в экспорте - накопительно, как в Prometheus)"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики корзин (последняя - +Inf), сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        """Учёт одного наблюдения"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels) -> _Timer:
+        """Замер длительности блока with или вызовов декорируемой функции"""
+        return _Timer(self, labels)
+
+    def count(self, **labels) -> int:
+        """Число наблюдений для набора меток"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = [(key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+# Длительность этапов обработки обновления: от ожидания в диспетчере до отправки ответа
+STAGE_SECONDS = Histogram("pipeline_stage_seconds", "Длительность этапов обработки обновления", ("stage",))
+
+
+def all_metrics() -> list:
+    """Список всех зарегистрированных метрик"""
+    return list(_registry)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    lines = []
+    for metric in all_metrics():
+        lines.append(f"# HELP {metric.name} {_escape(metric.description)}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, labels, value in metric.samples():
+            rendered = ",".join(f'{name}="{_escape(str(label))}"' for name, label in labels.items())
+            lines.append(f"{metric.name}{suffix}{{{rendered}}} {_format_value(value)}" if rendered
+                         else f"{metric.name}{suffix} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
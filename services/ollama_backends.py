@@ -0,0 +1,179 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence
+from services.ollama_health import CircuitBreaker
+from services.metrics import Counter, Gauge
+from config.settings import (
+    OLLAMA_BACKENDS,
+    OLLAMA_STICKY_MAX_EXTRA,
+    OLLAMA_SESSION_MAX_CHATS,
+    OLLAMA_BREAKER_FAILURE_THRESHOLD,
+    OLLAMA_BREAKER_BACKOFF,
+    OLLAMA_BREAKER_MAX_BACKOFF,
+)
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+OLLAMA_BACKEND_REQUESTS = Counter("ollama_backend_requests_total", "Запросы к серверам Ollama", ("backend", "route"))
+
+
+class OllamaBackend:
+    """Сервер Ollama: адрес, модели, вес и собственный автомат защиты"""
+
+    def __init__(self, url: str, models: Sequence[str] = (), weight: float = 1):
+        self.url = url
+        self.health_url = url.replace("/api/chat", "/api/tags")
+        self.models = frozenset(models)
+        self.weight = weight
+        self.breaker = CircuitBreaker(
+            failure_threshold=OLLAMA_BREAKER_FAILURE_THRESHOLD,
+            backoff=OLLAMA_BREAKER_BACKOFF,
+            max_backoff=OLLAMA_BREAKER_MAX_BACKOFF,
+            name=f"Ollama {url}"
+        )
+        # Запросы этого процесса, которые сейчас выполняются на сервере
+        self._in_flight = 0
+        # Общая таблица загрузки процессов-обработчиков: (таблица, строка процесса, столбец сервера, столбцов)
+        self._shared = None
+
+    @property
+    def in_flight(self) -> int:
+        """Запросы на сервере: при общей таблице - от всех процессов-обработчиков"""
+        if self._shared is None:
+            return self._in_flight
+        table, _, column, columns = self._shared
+        return sum(table[column::columns])
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.weight
+
+    def _add_in_flight(self, delta: int):
+        self._in_flight += delta
+        if self._shared is not None:
+            table, row, column, columns = self._shared
+            # Строку пишет только свой процесс, поэтому блокировка между процессами не нужна
+            table[row * columns + column] = self._in_flight
+
+    def serves(self, model: str) -> bool:
+        return not self.models or model in self.models
+
+
+class BackendPool:
+    """Выбор сервера Ollama для запроса.
+
+    Запрос идёт на доступный сервер с нужной моделью и наименьшим числом
+    выполняемых запросов на единицу веса. Ходы одного чата по возможности
+    остаются на одном сервере: там в KV-кеше уже лежит их общий префикс.
+    Сервер, чей автомат защиты разомкнут, не получает запросов, пока
+    проверка доступности или пробный запрос не вернут его в работу.
+    """
+
+    def __init__(self, backends: Iterable[OllamaBackend], sticky_max_extra: int = OLLAMA_STICKY_MAX_EXTRA,
+                 max_chats: int = OLLAMA_SESSION_MAX_CHATS):
+        self.backends: List[OllamaBackend] = list(backends)
+        self.sticky_max_extra = sticky_max_extra
+        self.max_chats = max_chats
+        self._lock = threading.Lock()
+        # Чат -> сервер его последнего хода (LRU)
+        self._affinity: "OrderedDict[int, OllamaBackend]" = OrderedDict()
+
+    @classmethod
+    def from_settings(cls, config: Iterable[dict] = OLLAMA_BACKENDS) -> "BackendPool":
+        return cls(OllamaBackend(entry["url"], entry.get("models", ()), entry.get("weight", 1)) for entry in config)
+
+    def available(self, model: str = None) -> bool:
+        """Есть ли сервер (с моделью model), готовый принять запрос"""
+        return any(backend.breaker.is_available() and (model is None or backend.serves(model))
+                   for backend in self.backends)
+
+    def acquire(self, model: str, chat_id: Optional[int] = None,
+                avoid: Iterable[OllamaBackend] = ()) -> Optional[OllamaBackend]:
+        """Сервер для запроса (учитывается как выполняемый до release) или None, если подходящих нет.
+
+        avoid - серверы, уже не ответившие на этот запрос: они выбираются, только если других нет.
+        """
+        excluded = set()
+        avoid = {id(backend) for backend in avoid}
+        while True:
+            with self._lock:
+                backend, route = self._choose(model, chat_id, excluded, avoid)
+                if backend is None:
+                    return None
+                backend._add_in_flight(1)
+            # Полуоткрытый автомат пропускает только один пробный запрос
+            if backend.breaker.allow_request():
+                break
+            self.release(backend)
+            excluded.add(id(backend))
+        if chat_id is not None:
+            with self._lock:
+                self._affinity[chat_id] = backend
+                self._affinity.move_to_end(chat_id)
+                while len(self._affinity) > self.max_chats:
+                    self._affinity.popitem(last=False)
+        OLLAMA_BACKEND_REQUESTS.inc(backend=backend.url, route=route)
+        return backend
+
+    def release(self, backend: OllamaBackend, chat_id: Optional[int] = None, failed: bool = False):
+        """Запрос к серверу завершён; после сбоя повтор чата идёт на наименее загруженный сервер"""
+        with self._lock:
+            backend._add_in_flight(-1)
+            if failed and chat_id is not None and self._affinity.get(chat_id) is backend:
+                del self._affinity[chat_id]
+
+    def _choose(self, model: str, chat_id: Optional[int], excluded: set, avoid: set):
+        """Сервер и причина выбора под self._lock"""
+        candidates = [backend for backend in self.backends
+                      if id(backend) not in excluded and backend.serves(model) and backend.breaker.is_available()]
+        if not candidates:
+            return None, None
+        # Сбойный сервер отвечает быстрее всех и иначе забирал бы все повторы
+        preferred = [backend for backend in candidates if id(backend) not in avoid]
+        candidates = preferred or candidates
+        # При равной загрузке - более мощный сервер
+        best = min(candidates, key=lambda backend: (backend.load, -backend.weight))
+        sticky = self._affinity.get(chat_id) if chat_id is not None else None
+        if sticky is not None and sticky is not best and sticky in candidates:
+            if (sticky.in_flight - self.sticky_max_extra) / sticky.weight <= best.load:
+                return sticky, "sticky"
+            return best, "rebalanced"
+        return best, "sticky" if sticky is best else "least_loaded"
+
+    def share_load(self, table, worker: int):
+        """Учёт выполняемых запросов в общей таблице процессов-обработчиков (см. shared_load_table).
+
+        Каждый процесс видит запросы всех процессов, и выбор наименее
+        загруженного сервера учитывает общую нагрузку, а не только свою.
+        """
+        columns = len(self.backends)
+        with self._lock:
+            for column, backend in enumerate(self.backends):
+                backend._shared = (table, worker, column, columns)
+                table[worker * columns + column] = backend._in_flight
+
+    def stats(self) -> Dict[str, dict]:
+        """Состояние серверов: выполняемые запросы и автомат защиты"""
+        with self._lock:
+            return {backend.url: {"in_flight": backend.in_flight, "weight": backend.weight,
+                                  "state": backend.breaker.state} for backend in self.backends}
+
+
+def shared_load_table(ctx, workers: int, backends: int):
+    """Таблица выполняемых запросов: строка на процесс-обработчик, столбец на сервер"""
+    return ctx.RawArray("i", workers * backends)
+
+
+def reset_worker_load(table, worker: int, backends: int):
+    """Обнуление строки процесса перед его (пере)запуском: запросы упавшего процесса уже не выполняются"""
+    table[worker * backends:(worker + 1) * backends] = [0] * backends
+
+
+# Серверы Ollama из настроек
+ollama_backends = BackendPool.from_settings()
+
+# Текущая загрузка читается при каждом запросе /metrics
+OLLAMA_IN_FLIGHT = Gauge("ollama_in_flight", "Запросы, выполняющиеся на серверах Ollama",
+                         func=lambda: sum(backend.in_flight for backend in ollama_backends.backends))
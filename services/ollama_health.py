@@ -0,0 +1,151 @@
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Автомат защиты для запросов к Ollama.
+
+    closed    - запросы идут как обычно, считаем подряд идущие сбои;
+    open      - сервер считается недоступным, запросы сразу отклоняются;
+    half_open - после паузы пропускаем один пробный запрос.
+    Пауза удваивается при каждом неудачном пробном запросе.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, backoff: float = 5, max_backoff: float = 300, name: str = "Ollama"):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._backoff = backoff
+        self._open_until = 0.0
+        self._trial_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def is_available(self) -> bool:
+        """Пропустит ли allow_request() запрос (без занятия пробного запроса)"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == self.OPEN and now < self._open_until:
+                return False
+            return self._trial_started is None or now - self._trial_started >= self.max_backoff
+
+    def allow_request(self) -> bool:
+        """Можно ли отправить запрос прямо сейчас"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() < self._open_until:
+                    return False
+                self._state = self.HALF_OPEN
+            # half_open: пропускаем только один пробный запрос,
+            # зависший пробный запрос не блокирует автомат навсегда
+            now = time.monotonic()
+            if self._trial_started is not None and now - self._trial_started < self.max_backoff:
+                return False
+            self._trial_started = now
+            return True
+
+    def record_success(self):
+        """Сервер ответил"""
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"[{self.name}] Сервер снова доступен")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._backoff = self.base_backoff
+            self._trial_started = None
+
+    def record_failure(self):
+        """Сервер не ответил или вернул ошибку"""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN:
+                self._backoff = min(self._backoff * 2, self.max_backoff)
+                self._open()
+            elif self._state == self.CLOSED and self._failures >= self.failure_threshold:
+                self._open()
+            self._trial_started = None
+
+    def record_probe_success(self):
+        """Фоновая проверка прошла: разрешаем пробный запрос, не дожидаясь конца паузы"""
+        with self._lock:
+            if self._state == self.OPEN:
+                self._state = self.HALF_OPEN
+            elif self._state == self.CLOSED:
+                self._failures = 0
+
+    def _open(self):
+        self._state = self.OPEN
+        self._open_until = time.monotonic() + self._backoff
+        logger.warning(f"[{self.name}] Сервер недоступен, запросы отклоняются {self._backoff:.0f} с")
+
+
+class OllamaHealthMonitor:
+    """Фоновая проверка доступности Ollama, результат передаётся в CircuitBreaker"""
+
+    def __init__(self, probe: Callable[[], bool], breaker: CircuitBreaker, interval: float = 15):
+        self.name = breaker.name
+        self._probe = probe
+        self._breaker = breaker
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.is_healthy: Optional[bool] = None
+        self.last_check: Optional[float] = None
+
+    def start(self):
+        """Запуск фонового потока проверки"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"health-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка фонового потока"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._interval)
+            self._thread = None
+
+    def check_now(self) -> bool:
+        """Однократная проверка с обновлением состояния"""
+        healthy = self._probe()
+        if healthy and not self.is_healthy:
+            logger.info(f"[{self.name}] Проверка доступности: сервер отвечает")
+        elif not healthy and self.is_healthy is not False:
+            logger.warning(f"[{self.name}] Проверка доступности: сервер не отвечает")
+        self.is_healthy = healthy
+        self.last_check = time.time()
+        if healthy:
+            self._breaker.record_probe_success()
+        else:
+            self._breaker.record_failure()
+        return healthy
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check_now()
+            except Exception as e:
+                logger.error(f"[{self.name}] Ошибка проверки доступности: {e}")
+            self._stop.wait(self._interval)
+
@@ -1,115 +1,577 @@
 import json
+import time
+import asyncio
 import logging
+import threading
+from contextlib import contextmanager
+import aiohttp
 import requests
-from typing import TypeVar, Generic
+from typing import Awaitable, Callable, TypeVar, Generic, List, Optional, Tuple
 from pydantic import ValidationError
-from config.settings import OLLAMA_URL, OLLAMA_MODEL
+from config.settings import (
+    OLLAMA_URL,
+    OLLAMA_MODEL,
+    OLLAMA_STREAM,
+    OLLAMA_STREAM_MAX_PREAMBLE,
+    OLLAMA_STRUCTURED_OUTPUT,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_HEALTH_TIMEOUT,
+    OLLAMA_HEALTH_CHECK_INTERVAL,
+)
+from services.ollama_health import OllamaHealthMonitor
+from services.ollama_backends import OllamaBackend, ollama_backends
+from services.json_stream import StreamingJsonScanner
+from services.metrics import Counter, STAGE_SECONDS
+from services.tracing import span, annotate
+from services.ollama_session import ChatSession
+from services.llm_scheduler import llm_scheduler, PRIORITY_ACTION, PRIORITY_BACKGROUND
+from models.schema import ollama_format_schema
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
 T = TypeVar('T')
 
-def check_ollama_server() -> bool:
+OLLAMA_HEALTH_URL = OLLAMA_URL.replace("/api/chat", "/api/tags")
+OLLAMA_TIMEOUT = 1800
+# Поле, которое показывается игроку ещё во время генерации
+STREAM_PREVIEW_FIELD = "last_action_description"
+# Сколько кусков потока читать после конца JSON в ожидании итоговой статистики
+STREAM_TAIL_CHUNKS = 16
+
+# Общая HTTP-сессия для асинхронных запросов (создаётся в event loop при первом запросе)
+_async_session: Optional[aiohttp.ClientSession] = None
+
+# Фоновые проверки доступности - по одной на сервер
+_health_monitors: List[OllamaHealthMonitor] = []
+
+# Запросы игроков в работе: фоновые генерации уступают им Ollama
+_live_requests = 0
+_last_live_request = 0.0
+_live_lock = threading.Lock()
+
+# Сколько вызовов и сколько генераций (включая повторные) ушло на каждую схему
+OLLAMA_CALLS = Counter("ollama_calls_total", "Вызовы ollama_with_validation", ("schema",))
+OLLAMA_GENERATIONS = Counter("ollama_generations_total", "Генерации Ollama по результату", ("schema", "outcome"))
+# Время и токены из полей ответа Ollama: prefill промпта против генерации ответа
+OLLAMA_PROMPT_EVAL_SECONDS = Counter("ollama_prompt_eval_seconds_total", "Время обработки промпта", ("schema",))
+OLLAMA_EVAL_SECONDS = Counter("ollama_eval_seconds_total", "Время генерации ответа", ("schema",))
+OLLAMA_LOAD_SECONDS = Counter("ollama_load_seconds_total", "Время загрузки модели", ("schema",))
+OLLAMA_PROMPT_TOKENS = Counter("ollama_prompt_tokens_total", "Обработано токенов промпта", ("schema",))
+OLLAMA_EVAL_TOKENS = Counter("ollama_eval_tokens_total", "Сгенерировано токенов", ("schema",))
+
+class OllamaUnavailableError(Exception):
+    """Ollama недоступен, запрос отклонён без ожидания"""
+
+def check_ollama_server(health_url: str = OLLAMA_HEALTH_URL) -> bool:
     """Проверка доступности Ollama сервера"""
     try:
         # Проверяем доступность сервера
-        health_url = OLLAMA_URL.replace("/api/chat", "/api/tags")
-        response = requests.get(health_url, timeout=900)
+        response = requests.get(health_url, timeout=OLLAMA_HEALTH_TIMEOUT)
         return response.status_code == 200
     except:
         return False
 
-def ollama_with_validation(prompt: str, schema_model: Generic[T], retries: int = 3, system_prompt: str = None) -> T:
-    """Отправка запроса к Ollama с валидацией ответа"""
-    
-    # Проверяем, что промпт не пустой
-    if not prompt or not prompt.strip():
-        logger.warning("[Ollama] Пустой промпт")
-        return None
-    
-    # Проверяем доступность сервера
-    if not check_ollama_server():
-        logger.error(f"[Ollama] Сервер недоступен по адресу {OLLAMA_URL}")
-        return None
+def start_health_monitor():
+    """Запуск фоновой проверки доступности серверов Ollama"""
+    if _health_monitors:
+        return
+    for backend in ollama_backends.backends:
+        monitor = OllamaHealthMonitor(lambda url=backend.health_url: check_ollama_server(url), backend.breaker,
+                                      interval=OLLAMA_HEALTH_CHECK_INTERVAL)
+        monitor.start()
+        _health_monitors.append(monitor)
 
-    for attempt in range(retries):
+def stop_health_monitor():
+    """Остановка фоновой проверки доступности Ollama"""
+    while _health_monitors:
+        _health_monitors.pop().stop()
+
+def _ensure_available():
+    """Быстрый отказ, если ни один сервер Ollama сейчас не считается доступным"""
+    if not ollama_backends.available(OLLAMA_MODEL):
+        logger.warning(f"[Ollama] Нет доступных серверов с моделью {OLLAMA_MODEL}, запрос отклонён")
+        raise OllamaUnavailableError(OLLAMA_MODEL)
+
+def _acquire_backend(payload: dict, chat_id: Optional[int], failed_backends: List[OllamaBackend]) -> OllamaBackend:
+    """Сервер для очередной попытки запроса (освобождается через ollama_backends.release)"""
+    backend = ollama_backends.acquire(payload["model"], chat_id, avoid=failed_backends)
+    if backend is None:
+        logger.warning(f"[Ollama] Нет доступных серверов с моделью {payload['model']}")
+        raise OllamaUnavailableError(payload["model"])
+    annotate(backend=backend.url, breaker=backend.breaker.state)
+    return backend
+
+@contextmanager
+def _live_request(background: bool):
+    """Учёт запроса игрока на время его выполнения"""
+    global _live_requests, _last_live_request
+    if background:
+        yield
+        return
+    with _live_lock:
+        _live_requests += 1
+        _last_live_request = time.monotonic()
+    try:
+        yield
+    finally:
+        with _live_lock:
+            _live_requests -= 1
+            _last_live_request = time.monotonic()
+
+def live_requests_in_flight() -> int:
+    """Сколько запросов игроков сейчас выполняется"""
+    return _live_requests
+
+def seconds_since_live_request() -> float:
+    """Сколько секунд Ollama не занят запросами игроков (0 - занят сейчас)"""
+    with _live_lock:
+        if _live_requests:
+            return 0.0
+        return time.monotonic() - _last_live_request
+
+def _record_generation(schema_model, outcome: str):
+    """Учёт результата одной генерации"""
+    OLLAMA_GENERATIONS.inc(schema=schema_model.__name__, outcome=outcome)
+    annotate(outcome=outcome)
+
+def _record_timings(schema_model, response_data: dict):
+    """Учёт времени prefill и генерации из итоговых полей ответа Ollama (наносекунды)"""
+    schema = schema_model.__name__
+    prompt_eval = response_data.get("prompt_eval_duration", 0) / 1e9
+    evaluation = response_data.get("eval_duration", 0) / 1e9
+    OLLAMA_PROMPT_EVAL_SECONDS.inc(prompt_eval, schema=schema)
+    OLLAMA_EVAL_SECONDS.inc(evaluation, schema=schema)
+    OLLAMA_LOAD_SECONDS.inc(response_data.get("load_duration", 0) / 1e9, schema=schema)
+    OLLAMA_PROMPT_TOKENS.inc(response_data.get("prompt_eval_count", 0), schema=schema)
+    OLLAMA_EVAL_TOKENS.inc(response_data.get("eval_count", 0), schema=schema)
+    if "eval_duration" in response_data:
+        STAGE_SECONDS.observe(prompt_eval, stage="llm_prompt_eval")
+        STAGE_SECONDS.observe(evaluation, stage="llm_eval")
+        annotate(prompt_tokens=response_data.get("prompt_eval_count", 0), eval_tokens=response_data.get("eval_count", 0),
+                 prompt_eval_ms=round(prompt_eval * 1000, 1), eval_ms=round(evaluation * 1000, 1))
+        logger.info(f"[Ollama] Промпт: {response_data.get('prompt_eval_count', 0)} ток. за {prompt_eval:.2f} с, "
+                    f"ответ: {response_data.get('eval_count', 0)} ток. за {evaluation:.2f} с")
+
+def generation_stats() -> dict:
+    """Статистика генераций по схемам: сколько генераций потрачено впустую и куда уходит время"""
+    stats = {}
+
+    def entry_for(schema: str) -> dict:
+        return stats.setdefault(schema, {"calls": 0, "generations": 0, "successes": 0})
+
+    for labels, value in OLLAMA_CALLS.items():
+        entry_for(labels["schema"])["calls"] = int(value)
+    for labels, value in OLLAMA_GENERATIONS.items():
+        entry = entry_for(labels["schema"])
+        entry["generations"] += int(value)
+        if labels["outcome"] == "success":
+            entry["successes"] += int(value)
+    for key, counter in (("prompt_eval_seconds", OLLAMA_PROMPT_EVAL_SECONDS), ("eval_seconds", OLLAMA_EVAL_SECONDS),
+                         ("prompt_tokens", OLLAMA_PROMPT_TOKENS), ("eval_tokens", OLLAMA_EVAL_TOKENS)):
+        for labels, value in counter.items():
+            entry_for(labels["schema"])[key] = value
+    for entry in stats.values():
+        entry["wasted"] = entry["generations"] - entry["successes"]
+        entry["retry_rate"] = entry["wasted"] / entry["generations"] if entry["generations"] else 0.0
+    return stats
+
+def log_generation_stats():
+    """Вывод статистики генераций в лог"""
+    for schema, entry in generation_stats().items():
+        logger.info(f"[Ollama] {schema}: вызовов {entry['calls']}, генераций {entry['generations']}, "
+                    f"впустую {entry['wasted']} ({entry['retry_rate']:.1%}), "
+                    f"prefill {entry.get('prompt_eval_seconds', 0):.1f} с / {int(entry.get('prompt_tokens', 0))} ток., "
+                    f"генерация {entry.get('eval_seconds', 0):.1f} с / {int(entry.get('eval_tokens', 0))} ток.")
+
+@STAGE_SECONDS.time(stage="payload")
+def _build_payload(prompt: str, system_prompt: str = None, stream: bool = False, schema_model=None,
+                   session: ChatSession = None) -> dict:
+    """Формирование тела запроса к Ollama"""
+    if session is not None:
+        # Системный промпт и прошлые ходы чата - неизменный префикс запроса
+        messages = session.messages(system_prompt, prompt)
+    else:
         messages = []
-        
+
         # Добавляем системный промпт, если он есть
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
-        
+
         # Добавляем пользовательский промпт
         messages.append({"role": "user", "content": prompt})
-        
-        payload = {
-            "model": OLLAMA_MODEL,
-            "messages": messages,
-            "stream": False
-        }
+
+    payload = {
+        "model": OLLAMA_MODEL,
+        "messages": messages,
+        "stream": stream,
+        # Модель остаётся загруженной между ходами игроков
+        "keep_alive": OLLAMA_KEEP_ALIVE
+    }
+    # Structured output: Ollama ограничивает генерацию JSON Schema модели (Ollama >= 0.5)
+    if OLLAMA_STRUCTURED_OUTPUT and schema_model is not None:
+        payload["format"] = ollama_format_schema(schema_model)
+    return payload
+
+class _StreamReader:
+    """Сборка потокового ответа Ollama (NDJSON) с разбором JSON на лету"""
+
+    def __init__(self, attempt: int):
+        self.attempt = attempt
+        self.scanner = StreamingJsonScanner(STREAM_PREVIEW_FIELD, max_preamble=OLLAMA_STREAM_MAX_PREAMBLE)
+        self.last_chunk: dict = {}
+        self._last_preview: Tuple[str, bool] = ("", False)
+        self._tail_chunks = 0
+
+    def feed_line(self, line) -> bool:
+        """Обработка строки потока, True - читать дальше не нужно"""
+        if not line or not line.strip():
+            return False
+        chunk = json.loads(line)
+        self.last_chunk = chunk
+        self.scanner.feed(chunk.get("message", {}).get("content", ""))
+        if self.scanner.is_invalid:
+            logger.warning(f"[Attempt {self.attempt+1}] Генерация прервана: {self.scanner.invalid_reason}")
+            return True
+        if chunk.get("done", False):
+            return True
+        # Объект закончен: ждём итоговый кусок со статистикой, но если модель
+        # продолжает писать - соединение закрывается
+        if self.scanner.is_complete:
+            self._tail_chunks += 1
+            return self._tail_chunks > STREAM_TAIL_CHUNKS
+        return False
+
+    def new_preview(self) -> Optional[Tuple[str, bool]]:
+        """Новое состояние поля предпросмотра, если оно изменилось"""
+        preview = self.scanner.preview()
+        if not preview[0] or preview == self._last_preview:
+            return None
+        self._last_preview = preview
+        return preview
+
+    def response_data(self) -> Optional[dict]:
+        """Ответ в том же виде, что и без потоковой передачи"""
+        if self.scanner.is_invalid:
+            return None
+        response_data = {key: value for key, value in self.last_chunk.items() if key != "message"}
+        response_data["message"] = {"role": "assistant", "content": self.scanner.json_text or self.scanner.text}
+        return response_data
+
+@STAGE_SECONDS.time(stage="parse")
+def _parse_response(response_data: dict, schema_model: Generic[T], attempt: int,
+                    validator: Callable[[T], T] = None) -> Optional[T]:
+    """Извлечение и валидация JSON из ответа Ollama, None - ответ непригоден"""
+    if "message" not in response_data or "content" not in response_data["message"]:
+        logger.warning(f"[Attempt {attempt+1}] Неожиданный формат ответа от Ollama")
+        _record_generation(schema_model, "bad_response")
+        return None
+
+    content = response_data["message"]["content"]
+    logger.info(f"[Ollama] Получен ответ длиной {len(content)} символов")
+
+    # Очищаем контент от лишних символов
+    content = content.strip()
+    if not content:
+        logger.warning(f"[Attempt {attempt+1}] Пустой ответ от Ollama")
+        _record_generation(schema_model, "empty")
+        return None
+
+    # Проверяем на простые ответы типа "Okay" или "the user sent"
+    if any(simple_response in content.lower() for simple_response in ["okay", "the user sent", "empty message", "just the word"]):
+        logger.warning(f"[Attempt {attempt+1}] Ollama вернул простой ответ вместо JSON: {content}")
+        _record_generation(schema_model, "simple_response")
+        return None
+
+    # Пытаемся найти JSON в ответе
+    json_start = content.find('{')
+    json_end = content.rfind('}') + 1
+
+    if json_start == -1 or json_end == 0:
+        logger.warning(f"[Attempt {attempt+1}] JSON не найден в ответе: {content[:100]}...")
+        _record_generation(schema_model, "no_json")
+        return None
+
+    json_content = content[json_start:json_end]
+    logger.debug(f"[Ollama] Извлечен JSON: {json_content[:100]}...")
+
+    # Пытаемся распарсить JSON
+    try:
+        data = json.loads(json_content)
+        validated = schema_model.parse_obj(data)
+    except json.JSONDecodeError as e:
+        logger.error(f"[Attempt {attempt+1}] JSON decode error: {e}")
+        logger.debug(f"[Ollama] Содержимое ответа: {content[:200]}...")
+        _record_generation(schema_model, "json_error")
+        return None
+    except ValidationError as e:
+        logger.error(f"[Attempt {attempt+1}] Validation error: {e}")
+        _record_generation(schema_model, "validation_error")
+        return None
+
+    # Дополнительная проверка смысла ответа (например, что он не выходит за проекцию состояния)
+    if validator is not None:
         try:
-            logger.info(f"[Ollama] Отправка запроса к модели {OLLAMA_MODEL}...")
-            logger.debug(f"[Ollama] Промпт: {prompt[:200]}...")
-            # Увеличиваем таймаут до 60 секунд
-            resp = requests.post(OLLAMA_URL, json=payload, timeout=1800)
-            resp.raise_for_status()
-            
-            response_data = resp.json()
-            if "message" not in response_data or "content" not in response_data["message"]:
-                logger.warning(f"[Attempt {attempt+1}] Неожиданный формат ответа от Ollama")
+            validated = validator(validated)
+        except ValueError as e:
+            logger.error(f"[Attempt {attempt+1}] Ответ отклонён проверкой: {e}")
+            _record_generation(schema_model, "rejected")
+            return None
+
+    logger.info(f"[Ollama] Успешная валидация данных")
+    _record_generation(schema_model, "success")
+    return validated
+
+@STAGE_SECONDS.time(stage="llm_request")
+def _post_streaming(backend: OllamaBackend, payload: dict, attempt: int,
+                    on_partial: Callable[[str, bool], None] = None,
+                    abort_if: Callable[[], bool] = None) -> Optional[dict]:
+    """Потоковый запрос к Ollama с предпросмотром и досрочной остановкой"""
+    reader = _StreamReader(attempt)
+    with requests.post(backend.url, json=payload, timeout=OLLAMA_TIMEOUT, stream=True) as resp:
+        resp.raise_for_status()
+        backend.breaker.record_success()
+        for line in resp.iter_lines(decode_unicode=True):
+            if abort_if is not None and abort_if():
+                # Закрытие соединения останавливает генерацию в Ollama
+                return None
+            stop = reader.feed_line(line)
+            preview = reader.new_preview()
+            if on_partial and preview:
+                try:
+                    on_partial(*preview)
+                except Exception as e:
+                    logger.error(f"[Ollama] Ошибка отображения промежуточного ответа: {e}")
+            if stop:
+                break
+    return reader.response_data()
+
+def _ollama_span(prompt: str, system_prompt: Optional[str], schema_model, session: Optional[ChatSession]):
+    """Участок трассировки вызова Ollama с размерами промпта"""
+    return span("ollama", schema=schema_model.__name__, prompt_chars=len(prompt or ""),
+                system_chars=len(system_prompt or ""),
+                history_chars=sum(len(message["content"]) for message in session.history) if session is not None else 0)
+
+def ollama_with_validation(prompt: str, schema_model: Generic[T], retries: int = 3, system_prompt: str = None,
+                           on_partial: Callable[[str, bool], None] = None, validator: Callable[[T], T] = None,
+                           session: ChatSession = None, background: bool = False,
+                           abort_if: Callable[[], bool] = None, chat_id: int = None,
+                           priority: int = PRIORITY_ACTION, on_queued: Callable[[int], None] = None) -> T:
+    """Отправка запроса к Ollama с валидацией ответа.
+
+    on_partial(text, complete) вызывается в потоковом режиме по мере генерации
+    last_action_description. validator(result) может поправить результат или
+    отклонить его через ValueError - тогда генерация повторяется. session -
+    история чата для запроса (ход в неё записывает вызывающий). background - запрос не
+    от игрока; abort_if() проверяется в потоковом режиме и в очереди, и если
+    вернул True, генерация прерывается и возвращается None. Запрос ждёт
+    свободного слота в llm_scheduler с приоритетом priority (фоновый - с
+    низшим); on_queued(position) сообщает место в очереди при долгом ожидании.
+    """
+    if background:
+        priority = PRIORITY_BACKGROUND
+    with _ollama_span(prompt, system_prompt, schema_model, session):
+        # Пока серверы недоступны, в очередь не становимся: отказ сразу, а не после ожидания своей очереди
+        _ensure_available()
+        with _live_request(background), llm_scheduler.slot(chat_id, priority, on_queued, abort_if) as granted:
+            if not granted:
+                _record_generation(schema_model, "preempted")
+                return None
+            return _ollama_with_validation(prompt, schema_model, retries, system_prompt, on_partial, validator,
+                                           session, abort_if, chat_id)
+
+def _ollama_with_validation(prompt: str, schema_model: Generic[T], retries: int, system_prompt: Optional[str],
+                            on_partial: Optional[Callable[[str, bool], None]], validator: Optional[Callable[[T], T]],
+                            session: Optional[ChatSession], abort_if: Optional[Callable[[], bool]],
+                            chat_id: Optional[int]) -> T:
+
+    # Проверяем, что промпт не пустой
+    if not prompt or not prompt.strip():
+        logger.warning("[Ollama] Пустой промпт")
+        return None
+
+    # За время ожидания в очереди серверы могли стать недоступны (или полуоткрыты для пробного запроса)
+    _ensure_available()
+
+    OLLAMA_CALLS.inc(schema=schema_model.__name__)
+    payload = _build_payload(prompt, system_prompt, stream=OLLAMA_STREAM, schema_model=schema_model, session=session)
+    failed_backends = []
+    for attempt in range(retries):
+        with span("ollama_attempt", attempt=attempt + 1):
+            # Каждая попытка - на наименее загруженный доступный сервер
+            backend = _acquire_backend(payload, chat_id, failed_backends)
+            failed = False
+            try:
+                logger.info(f"[Ollama] Отправка запроса к модели {OLLAMA_MODEL} на {backend.url}...")
+                logger.debug(f"[Ollama] Промпт: {prompt[:200]}...")
+                if OLLAMA_STREAM:
+                    response_data = _post_streaming(backend, payload, attempt, on_partial, abort_if)
+                    if response_data is None:
+                        if abort_if is not None and abort_if():
+                            _record_generation(schema_model, "preempted")
+                            return None
+                        _record_generation(schema_model, "aborted")
+                        continue
+                else:
+                    with STAGE_SECONDS.time(stage="llm_request"):
+                        resp = requests.post(backend.url, json=payload, timeout=OLLAMA_TIMEOUT)
+                    resp.raise_for_status()
+                    backend.breaker.record_success()
+                    response_data = resp.json()
+
+                _record_timings(schema_model, response_data)
+                validated = _parse_response(response_data, schema_model, attempt, validator)
+                if validated is not None:
+                    return validated
+
+            except KeyError as e:
+                logger.error(f"[Attempt {attempt+1}] Key error: {e}")
+                _record_generation(schema_model, "error")
                 continue
-                
-            content = response_data["message"]["content"]
-            logger.info(f"[Ollama] Получен ответ длиной {len(content)} символов")
-            
-            # Очищаем контент от лишних символов
-            content = content.strip()
-            if not content:
-                logger.warning(f"[Attempt {attempt+1}] Пустой ответ от Ollama")
+            except requests.exceptions.Timeout as e:
+                logger.error(f"[Attempt {attempt+1}] Timeout error: {e}")
+                backend.breaker.record_failure()
+                failed = True
+                _record_generation(schema_model, "timeout")
                 continue
-            
-            # Проверяем на простые ответы типа "Okay" или "the user sent"
-            if any(simple_response in content.lower() for simple_response in ["okay", "the user sent", "empty message", "just the word"]):
-                logger.warning(f"[Attempt {attempt+1}] Ollama вернул простой ответ вместо JSON: {content}")
+            except requests.RequestException as e:
+                logger.error(f"[Ollama] Request to {backend.url} failed: {e}")
+                backend.breaker.record_failure()
+                failed = True
+                _record_generation(schema_model, "request_error")
+                # Другой сервер может ответить, с единственным повтор бесполезен
+                if len(ollama_backends.backends) > 1:
+                    continue
+                break
+            except Exception as e:
+                logger.error(f"[Attempt {attempt+1}] Unexpected error: {e}")
+                _record_generation(schema_model, "error")
                 continue
-            
-            # Пытаемся найти JSON в ответе
-            json_start = content.find('{')
-            json_end = content.rfind('}') + 1
-            
-            if json_start == -1 or json_end == 0:
-                logger.warning(f"[Attempt {attempt+1}] JSON не найден в ответе: {content[:100]}...")
+            finally:
+                ollama_backends.release(backend, chat_id, failed)
+                if failed:
+                    failed_backends.append(backend)
+
+    logger.error(f"[Ollama] Все попытки исчерпаны, возвращаем None")
+    return None
+
+def _get_async_session() -> aiohttp.ClientSession:
+    """Общая aiohttp-сессия для запросов к Ollama"""
+    global _async_session
+    if _async_session is None or _async_session.closed:
+        _async_session = aiohttp.ClientSession()
+    return _async_session
+
+async def close_async_session():
+    """Закрытие aiohttp-сессии (при остановке асинхронного режима)"""
+    global _async_session
+    if _async_session is not None and not _async_session.closed:
+        await _async_session.close()
+    _async_session = None
+
+@STAGE_SECONDS.time(stage="llm_request")
+async def _post_streaming_async(backend: OllamaBackend, payload: dict, attempt: int, timeout: aiohttp.ClientTimeout,
+                                on_partial: Callable[[str, bool], Awaitable[None]] = None) -> Optional[dict]:
+    """Асинхронный потоковый запрос к Ollama с предпросмотром и досрочной остановкой"""
+    reader = _StreamReader(attempt)
+    async with _get_async_session().post(backend.url, json=payload, timeout=timeout) as resp:
+        resp.raise_for_status()
+        backend.breaker.record_success()
+        async for line in resp.content:
+            stop = reader.feed_line(line.decode("utf-8"))
+            preview = reader.new_preview()
+            if on_partial and preview:
+                try:
+                    await on_partial(*preview)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"[Ollama] Ошибка отображения промежуточного ответа: {e}")
+            if stop:
+                break
+    return reader.response_data()
+
+async def ollama_with_validation_async(prompt: str, schema_model: Generic[T], retries: int = 3, system_prompt: str = None,
+                                       on_partial: Callable[[str, bool], Awaitable[None]] = None,
+                                       validator: Callable[[T], T] = None, session: ChatSession = None,
+                                       chat_id: int = None, priority: int = PRIORITY_ACTION,
+                                       on_queued: Callable[[int], Awaitable[None]] = None) -> T:
+    """Асинхронная отправка запроса к Ollama с валидацией ответа (on_partial и on_queued - корутины)"""
+    with _ollama_span(prompt, system_prompt, schema_model, session), _live_request(background=False):
+        # Пока серверы недоступны, в очередь не становимся
+        _ensure_available()
+        async with llm_scheduler.slot_async(chat_id, priority, on_queued):
+            return await _ollama_with_validation_async(prompt, schema_model, retries, system_prompt, on_partial,
+                                                       validator, session, chat_id)
+
+async def _ollama_with_validation_async(prompt: str, schema_model: Generic[T], retries: int,
+                                        system_prompt: Optional[str],
+                                        on_partial: Optional[Callable[[str, bool], Awaitable[None]]],
+                                        validator: Optional[Callable[[T], T]], session: Optional[ChatSession],
+                                        chat_id: Optional[int]) -> T:
+
+    # Проверяем, что промпт не пустой
+    if not prompt or not prompt.strip():
+        logger.warning("[Ollama] Пустой промпт")
+        return None
+
+    # За время ожидания в очереди серверы могли стать недоступны (или полуоткрыты для пробного запроса)
+    _ensure_available()
+
+    OLLAMA_CALLS.inc(schema=schema_model.__name__)
+    payload = _build_payload(prompt, system_prompt, stream=OLLAMA_STREAM, schema_model=schema_model, session=session)
+    timeout = aiohttp.ClientTimeout(total=OLLAMA_TIMEOUT)
+    failed_backends = []
+    for attempt in range(retries):
+        with span("ollama_attempt", attempt=attempt + 1):
+            # Каждая попытка - на наименее загруженный доступный сервер
+            backend = _acquire_backend(payload, chat_id, failed_backends)
+            failed = False
+            try:
+                logger.info(f"[Ollama] Отправка запроса к модели {OLLAMA_MODEL} на {backend.url}...")
+                logger.debug(f"[Ollama] Промпт: {prompt[:200]}...")
+                if OLLAMA_STREAM:
+                    response_data = await _post_streaming_async(backend, payload, attempt, timeout, on_partial)
+                    if response_data is None:
+                        _record_generation(schema_model, "aborted")
+                        continue
+                else:
+                    with STAGE_SECONDS.time(stage="llm_request"):
+                        async with _get_async_session().post(backend.url, json=payload, timeout=timeout) as resp:
+                            resp.raise_for_status()
+                            response_data = await resp.json(content_type=None)
+                    backend.breaker.record_success()
+
+                _record_timings(schema_model, response_data)
+                validated = _parse_response(response_data, schema_model, attempt, validator)
+                if validated is not None:
+                    return validated
+
+            except asyncio.TimeoutError as e:
+                logger.error(f"[Attempt {attempt+1}] Timeout error: {e}")
+                backend.breaker.record_failure()
+                failed = True
+                _record_generation(schema_model, "timeout")
                 continue
-            
-            json_content = content[json_start:json_end]
-            logger.debug(f"[Ollama] Извлечен JSON: {json_content[:100]}...")
-            
-            # Пытаемся распарсить JSON
-            data = json.loads(json_content)
-            validated = schema_model.parse_obj(data)
-            logger.info(f"[Ollama] Успешная валидация данных")
-            return validated
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"[Attempt {attempt+1}] JSON decode error: {e}")
-            logger.debug(f"[Ollama] Содержимое ответа: {content[:200]}...")
-            continue
-        except ValidationError as e:
-            logger.error(f"[Attempt {attempt+1}] Validation error: {e}")
-            continue
-        except KeyError as e:
-            logger.error(f"[Attempt {attempt+1}] Key error: {e}")
-            continue
-        except requests.exceptions.Timeout as e:
-            logger.error(f"[Attempt {attempt+1}] Timeout error: {e}")
-            continue
-        except requests.RequestException as e:
-            logger.error(f"[Ollama] Request failed: {e}")
-            break
-        except Exception as e:
-            logger.error(f"[Attempt {attempt+1}] Unexpected error: {e}")
-            continue
-    
+            except aiohttp.ClientError as e:
+                logger.error(f"[Ollama] Request to {backend.url} failed: {e}")
+                backend.breaker.record_failure()
+                failed = True
+                _record_generation(schema_model, "request_error")
+                # Другой сервер может ответить, с единственным повтор бесполезен
+                if len(ollama_backends.backends) > 1:
+                    continue
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[Attempt {attempt+1}] Unexpected error: {e}")
+                _record_generation(schema_model, "error")
+                continue
+            finally:
+                ollama_backends.release(backend, chat_id, failed)
+                if failed:
+                    failed_backends.append(backend)
+
     logger.error(f"[Ollama] Все попытки исчерпаны, возвращаем None")
-    return None 
\ No newline at end of file
+    return None
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from config.settings import OLLAMA_SESSION_MAX_TURNS, OLLAMA_SESSION_MAX_CHATS
+
+
+# Сколько символов описания хода хранить в истории
+NARRATIVE_MAX_CHARS = 300
+
+
+class ChatSession:
+    """История диалога одного чата с Ollama.
+
+    Сообщения идут в порядке system -> прошлые ходы -> новое действие.
+    Прошлый ход хранится коротко: текст действия игрока и строка с описанием
+    результата, а проекция состояния есть только в новом сообщении. Поэтому
+    история не растёт на размер проекции за каждый ход, а system и прошлые
+    ходы остаются неизменным префиксом, который Ollama берёт из KV-кеша.
+    """
+
+    def __init__(self, max_turns: int = OLLAMA_SESSION_MAX_TURNS):
+        self.max_turns = max_turns
+        self.history: List[Dict[str, str]] = []
+
+    def messages(self, system_prompt: Optional[str], prompt: str) -> List[Dict[str, str]]:
+        """Сообщения запроса с историей чата"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.extend(self.history)
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def record(self, action: str, narrative: Optional[str]):
+        """Сохранение успешного хода: действие игрока и краткое описание результата"""
+        narrative = " ".join((narrative or "").split())
+        if len(narrative) > NARRATIVE_MAX_CHARS:
+            narrative = narrative[:NARRATIVE_MAX_CHARS - 2] + " …"
+        self.history.append({"role": "user", "content": f'Действие игрока: "{action}"'})
+        self.history.append({"role": "assistant", "content": narrative or "Ничего не произошло."})
+        if len(self.history) > self.max_turns * 2:
+            # Обрезаем сразу половину: префикс меняется реже, чем при сдвиге на один ход
+            keep = max(self.max_turns // 2, 1) * 2
+            self.history = self.history[-keep:]
+
+    def reset(self):
+        self.history = []
+
+
+class SessionStore:
+    """Сессии чатов с вытеснением давно неактивных"""
+
+    def __init__(self, max_chats: int = OLLAMA_SESSION_MAX_CHATS, max_turns: int = OLLAMA_SESSION_MAX_TURNS):
+        self.max_chats = max_chats
+        self.max_turns = max_turns
+        self._sessions: "OrderedDict[int, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id: int) -> Optional[ChatSession]:
+        """Сессия чата (None, если сессии отключены)"""
+        if self.max_turns <= 0 or chat_id is None:
+            return None
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is None:
+                session = ChatSession(self.max_turns)
+                self._sessions[chat_id] = session
+                while len(self._sessions) > self.max_chats:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(chat_id)
+            return session
+
+    def reset(self, chat_id: int):
+        """Сброс истории чата (новая игра)"""
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+
+
+# Сессии действий игроков по chat_id
+chat_sessions = SessionStore()
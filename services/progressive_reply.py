@@ -0,0 +1,70 @@
+import time
+from typing import Optional
+from services.send_queue import Preview
+from config.settings import STREAM_EDIT_INTERVAL, TELEGRAM_MESSAGE_LIMIT
+
+
+class ProgressiveReply:
+    """Сообщение, которое дописывается по мере генерации ответа.
+
+    Первый фрагмент отправляется новым сообщением, дальнейшие - правками
+    не чаще STREAM_EDIT_INTERVAL, итоговый ответ заменяет предпросмотр.
+    Ответ длиннее лимита Telegram заменяет предпросмотр первой частью,
+    остальные части уходят новыми сообщениями. Всё это идёт через очередь
+    отправки (SendQueue) с её лимитами и повторами, генерацию не задерживает.
+    """
+
+    def __init__(self, outbound, chat_id: int, header: str = "", min_interval: float = STREAM_EDIT_INTERVAL):
+        self.outbound = outbound
+        self.chat_id = chat_id
+        self.header = header
+        self.min_interval = min_interval
+        self.preview: Optional[Preview] = None
+        self._last_text = ""
+        self._last_edit = 0.0
+
+    def _render(self, text: str, complete: bool) -> str:
+        body = f"{self.header}{text}" if complete else f"{self.header}{text} …"
+        # Предпросмотр длиннее лимита Telegram не примет - показываем начало
+        return body if len(body) <= TELEGRAM_MESSAGE_LIMIT else body[:TELEGRAM_MESSAGE_LIMIT - 2] + " …"
+
+    def _next(self, text: str, complete: bool) -> Optional[str]:
+        """Текст очередной правки или None, если показывать пока нечего"""
+        body = self._render(text, complete)
+        if body == self._last_text or not (complete or time.monotonic() - self._last_edit >= self.min_interval):
+            return None
+        if self.preview is None:
+            self.preview = self.outbound.preview(self.chat_id)
+        self._last_text = body
+        self._last_edit = time.monotonic()
+        return body
+
+    def update(self, text: str, complete: bool):
+        """Показ очередной части ответа"""
+        body = self._next(text, complete)
+        if body is not None:
+            self.outbound.update_preview(self.preview, body)
+
+    def finish(self, text: str) -> bool:
+        """Замена предпросмотра итоговым ответом, False - ответ нужно отправить отдельно"""
+        if self.preview is None:
+            return False
+        self.outbound.finish_preview(self.preview, text)
+        return True
+
+
+class AsyncProgressiveReply(ProgressiveReply):
+    """ProgressiveReply для асинхронной очереди отправки"""
+
+    async def update(self, text: str, complete: bool):
+        """Показ очередной части ответа"""
+        body = self._next(text, complete)
+        if body is not None:
+            await self.outbound.update_preview(self.preview, body)
+
+    async def finish(self, text: str) -> bool:
+        """Замена предпросмотра итоговым ответом, False - ответ нужно отправить отдельно"""
+        if self.preview is None:
+            return False
+        await self.outbound.finish_preview(self.preview, text)
+        return True
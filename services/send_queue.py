@@ -0,0 +1,461 @@
+import time
+import heapq
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from services.telegram_client import TelegramRetryAfter
+from services.metrics import Counter, STAGE_SECONDS
+from config.settings import (
+    TELEGRAM_MESSAGE_LIMIT,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_INTERVAL,
+    TELEGRAM_SEND_WORKERS,
+    TELEGRAM_SEND_MAX_ATTEMPTS,
+    TELEGRAM_SEND_BACKOFF,
+    TELEGRAM_SEND_MAX_BACKOFF,
+)
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+TELEGRAM_SENDS = Counter("telegram_sends_total", "Попытки отправки сообщений по результату", ("result",))
+
+# Результаты попытки отправки
+_SENT, _RETRY, _DROPPED = "sent", "retry", "dropped"
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Части сообщения не длиннее limit: по границам строк, длинные строки - по пробелам"""
+    if len(text) <= limit:
+        return [text]
+    parts = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        if len(current) + len(line) <= limit:
+            current += line
+            continue
+        if current:
+            parts.append(current)
+        current = ""
+        # Строка длиннее лимита: режем по последнему пробелу, а без пробелов - как есть
+        while len(line) > limit:
+            cut = line.rfind(" ", 0, limit + 1)
+            if cut <= 0:
+                cut = limit
+            parts.append(line[:cut])
+            line = line[cut:].lstrip(" ")
+        current = line
+    if current:
+        parts.append(current)
+    # Перевод строки на границе части в Telegram не нужен, а пустые части не отправляются
+    return [part.rstrip("\n") for part in parts if part.strip()]
+
+
+class Preview:
+    """Сообщение с предпросмотром, которое дописывается правками (см. ProgressiveReply).
+
+    В очереди у него не больше одной задачи: новый текст, пришедший, пока
+    задача ждёт отправки, просто заменяет прежний, и Telegram получает
+    только последний.
+    """
+
+    __slots__ = ("chat_id", "text", "sent_text", "message_id", "final", "queued")
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        # Текст, который должен оказаться в сообщении, и текст, который там уже есть
+        self.text = ""
+        self.sent_text = ""
+        self.message_id: Optional[int] = None
+        # Итоговый ответ: если правка не удалась, он отправляется новым сообщением
+        self.final = False
+        # Задача предпросмотра уже ждёт в очереди
+        self.queued = False
+
+
+class _Message:
+    __slots__ = ("chat_id", "text", "attempts", "queued_at", "preview")
+
+    def __init__(self, chat_id: int, text: str, preview: Optional[Preview] = None):
+        self.chat_id = chat_id
+        self.text = text
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+        self.preview = preview
+
+
+class _Chat:
+    __slots__ = ("messages", "ready_at", "busy")
+
+    def __init__(self):
+        self.messages: Deque[_Message] = deque()
+        # Раньше этого времени в чат отправлять нельзя (интервал чата или retry_after)
+        self.ready_at = 0.0
+        # Сообщение чата сейчас отправляется - следующее ждёт, чтобы не нарушить порядок
+        self.busy = False
+
+
+class _SendSchedule:
+    """Порядок отправки без ожидания и ввода-вывода (вызывается под блокировкой очереди).
+
+    Сообщения одного чата уходят строго по порядку и не чаще chat_interval,
+    все вместе - не чаще global_rate в секунду. Следующим отправляется чат,
+    который раньше всех стал готов.
+    """
+
+    def __init__(self, global_rate: float, chat_interval: float, max_attempts: int, backoff: float,
+                 max_backoff: float):
+        self.global_interval = 1 / global_rate
+        self.chat_interval = chat_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._chats: Dict[int, _Chat] = {}
+        # (время готовности, chat_id) чатов с сообщениями, которые сейчас не отправляются
+        self._ready: List[Tuple[float, int]] = []
+        self._global_next = 0.0
+        self.pending = 0
+
+    def push(self, chat_id: int, texts: List[str]):
+        self._push(chat_id, [_Message(chat_id, text) for text in texts])
+
+    def push_preview(self, preview: Preview, text: str):
+        """Новый текст предпросмотра; задача в очереди уже есть - она отправит этот текст"""
+        preview.text = text
+        if preview.queued:
+            TELEGRAM_SENDS.inc(result="coalesced")
+            return
+        preview.queued = True
+        self._push(preview.chat_id, [_Message(preview.chat_id, None, preview)])
+
+    def _push(self, chat_id: int, messages: List[_Message]):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat()
+        was_idle = not chat.messages and not chat.busy
+        chat.messages.extend(messages)
+        self.pending += len(messages)
+        if was_idle and chat.messages:
+            heapq.heappush(self._ready, (chat.ready_at, chat_id))
+
+    def take(self, now: float) -> Tuple[Optional[_Message], Optional[float]]:
+        """Сообщение для отправки или (None, сколько ждать; None - очередь пуста)"""
+        if not self._ready:
+            return None, None
+        ready_at = max(self._ready[0][0], self._global_next)
+        if ready_at > now:
+            return None, ready_at - now
+        _, chat_id = heapq.heappop(self._ready)
+        chat = self._chats[chat_id]
+        chat.busy = True
+        self._global_next = max(now, self._global_next) + self.global_interval
+        return chat.messages[0], None
+
+    def done(self, message: _Message, now: float, result: str, delay: float = 0):
+        """Итог попытки: sent/dropped - сообщение убирается, retry - повтор через delay"""
+        chat = self._chats[message.chat_id]
+        chat.busy = False
+        if result == _RETRY:
+            chat.ready_at = now + delay
+        else:
+            chat.messages.popleft()
+            self.pending -= 1
+            chat.ready_at = now + self.chat_interval
+        if chat.messages:
+            heapq.heappush(self._ready, (chat.ready_at, message.chat_id))
+        elif len(self._chats) > 1000:
+            self._prune(now)
+
+    def retry_delay(self, message: _Message) -> Optional[float]:
+        """Пауза перед повтором после сбоя или None, если попытки исчерпаны"""
+        message.attempts += 1
+        if message.attempts >= self.max_attempts:
+            return None
+        return min(self.backoff * 2 ** (message.attempts - 1), self.max_backoff)
+
+    def _prune(self, now: float):
+        """Забываем чаты без сообщений, чей интервал уже истёк"""
+        for chat_id in [chat_id for chat_id, chat in self._chats.items()
+                        if not chat.messages and not chat.busy and chat.ready_at <= now]:
+            del self._chats[chat_id]
+
+
+def _schedule(global_rate: float) -> _SendSchedule:
+    return _SendSchedule(global_rate, TELEGRAM_CHAT_INTERVAL, TELEGRAM_SEND_MAX_ATTEMPTS,
+                         TELEGRAM_SEND_BACKOFF, TELEGRAM_SEND_MAX_BACKOFF)
+
+
+def _request(message: _Message) -> Optional[Tuple[str, dict]]:
+    """Метод Bot API и данные для задачи (под блокировкой очереди); None - отправлять нечего"""
+    preview = message.preview
+    if preview is None:
+        return "sendMessage", {"chat_id": message.chat_id, "text": message.text}
+    # Следующий текст предпросмотра - уже новой задачей
+    preview.queued = False
+    message.text = preview.text
+    if preview.message_id is None:
+        return "sendMessage", {"chat_id": message.chat_id, "text": message.text}
+    if message.text == preview.sent_text:
+        return None
+    return "editMessageText", {"chat_id": message.chat_id, "message_id": preview.message_id, "text": message.text}
+
+
+def _preview_done(message: _Message, response: Optional[dict], result: str, delay: float) -> Tuple[str, float]:
+    """Учёт отправленного предпросмотра (под блокировкой очереди)"""
+    preview = message.preview
+    if result == _RETRY:
+        # Повтор отправит и текст, пришедший за время попытки
+        preview.queued = True
+    elif result == _SENT:
+        if preview.message_id is None:
+            preview.message_id = response.get("result", {}).get("message_id")
+        preview.sent_text = message.text
+    elif result == _DROPPED and preview.final and preview.message_id is not None and response is not None:
+        # Сообщение с предпросмотром удалено или не правится - итоговый ответ уходит новым сообщением
+        preview.message_id = None
+        return _RETRY, 0
+    return result, delay
+
+
+def _outcome(schedule: _SendSchedule, message: _Message, response: Optional[dict],
+             error: Optional[Exception]) -> Tuple[str, float]:
+    """Результат попытки отправки и пауза перед повтором"""
+    if isinstance(error, TelegramRetryAfter):
+        # Telegram сам говорит, когда можно повторить; такие повторы попыток не тратят
+        TELEGRAM_SENDS.inc(result="retry_after")
+        logger.warning(f"[Send] Превышен лимит Telegram для чата {message.chat_id}, "
+                       f"повтор через {error.retry_after:.0f} с")
+        return _RETRY, error.retry_after
+    if error is not None:
+        delay = schedule.retry_delay(message)
+        if delay is None:
+            TELEGRAM_SENDS.inc(result="dropped")
+            logger.error(f"[Send] Сообщение в чат {message.chat_id} не отправлено после "
+                         f"{message.attempts} попыток: {error}")
+            return _DROPPED, 0
+        TELEGRAM_SENDS.inc(result="retry")
+        logger.warning(f"[Send] Ошибка отправки в чат {message.chat_id}, повтор через {delay:.0f} с: {error}")
+        return _RETRY, delay
+    if not response.get("ok", False) and "message is not modified" in str(response.get("description", "")):
+        # Правка с тем же текстом - сообщение уже в нужном виде
+        TELEGRAM_SENDS.inc(result="sent")
+        return _SENT, 0
+    if not response.get("ok", False):
+        # Ошибка запроса (бот заблокирован, чат не найден) - повтор не поможет
+        TELEGRAM_SENDS.inc(result="rejected")
+        logger.error(f"[Send] Telegram отклонил сообщение в чат {message.chat_id}: {response.get('description')}")
+        return _DROPPED, 0
+    TELEGRAM_SENDS.inc(result="sent")
+    # От постановки в очередь до доставки, с учётом лимитов и повторов
+    STAGE_SECONDS.observe(time.monotonic() - message.queued_at, stage="send_wait")
+    return _SENT, 0
+
+
+class SendQueue:
+    """Очередь исходящих сообщений синхронного режима.
+
+    send_message() кладёт ответ в очередь (длинный - частями) и сразу
+    возвращается, а фоновые потоки отправляют его с соблюдением лимитов
+    Telegram, ждут retry_after при 429 и повторяют отправку при сбоях.
+    Предпросмотр (preview, update_preview, finish_preview) идёт через ту же
+    очередь: первое сообщение и правки подчиняются тем же лимитам, а правки,
+    не успевшие уйти, сливаются в одну. Остальные методы передаются клиенту.
+    """
+
+    def __init__(self, client, workers: int = TELEGRAM_SEND_WORKERS, global_rate: float = TELEGRAM_GLOBAL_RATE):
+        self.client = client
+        self.workers = workers
+        self._schedule = _schedule(global_rate)
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    @property
+    def pending(self) -> int:
+        """Сколько сообщений ещё не отправлено"""
+        with self._cond:
+            return self._schedule.pending
+
+    def send_message(self, chat_id: int, text: str) -> bool:
+        """Постановка сообщения в очередь отправки"""
+        with self._cond:
+            self._schedule.push(chat_id, split_message(text))
+            self._cond.notify()
+        return True
+
+    def preview(self, chat_id: int) -> Preview:
+        """Новое сообщение с предпросмотром (отправится с первым update_preview)"""
+        return Preview(chat_id)
+
+    def update_preview(self, preview: Preview, text: str):
+        """Новый текст предпросмотра (не длиннее лимита Telegram)"""
+        with self._cond:
+            self._schedule.push_preview(preview, text)
+            self._cond.notify()
+
+    def finish_preview(self, preview: Preview, text: str):
+        """Итоговый ответ на месте предпросмотра; части сверх лимита - следующими сообщениями"""
+        first, *rest = split_message(text)
+        with self._cond:
+            preview.final = True
+            self._schedule.push_preview(preview, first)
+            self._schedule.push(preview.chat_id, rest)
+            self._cond.notify()
+
+    def start(self):
+        """Запуск потоков отправки"""
+        if self._threads:
+            return
+        self._closed = False
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"send-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """Остановка после отправки всего, что уже в очереди; False - не успели за timeout"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        drained = not any(thread.is_alive() for thread in self._threads)
+        if not drained:
+            logger.warning(f"[Send] Не отправлено {self.pending} сообщений при остановке")
+        self._threads = []
+        return drained
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    message, wait = self._schedule.take(time.monotonic())
+                    if message is not None:
+                        break
+                    if wait is None and self._closed:
+                        return
+                    self._cond.wait(wait)
+                request = _request(message)
+            response, error = None, None
+            if request is not None:
+                try:
+                    with STAGE_SECONDS.time(stage="send"):
+                        response = self.client.call(*request)
+                except Exception as e:
+                    error = e
+                result, delay = _outcome(self._schedule, message, response, error)
+            else:
+                result, delay = _SENT, 0
+            with self._cond:
+                if message.preview is not None:
+                    result, delay = _preview_done(message, response, result, delay)
+                self._schedule.done(message, time.monotonic(), result, delay)
+                self._cond.notify_all()
+
+
+class AsyncSendQueue:
+    """Асинхронный аналог SendQueue: отправка задачами в event loop"""
+
+    def __init__(self, client, workers: int = TELEGRAM_SEND_WORKERS, global_rate: float = TELEGRAM_GLOBAL_RATE):
+        self.client = client
+        self.workers = workers
+        self._schedule = _schedule(global_rate)
+        self._cond: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    @property
+    def pending(self) -> int:
+        """Сколько сообщений ещё не отправлено"""
+        return self._schedule.pending
+
+    async def send_message(self, chat_id: int, text: str) -> bool:
+        """Постановка сообщения в очередь отправки"""
+        async with self._cond:
+            self._schedule.push(chat_id, split_message(text))
+            self._cond.notify()
+        return True
+
+    def preview(self, chat_id: int) -> Preview:
+        """Новое сообщение с предпросмотром (отправится с первым update_preview)"""
+        return Preview(chat_id)
+
+    async def update_preview(self, preview: Preview, text: str):
+        """Новый текст предпросмотра (не длиннее лимита Telegram)"""
+        async with self._cond:
+            self._schedule.push_preview(preview, text)
+            self._cond.notify()
+
+    async def finish_preview(self, preview: Preview, text: str):
+        """Итоговый ответ на месте предпросмотра; части сверх лимита - следующими сообщениями"""
+        first, *rest = split_message(text)
+        async with self._cond:
+            preview.final = True
+            self._schedule.push_preview(preview, first)
+            self._schedule.push(preview.chat_id, rest)
+            self._cond.notify()
+
+    def start(self):
+        """Запуск задач отправки (в работающем event loop)"""
+        if self._tasks:
+            return
+        self._closed = False
+        self._cond = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: Optional[float] = None) -> bool:
+        """Остановка после отправки всего, что уже в очереди; False - не успели за timeout"""
+        async with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if not self._tasks:
+            return True
+        _, not_done = await asyncio.wait(self._tasks, timeout=timeout)
+        if not_done:
+            logger.warning(f"[Send] Не отправлено {self.pending} сообщений при остановке")
+            for task in not_done:
+                task.cancel()
+            await asyncio.gather(*not_done, return_exceptions=True)
+        self._tasks = []
+        return not not_done
+
+    async def _run(self):
+        while True:
+            async with self._cond:
+                while True:
+                    message, wait = self._schedule.take(time.monotonic())
+                    if message is not None:
+                        break
+                    if wait is None and self._closed:
+                        return
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                request = _request(message)
+            response, error = None, None
+            if request is not None:
+                try:
+                    with STAGE_SECONDS.time(stage="send"):
+                        response = await self.client.call(*request)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    error = e
+                result, delay = _outcome(self._schedule, message, response, error)
+            else:
+                result, delay = _SENT, 0
+            async with self._cond:
+                if message.preview is not None:
+                    result, delay = _preview_done(message, response, result, delay)
+                self._schedule.done(message, time.monotonic(), result, delay)
+                self._cond.notify_all()
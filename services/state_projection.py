@@ -0,0 +1,121 @@
+import logging
+from typing import List
+from models import GameStateModel, StateChange, ProjectionModel, RoomSummaryModel
+from services.metrics import STAGE_SECONDS
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+# Длина краткого описания соседней комнаты
+SUMMARY_LENGTH = 160
+
+
+def _summarize(description: str) -> str:
+    """Первое предложение описания, не длиннее SUMMARY_LENGTH"""
+    sentence_end = description.find(". ")
+    summary = description[:sentence_end + 1] if sentence_end != -1 else description
+    if len(summary) > SUMMARY_LENGTH:
+        summary = summary[:SUMMARY_LENGTH].rstrip() + "…"
+    return summary
+
+
+@STAGE_SECONDS.time(stage="projection")
+def build_projection(state: GameStateModel) -> ProjectionModel:
+    """Проекция состояния для промпта: игрок, текущая комната и её соседи.
+
+    Остальные комнаты подземелья в промпт не попадают, поэтому размер промпта
+    не растёт вместе с подземельем.
+    """
+    room_id = state.player.location
+    room = state.dungeon.rooms[room_id]
+
+    neighbours = {}
+    for exit_info in room.exits.values():
+        # Про комнаты за скрытыми проходами игрок ещё ничего не знает
+        if exit_info.is_hidden:
+            continue
+        target = state.dungeon.rooms.get(exit_info.target_room)
+        if target is not None:
+            neighbours[exit_info.target_room] = RoomSummaryModel(
+                summary=_summarize(target.description),
+                has_enemies=bool(target.enemies)
+            )
+
+    return ProjectionModel(
+        player=state.player,
+        current_room_id=room_id,
+        current_room=room,
+        neighbour_rooms=neighbours,
+        adventure_description=state.adventure_description,
+        story_context=state.story_context,
+        last_action_description=state.last_action_description
+    )
+
+
+def _drop_unknown(changes: StateChange, field: str, known: List[str]) -> dict:
+    """Удаление из списка ссылок на отсутствующие в проекции сущности"""
+    values = getattr(changes, field)
+    if not values:
+        return {}
+    kept = [value for value in values if value in known]
+    if len(kept) != len(values):
+        logger.warning(f"[Projection] {field}: отброшены неизвестные значения {[v for v in values if v not in known]}")
+        return {field: kept}
+    return {}
+
+
+# Изменения комнаты, в которой находится игрок после хода: при переходе это
+# комната назначения, её содержимого в проекции нет
+ROOM_REFERENCE_FIELDS = (
+    "room_items_remove",
+    "room_enemies_remove",
+    "room_friendly_npcs_remove",
+    "room_items_add",
+    "room_enemies_add",
+    "room_friendly_npcs_add",
+    "room_description_change",
+    "room_exits_reveal",
+    "room_exits_hide",
+    "room_exits_block",
+    "room_exits_unblock",
+)
+EXIT_FIELDS = ("room_exits_reveal", "room_exits_hide", "room_exits_block", "room_exits_unblock")
+
+
+def check_state_change_scope(projection: ProjectionModel, changes: StateChange) -> StateChange:
+    """Проверка, что изменения касаются только сущностей из проекции.
+
+    Переход не через видимый незаблокированный выход текущей комнаты или
+    изменение чужого выхода - ошибка (ValueError, ответ модели отбрасывается).
+    Удаление несуществующих предметов, врагов и NPC просто отбрасывается, как
+    и любые изменения комнаты при переходе: они относились бы к комнате
+    назначения, которой модель не видела.
+    """
+    room = projection.current_room
+    exit_targets = {exit_info.target_room: exit_info for exit_info in room.exits.values()}
+    updates = {}
+
+    location = changes.player_location_change
+    if location is not None and location != projection.current_room_id:
+        exit_info = exit_targets.get(location)
+        if exit_info is None:
+            raise ValueError(f"Переход в комнату {location}, в которую нет выхода из {projection.current_room_id}")
+        if exit_info.is_hidden or exit_info.is_blocked:
+            raise ValueError(f"Переход через скрытый или заблокированный выход в {location}")
+        # apply_state_changes применяет изменения комнаты к комнате назначения,
+        # а её содержимого в проекции нет - такие изменения (и добавления тоже) отбрасываем
+        dropped = [field for field in ROOM_REFERENCE_FIELDS if getattr(changes, field)]
+        if dropped:
+            logger.warning(f"[Projection] При переходе в {location} отброшены изменения комнаты: {dropped}")
+            updates.update({field: None for field in dropped})
+    else:
+        for field in EXIT_FIELDS:
+            unknown = [target for target in getattr(changes, field) or [] if target not in exit_targets]
+            if unknown:
+                raise ValueError(f"{field} ссылается на выходы вне текущей комнаты: {unknown}")
+        updates.update(_drop_unknown(changes, "room_items_remove", room.items + (changes.room_items_add or [])))
+        updates.update(_drop_unknown(changes, "room_enemies_remove", room.enemies + (changes.room_enemies_add or [])))
+        updates.update(_drop_unknown(changes, "room_friendly_npcs_remove", room.friendly_npcs + (changes.room_friendly_npcs_add or [])))
+
+    updates.update(_drop_unknown(changes, "inventory_remove", projection.player.inventory + (changes.inventory_add or [])))
+    return changes.copy(update=updates) if updates else changes
@@ -0,0 +1,199 @@
+import time
+import zlib
+import queue
+import logging
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Optional
+from services.dispatcher import get_update_chat_id
+from services.update_journal import update_journal
+from services.metrics import Counter
+from config.settings import (
+    WORKER_PROCESSES,
+    WORKER_QUEUE_SIZE,
+    WORKER_RESTART_BACKOFF,
+    WORKER_RESTART_MAX_BACKOFF,
+)
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+WORKER_RESTARTS = Counter("worker_restarts_total", "Перезапуски упавших процессов-обработчиков")
+
+# Процесс, проработавший столько секунд, считается стабильным: пауза перед перезапуском сбрасывается
+_STABLE_AFTER = 30
+
+
+def spawn_context():
+    """Контекст запуска процессов-обработчиков (общие объекты для них создаются в нём же)"""
+    return multiprocessing.get_context("spawn")
+
+
+def worker_share(total: int, index: int, workers: int) -> int:
+    """Доля процесса index в общем целом лимите total (остаток - первым процессам), не меньше 1"""
+    return max(total // workers + (1 if index < total % workers else 0), 1)
+
+
+def shard_of(update: dict, shards: int) -> int:
+    """Номер процесса, которому принадлежит обновление: по chat_id, без чата - по update_id"""
+    chat_id = get_update_chat_id(update)
+    key = chat_id if chat_id is not None else ("update", update.get("update_id"))
+    # hash() строк меняется между процессами, crc32 - нет
+    return zlib.crc32(str(key).encode("utf-8")) % shards
+
+
+class Supervisor:
+    """Процессы-обработчики обновлений, каждый - владелец своей части чатов.
+
+    Обновление отправляется в очередь процесса shard_of(update), поэтому все
+    обновления одного чата обрабатывает один процесс, и его игра (кеш
+    состояния, журнал ходов) не нужна никому другому. Сообщения в очереди:
+    ("update", update), ("reply", chat_id, text) и None - остановка.
+
+    Упавший процесс перезапускается с новой очередью, а принятые, но не
+    обработанные обновления его чатов берутся из журнала обновлений.
+    """
+
+    def __init__(self, target: Callable, workers: int = WORKER_PROCESSES, queue_size: int = WORKER_QUEUE_SIZE,
+                 restart_backoff: float = WORKER_RESTART_BACKOFF,
+                 max_restart_backoff: float = WORKER_RESTART_MAX_BACKOFF,
+                 shared: tuple = (), before_spawn: Callable[[int], None] = None):
+        # target(index, inbox, *shared) выполняется в процессе-обработчике; shared - объекты,
+        # общие для процессов (созданные в контексте spawn), before_spawn(index) - перед каждым запуском
+        self.target = target
+        self.shared = shared
+        self.before_spawn = before_spawn
+        self.workers = workers
+        self.queue_size = queue_size
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        # spawn: процесс не наследует потоки и соединения главного процесса
+        self._ctx = spawn_context()
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[Optional[multiprocessing.Process]] = []
+        self._started_at: List[float] = []
+        self._backoff: List[float] = []
+        # Наибольший update_id, переданный каждому процессу: из журнала при перезапуске берутся только они,
+        # а более новые главный процесс передаст сам
+        self._submitted: List[int] = []
+        # Замена очереди упавшего процесса и постановка в очередь не должны пересекаться
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(self):
+        """Запуск процессов и наблюдения за ними"""
+        with self._lock:
+            for index in range(self.workers):
+                self._queues.append(self._ctx.Queue(self.queue_size))
+                self._processes.append(None)
+                self._started_at.append(0.0)
+                self._backoff.append(self.restart_backoff)
+                self._submitted.append(-1)
+                self._spawn(index)
+        self._monitor = threading.Thread(target=self._watch, name="supervisor", daemon=True)
+        self._monitor.start()
+        logger.info(f"[Supervisor] Запущено процессов-обработчиков: {self.workers}")
+
+    def submit(self, update: dict):
+        """Передача обновления процессу его чата (ждёт, пока в очереди есть место)"""
+        self._put(shard_of(update, self.workers), ("update", update), update.get("update_id", -1))
+
+    def send_reply(self, chat_id: int, text: str):
+        """Отправка готового ответа процессом, которому принадлежит чат"""
+        self._put(shard_of({"message": {"chat": {"id": chat_id}}}, self.workers), ("reply", chat_id, text))
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """Остановка после обработки уже переданных обновлений; False - кого-то пришлось завершить"""
+        self._closing.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for inbox in self._queues:
+            try:
+                inbox.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        stopped = True
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"[Supervisor] {process.name} не завершился вовремя и будет остановлен")
+                process.terminate()
+                process.join()
+                stopped = False
+        for inbox in self._queues:
+            _discard(inbox)
+        return stopped
+
+    def _put(self, index: int, item, update_id: int = -1):
+        while True:
+            with self._lock:
+                try:
+                    self._queues[index].put_nowait(item)
+                    self._submitted[index] = max(self._submitted[index], update_id)
+                    return
+                except queue.Full:
+                    pass
+            # Процесс не успевает - приём обновлений ждёт, как при заполненной очереди диспетчера
+            time.sleep(0.05)
+
+    def _spawn(self, index: int):
+        if self.before_spawn is not None:
+            self.before_spawn(index)
+        process = self._ctx.Process(target=self.target, args=(index, self._queues[index], *self.shared),
+                                    name=f"worker-{index}", daemon=True)
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def _watch(self):
+        """Перезапуск упавших процессов (фоновый поток главного процесса)"""
+        restart_at: Dict[int, float] = {}
+        while not self._closing.is_set():
+            alive = [process.sentinel for index, process in enumerate(self._processes) if index not in restart_at]
+            timeout = 1.0
+            if restart_at:
+                timeout = max(min(min(restart_at.values()) - time.monotonic(), timeout), 0)
+            wait(alive, timeout)
+            if self._closing.is_set():
+                return
+            now = time.monotonic()
+            for index, process in enumerate(self._processes):
+                if index in restart_at:
+                    if now >= restart_at[index]:
+                        del restart_at[index]
+                        self._restart(index)
+                elif not process.is_alive():
+                    # Падение вскоре после запуска - пауза растёт, иначе начинается заново
+                    if now - self._started_at[index] >= _STABLE_AFTER:
+                        self._backoff[index] = self.restart_backoff
+                    delay = self._backoff[index]
+                    self._backoff[index] = min(delay * 2, self.max_restart_backoff)
+                    logger.error(f"[Supervisor] {process.name} завершился с кодом {process.exitcode}, "
+                                 f"перезапуск через {delay:.0f} с")
+                    restart_at[index] = now + delay
+
+    def _restart(self, index: int):
+        with self._lock:
+            # Очередь, из которой читал упавший процесс, могла остаться заблокированной
+            _discard(self._queues[index])
+            self._queues[index] = self._ctx.Queue(self.queue_size)
+            self._spawn(index)
+            WORKER_RESTARTS.inc()
+            # Всё, что было в старой очереди или в обработке, есть в журнале обновлений
+            pending = [update for update in update_journal.pending()
+                       if shard_of(update, self.workers) == index and update["update_id"] <= self._submitted[index]]
+            for update in pending:
+                self._queues[index].put(("update", update))
+        if pending:
+            logger.info(f"[Supervisor] worker-{index}: повторно передано обновлений: {len(pending)}")
+
+
+def _discard(inbox: multiprocessing.Queue):
+    """Закрытие очереди без ожидания, пока её дочитают"""
+    inbox.cancel_join_thread()
+    inbox.close()
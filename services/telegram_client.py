@@ -1,16 +1,33 @@
 import requests
-import json
+import asyncio
 import logging
-from typing import Optional, Dict, Any
-from config.settings import TELEGRAM_TOKEN
+import aiohttp
+from typing import Optional
+from config.settings import TELEGRAM_API_URL, TELEGRAM_POLL_TIMEOUT
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
+# Таймаут запросов отправки, чтобы зависший запрос не держал очередь отправки
+SEND_TIMEOUT = 30
+
+
+class TelegramRetryAfter(Exception):
+    """Telegram ответил 429: повторить запрос можно не раньше чем через retry_after секунд"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+def _retry_after(payload: dict) -> float:
+    return float(payload.get("parameters", {}).get("retry_after", 1))
+
+
 class TelegramClient:
     def __init__(self, token: str):
         self.token = token
-        self.base_url = f"https://api.telegram.org/bot{token}"
+        self.base_url = f"{TELEGRAM_API_URL}/bot{token}"
         self.offset = 0
     
     def get_updates(self) -> list:
@@ -18,7 +35,7 @@ class TelegramClient:
         url = f"{self.base_url}/getUpdates"
         params = {
             "offset": self.offset,
-            "timeout": 30
+            "timeout": TELEGRAM_POLL_TIMEOUT
         }
         
         try:
@@ -52,10 +69,24 @@ class TelegramClient:
             logger.error(f"Error sending message: {e}")
             return False
     
-    def set_webhook(self, url: str) -> bool:
-        """Установка webhook (для продакшена)"""
+    def call(self, method: str, data: dict) -> dict:
+        """Вызов метода Bot API с ответом Telegram как есть (ok=False - ошибка запроса).
+
+        При 429 бросает TelegramRetryAfter, при сбое сети или ошибке 5xx - исключение requests.
+        """
+        response = requests.post(f"{self.base_url}/{method}", json=data, timeout=SEND_TIMEOUT)
+        if response.status_code == 429:
+            raise TelegramRetryAfter(_retry_after(response.json()))
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response.json()
+
+    def set_webhook(self, url: str, secret_token: str = "") -> bool:
+        """Установка webhook (для продакшена); secret_token Telegram передаёт в каждом запросе"""
         webhook_url = f"{self.base_url}/setWebhook"
         data = {"url": url}
+        if secret_token:
+            data["secret_token"] = secret_token
         
         try:
             response = requests.post(webhook_url, json=data)
@@ -63,4 +94,88 @@ class TelegramClient:
             return response.json().get("ok", False)
         except Exception as e:
             logger.error(f"Error setting webhook: {e}")
-            return False 
\ No newline at end of file
+            return False
+
+    def delete_webhook(self) -> bool:
+        """Удаление webhook: пока он установлен, getUpdates не работает"""
+        try:
+            response = requests.post(f"{self.base_url}/deleteWebhook", json={})
+            response.raise_for_status()
+            return response.json().get("ok", False)
+        except Exception as e:
+            logger.error(f"Error deleting webhook: {e}")
+            return False
+
+
+
+class AsyncTelegramClient:
+    """Асинхронный клиент Telegram Bot API на aiohttp"""
+
+    def __init__(self, token: str):
+        self.token = token
+        self.base_url = f"{TELEGRAM_API_URL}/bot{token}"
+        self.offset = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self):
+        """Закрытие HTTP-сессии"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def get_updates(self) -> list:
+        """Длинный опрос обновлений от Telegram (ошибки сети пробрасываются)"""
+        url = f"{self.base_url}/getUpdates"
+        params = {
+            "offset": self.offset,
+            "timeout": TELEGRAM_POLL_TIMEOUT
+        }
+        # Запрос ждёт до TELEGRAM_POLL_TIMEOUT секунд, даём запас на сеть
+        timeout = aiohttp.ClientTimeout(total=TELEGRAM_POLL_TIMEOUT + 10)
+
+        async with self._get_session().get(url, params=params, timeout=timeout) as response:
+            response.raise_for_status()
+            data = await response.json()
+
+        if data.get("ok") and data.get("result"):
+            updates = data["result"]
+            if updates:
+                self.offset = updates[-1]["update_id"] + 1
+            return updates
+        return []
+
+    async def call(self, method: str, data: dict) -> dict:
+        """Асинхронный TelegramClient.call (при сбое сети или 5xx - исключение aiohttp)"""
+        timeout = aiohttp.ClientTimeout(total=SEND_TIMEOUT)
+        async with self._get_session().post(f"{self.base_url}/{method}", json=data, timeout=timeout) as response:
+            if response.status == 429:
+                raise TelegramRetryAfter(_retry_after(await response.json(content_type=None)))
+            if response.status >= 500:
+                response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def set_webhook(self, url: str, secret_token: str = "") -> bool:
+        """Установка webhook; secret_token Telegram передаёт в каждом запросе"""
+        data = {"url": url}
+        if secret_token:
+            data["secret_token"] = secret_token
+        return await self._post_ok("setWebhook", data)
+
+    async def delete_webhook(self) -> bool:
+        """Удаление webhook: пока он установлен, getUpdates не работает"""
+        return await self._post_ok("deleteWebhook", {})
+
+    async def _post_ok(self, method: str, data: dict) -> bool:
+        try:
+            async with self._get_session().post(f"{self.base_url}/{method}", json=data) as response:
+                response.raise_for_status()
+                return (await response.json()).get("ok", False)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error calling {method}: {e}")
+            return False
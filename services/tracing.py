@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from config.settings import (
+    TRACE_LOG_PATH,
+    SLOW_TURN_THRESHOLD,
+    SLOW_TURN_LOG_PATH,
+    PROFILER_INTERVAL,
+    PROFILER_PATH,
+)
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+# Текущий участок трассировки: в потоке обработчика или в задаче asyncio
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    """Участок обработки обновления: имя, время, атрибуты и вложенные участки"""
+
+    __slots__ = ("name", "attrs", "started", "duration", "children", "error")
+
+    def __init__(self, name: str, attrs: dict, started: float = None):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter() if started is None else started
+        self.duration: Optional[float] = None
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+
+    def to_dict(self, origin: float) -> dict:
+        """Участок с вложенными; время - в миллисекундах от начала трассировки"""
+        data = {"name": self.name, "start_ms": _ms(self.started - origin),
+                "duration_ms": _ms(self.duration) if self.duration is not None else None}
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+class _SpanScope:
+    """Участок на время блока with или вызова декорируемой функции (в том числе корутины).
+
+    Без активной трассировки ничего не записывает.
+    """
+
+    def __init__(self, name: str, attrs: dict):
+        self._name = name
+        self._attrs = attrs
+        self._span: Optional[Span] = None
+        self._token = None
+
+    def __enter__(self) -> Optional[Span]:
+        parent = _current.get()
+        if parent is None:
+            return None
+        self._span = Span(self._name, dict(self._attrs))
+        parent.children.append(self._span)
+        self._token = _current.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is None:
+            return
+        self._span.duration = time.perf_counter() - self._span.started
+        if exc_type is not None:
+            self._span.error = f"{exc_type.__name__}: {exc}"
+        _current.reset(self._token)
+        self._span = self._token = None
+
+    def __call__(self, func):
+        name, attrs = self._name, self._attrs
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def traced_async(*args, **kwargs):
+                with _SpanScope(name, attrs):
+                    return await func(*args, **kwargs)
+            return traced_async
+
+        @functools.wraps(func)
+        def traced(*args, **kwargs):
+            with _SpanScope(name, attrs):
+                return func(*args, **kwargs)
+        return traced
+
+
+def span(name: str, **attrs) -> _SpanScope:
+    """Вложенный участок текущей трассировки: with span(...) или @span(...)"""
+    return _SpanScope(name, attrs)
+
+
+def annotate(**attrs):
+    """Атрибуты текущего участка (размер промпта, результат попытки)"""
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def record_span(name: str, seconds: float, **attrs):
+    """Уже завершившийся участок длительностью seconds (например, ожидание в очереди)"""
+    current = _current.get()
+    if current is not None:
+        child = Span(name, attrs, time.perf_counter() - seconds)
+        child.duration = seconds
+        current.children.append(child)
+
+
+class _JsonLinesLog:
+    """Файл JSON Lines; строка пишется одним вызовом write, поэтому процессы могут писать в один файл"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, record: dict):
+        line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.error(f"[Trace] Не удалось записать {self.path}: {e}")
+
+
+class Tracer:
+    """Трассировка обновлений: у каждого - свой trace_id и дерево участков.
+
+    Завершённая трассировка пишется в trace_log_path (если задан), а ход
+    дольше slow_threshold секунд - ещё и в журнал медленных ходов вместе со
+    сводкой: размеры промптов, попытки Ollama с результатами и время этапов.
+    """
+
+    def __init__(self, trace_log_path: str = TRACE_LOG_PATH, slow_threshold: float = SLOW_TURN_THRESHOLD,
+                 slow_log_path: str = SLOW_TURN_LOG_PATH):
+        self.trace_log = _JsonLinesLog(trace_log_path) if trace_log_path else None
+        self.slow_threshold = slow_threshold
+        self.slow_log = _JsonLinesLog(slow_log_path) if slow_threshold and slow_log_path else None
+        # Потоки, которые сейчас обрабатывают обновления (их стеки смотрит профилировщик)
+        self._active_threads: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.trace_log is not None or self.slow_log is not None or profiler.enabled
+
+    def trace_update(self, update: dict) -> "_TraceScope":
+        """Трассировка обработки обновления на время блока with"""
+        return _TraceScope(self, update)
+
+    def active_threads(self) -> List[int]:
+        with self._lock:
+            return list(self._active_threads)
+
+    def _enter_thread(self):
+        with self._lock:
+            self._active_threads[threading.get_ident()] += 1
+
+    def _leave_thread(self):
+        ident = threading.get_ident()
+        with self._lock:
+            self._active_threads[ident] -= 1
+            if self._active_threads[ident] <= 0:
+                del self._active_threads[ident]
+
+    def _finish(self, root: Span, wall_start: float):
+        if self.trace_log is None and self.slow_log is None:
+            return
+        record = {"trace_id": root.attrs.pop("trace_id"),
+                  "started_at": datetime.fromtimestamp(wall_start, timezone.utc).isoformat(timespec="milliseconds"),
+                  "duration_ms": _ms(root.duration), "pid": os.getpid(), **root.attrs}
+        if root.error:
+            record["error"] = root.error
+        record["spans"] = [child.to_dict(root.started) for child in root.children]
+        if self.trace_log is not None:
+            self.trace_log.write(record)
+        if self.slow_log is not None and root.duration >= self.slow_threshold:
+            record["summary"] = _summary(root)
+            self.slow_log.write(record)
+            logger.warning(f"[Trace] Медленный ход {record['trace_id']} (обновление {record.get('update_id')}, "
+                           f"чат {record.get('chat_id')}): {root.duration:.1f} с, подробности в {self.slow_log.path}")
+
+
+class _TraceScope:
+    def __init__(self, tracer: Tracer, update: dict):
+        self._tracer = tracer
+        self._update = update
+        self._root: Optional[Span] = None
+        self._token = None
+        self._wall_start = 0.0
+
+    def __enter__(self) -> Optional[Span]:
+        if not self._tracer.enabled:
+            return None
+        message = self._update.get("message", {})
+        text = message.get("text", "")
+        self._root = Span("update", {
+            "trace_id": uuid.uuid4().hex[:16],
+            "update_id": self._update.get("update_id"),
+            "chat_id": message.get("chat", {}).get("id"),
+            # Сам текст игрока в журнал не попадает
+            "command": text.split()[0] if text.startswith("/") else "action",
+            "text_chars": len(text),
+        })
+        self._wall_start = time.time()
+        self._token = _current.set(self._root)
+        self._tracer._enter_thread()
+        return self._root
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._root is None:
+            return
+        root = self._root
+        root.duration = time.perf_counter() - root.started
+        if exc_type is not None:
+            root.error = f"{exc_type.__name__}: {exc}"
+        self._tracer._leave_thread()
+        _current.reset(self._token)
+        self._root = self._token = None
+        self._tracer._finish(root, self._wall_start)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+def _summary(root: Span) -> dict:
+    """Сводка медленного хода: время по этапам, промпты и попытки Ollama"""
+    stages: Dict[str, float] = {}
+    prompts, attempts = [], []
+    for item in root.walk():
+        if item is root:
+            continue
+        stages[item.name] = stages.get(item.name, 0) + (item.duration or 0)
+        if item.name == "ollama":
+            prompts.append(dict(item.attrs, duration_ms=_ms(item.duration or 0)))
+        elif item.name == "ollama_attempt":
+            attempts.append(dict(item.attrs, duration_ms=_ms(item.duration or 0), error=item.error))
+    return {"stages_ms": {name: _ms(seconds) for name, seconds in stages.items()},
+            "prompts": prompts, "attempts": attempts}
+
+
+class SamplingProfiler:
+    """Выборочный профилировщик горячего пути.
+
+    Раз в interval секунд снимает стеки потоков, которые сейчас обрабатывают
+    обновления, и при остановке пишет их в path в свёрнутом формате
+    (строка "функция;функция;... число" - вход для flamegraph.pl и speedscope).
+    В асинхронном режиме все обновления обрабатываются в потоке event loop,
+    поэтому в выборку попадает и ожидание ввода-вывода.
+    """
+
+    def __init__(self, interval: float = PROFILER_INTERVAL, path: str = PROFILER_PATH):
+        self.interval = interval
+        self.path = path
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"[Profiler] Выборка стеков раз в {self.interval * 1000:.0f} мс")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.dump()
+
+    def dump(self) -> Optional[str]:
+        """Запись накопленных стеков в файл; путь или None, если выборок нет"""
+        if not self.samples:
+            return None
+        path = self.path.format(pid=os.getpid())
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"[Profiler] {sum(self.samples.values())} выборок записано в {path}")
+        return path
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident in tracer.active_threads():
+            frame = frames.get(ident)
+            if frame is not None:
+                self.samples[_collapse(frame)] += 1
+
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+# Профилировщик и трассировка процесса
+profiler = SamplingProfiler()
+tracer = Tracer()
+trace_update = tracer.trace_update
@@ -0,0 +1,105 @@
+import time
+import sqlite3
+import logging
+from typing import List, Optional, Tuple
+from database import db_manager
+from services.dispatcher import get_update_chat_id
+from services.metrics import Counter
+from config.settings import UPDATE_JOURNAL_ENABLED, PROCESSED_UPDATES_TTL
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+JOURNAL_UPDATES = Counter("update_journal_updates_total", "Принятые обновления по результату проверки журнала",
+                          ("result",))
+
+# Как часто удалять из журнала старые обработанные обновления, секунды
+_PRUNE_INTERVAL = 3600
+
+
+class UpdateJournal:
+    """Журнал обновлений Telegram в БД.
+
+    Принятые обновления записываются в processed_updates вместе с offset
+    следующего getUpdates до того, как попадут к диспетчеру, поэтому
+    после падения offset не откатывается, а необработанные обновления
+    обрабатываются заново. Обработанное обновление хранит свой ответ:
+    если Telegram доставит его ещё раз, ответ отправляется повторно без
+    обращения к Ollama.
+    """
+
+    def __init__(self, enabled: bool = UPDATE_JOURNAL_ENABLED, ttl: float = PROCESSED_UPDATES_TTL):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._last_prune = 0.0
+
+    def restore(self, client=None) -> List[dict]:
+        """Восстановление после запуска: offset клиента и необработанные обновления"""
+        if not self.enabled:
+            return []
+        if client is not None:
+            client.offset = max(client.offset, db_manager.load_update_offset())
+        self._prune()
+        pending = self.pending()
+        if pending:
+            JOURNAL_UPDATES.inc(len(pending), result="recovered")
+            logger.info(f"[Updates] Необработанных обновлений с прошлого запуска: {len(pending)}")
+        return pending
+
+    def pending(self) -> List[dict]:
+        """Принятые, но ещё не обработанные обновления по порядку"""
+        if not self.enabled:
+            return []
+        return db_manager.load_pending_updates()
+
+    def accept(self, updates: List[dict], offset: Optional[int] = None) -> Tuple[List[dict], List[Tuple[int, str]]]:
+        """Новые обновления для обработки и ответы (chat_id, текст) на повторно доставленные"""
+        if not self.enabled or not updates:
+            return updates, []
+        try:
+            known = db_manager.accept_updates(updates, [get_update_chat_id(update) for update in updates], offset)
+        except sqlite3.Error as e:
+            # Без журнала обновления всё равно обрабатываются, как до его появления
+            logger.error(f"[Updates] Ошибка записи журнала обновлений: {e}")
+            return updates, []
+        fresh, replies = [], []
+        for update, entry in zip(updates, known):
+            if entry is None:
+                JOURNAL_UPDATES.inc(result="new")
+                fresh.append(update)
+                continue
+            done, reply = entry
+            if not done:
+                # Обновление уже обрабатывается (или поставлено в очередь при восстановлении)
+                JOURNAL_UPDATES.inc(result="in_progress")
+                continue
+            JOURNAL_UPDATES.inc(result="replayed")
+            chat_id = get_update_chat_id(update)
+            if reply and chat_id is not None:
+                replies.append((chat_id, reply))
+        if time.monotonic() - self._last_prune >= _PRUNE_INTERVAL:
+            self._prune()
+        return fresh, replies
+
+    def finish(self, update: dict, reply: Optional[str]):
+        """Отметка обновления обработанным; reply - отправленный ответ (None - без ответа)"""
+        if not self.enabled or "update_id" not in update:
+            return
+        try:
+            db_manager.finish_update(update["update_id"], reply or None)
+        except sqlite3.Error as e:
+            logger.error(f"[Updates] Ошибка записи ответа на обновление {update['update_id']}: {e}")
+
+    def _prune(self):
+        self._last_prune = time.monotonic()
+        try:
+            removed = db_manager.prune_processed_updates(time.time() - self.ttl)
+        except sqlite3.Error as e:
+            logger.error(f"[Updates] Ошибка очистки журнала обновлений: {e}")
+            return
+        if removed:
+            logger.info(f"[Updates] Удалено старых обработанных обновлений: {removed}")
+
+
+# Глобальный журнал обновлений
+update_journal = UpdateJournal()
@@ -0,0 +1,198 @@
+import hmac
+import json
+import queue
+import asyncio
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from aiohttp import web
+from services.metrics import Counter
+from config.settings import (
+    WEBHOOK_LISTEN_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_QUEUE_SIZE,
+)
+
+# Настройка логгера
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передаёт secret_token из setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+WEBHOOK_REQUESTS = Counter("webhook_requests_total", "Запросы к webhook по результату", ("result",))
+
+
+def _check_secret(received: Optional[str], secret: str) -> bool:
+    """Совпадает ли секрет запроса с ожидаемым (без утечки по времени сравнения)"""
+    if not secret:
+        return True
+    return received is not None and hmac.compare_digest(received.encode("utf-8"), secret.encode("utf-8"))
+
+
+def _parse_update(body: bytes) -> Optional[dict]:
+    """Обновление из тела запроса или None, если это не объект обновления"""
+    try:
+        update = json.loads(body)
+    except ValueError:
+        return None
+    return update if isinstance(update, dict) and "update_id" in update else None
+
+
+class WebhookServer:
+    """Приём обновлений Telegram по webhook в синхронном режиме.
+
+    Встроенный HTTP-сервер проверяет секрет, кладёт обновление в очередь и
+    сразу отвечает 200, не дожидаясь обработки. Основной цикл забирает
+    обновления через get_updates() так же, как при длинном опросе. Если
+    очередь переполнена, отвечает 503 - Telegram повторит доставку позже.
+    """
+
+    def __init__(self, host: str = WEBHOOK_LISTEN_HOST, port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH,
+                 secret_token: str = WEBHOOK_SECRET_TOKEN, max_queue: int = WEBHOOK_QUEUE_SIZE):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self._queue: "queue.Queue[dict]" = queue.Queue(max_queue)
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Запуск HTTP-сервера в фоновом потоке"""
+        if self._server is not None:
+            return
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        # При port=0 система выбирает свободный порт
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+        logger.info(f"[Webhook] Приём обновлений на {self.host}:{self.port}{self.path}")
+
+    def stop(self):
+        """Остановка HTTP-сервера (принятые обновления остаются в очереди)"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
+
+    def get_updates(self, timeout: float = 1) -> list:
+        """Принятые обновления; ждёт первое не дольше timeout секунд"""
+        try:
+            updates = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                updates.append(self._queue.get_nowait())
+            except queue.Empty:
+                return updates
+
+    def _accept(self, path: str, secret: Optional[str], body: bytes) -> int:
+        """HTTP-статус ответа Telegram на доставку обновления"""
+        if path != self.path:
+            WEBHOOK_REQUESTS.inc(result="not_found")
+            return 404
+        if not _check_secret(secret, self.secret_token):
+            WEBHOOK_REQUESTS.inc(result="forbidden")
+            return 403
+        update = _parse_update(body)
+        if update is None:
+            WEBHOOK_REQUESTS.inc(result="bad_request")
+            return 400
+        try:
+            self._queue.put_nowait(update)
+        except queue.Full:
+            WEBHOOK_REQUESTS.inc(result="overloaded")
+            logger.warning("[Webhook] Очередь обновлений переполнена, Telegram повторит доставку")
+            return 503
+        WEBHOOK_REQUESTS.inc(result="accepted")
+        return 200
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status = server._accept(self.path, self.headers.get(SECRET_HEADER), body)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        return Handler
+
+
+class AsyncWebhookServer:
+    """Приём обновлений Telegram по webhook в event loop (aiohttp.web).
+
+    Аналог WebhookServer: проверка секрета, очередь asyncio и немедленный ответ.
+    """
+
+    def __init__(self, host: str = WEBHOOK_LISTEN_HOST, port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH,
+                 secret_token: str = WEBHOOK_SECRET_TOKEN, max_queue: int = WEBHOOK_QUEUE_SIZE):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        """Запуск HTTP-сервера в текущем event loop"""
+        if self._runner is not None:
+            return
+        self._queue = asyncio.Queue(self.max_queue)
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # При port=0 система выбирает свободный порт
+        self.port = self._runner.addresses[0][1]
+        logger.info(f"[Webhook] Приём обновлений на {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Остановка HTTP-сервера (принятые обновления остаются в очереди)"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def get_updates(self) -> List[dict]:
+        """Принятые обновления; ждёт, пока придёт хотя бы одно"""
+        updates = [await self._queue.get()]
+        while not self._queue.empty():
+            updates.append(self._queue.get_nowait())
+        return updates
+
+    def get_pending(self) -> List[dict]:
+        """Принятые обновления без ожидания (при остановке)"""
+        updates = []
+        while self._queue is not None and not self._queue.empty():
+            updates.append(self._queue.get_nowait())
+        return updates
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if not _check_secret(request.headers.get(SECRET_HEADER), self.secret_token):
+            WEBHOOK_REQUESTS.inc(result="forbidden")
+            return web.Response(status=403)
+        update = _parse_update(await request.read())
+        if update is None:
+            WEBHOOK_REQUESTS.inc(result="bad_request")
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            WEBHOOK_REQUESTS.inc(result="overloaded")
+            logger.warning("[Webhook] Очередь обновлений переполнена, Telegram повторит доставку")
+            return web.Response(status=503)
+        WEBHOOK_REQUESTS.inc(result="accepted")
+        return web.Response(status=200)
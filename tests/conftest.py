@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db_manager  # noqa: E402
+
+
+@pytest.fixture(params=["snapshot", "normalized"])
+def db(request, tmp_path):
+    """Пустая БД во временном каталоге; тест выполняется для обоих хранилищ игр"""
+    previous = db_manager._db_path, db_manager._backend
+    db_manager.init_db(str(tmp_path / "dnd.db"), backend=request.param)
+    yield request.param
+    db_manager.close_connections()
+    db_manager._db_path, db_manager._backend = previous
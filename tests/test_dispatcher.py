@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from services.dispatcher import AsyncUpdateDispatcher, UpdateDispatcher
+
+
+def _update(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": f"ход {update_id}"}}
+
+
+def _by_chat(handled):
+    chats = {}
+    for update in handled:
+        chats.setdefault(update["message"]["chat"]["id"], []).append(update["update_id"])
+    return chats
+
+
+def test_sync_dispatcher_keeps_order_within_chat():
+    handled, active, overlap = [], set(), []
+    lock = threading.Lock()
+
+    def handler(update):
+        chat_id = update["message"]["chat"]["id"]
+        with lock:
+            if chat_id in active:
+                overlap.append(chat_id)
+            active.add(chat_id)
+        # Более ранние обновления обрабатываются дольше - обогнать их могла бы только ошибка порядка
+        time.sleep(0.02 if update["update_id"] % 3 == 0 else 0.001)
+        with lock:
+            active.discard(chat_id)
+            handled.append(update)
+
+    dispatcher = UpdateDispatcher(handler, max_workers=4)
+    for update_id in range(30):
+        dispatcher.submit(_update(update_id, chat_id=update_id % 3))
+    assert dispatcher.shutdown(timeout=10)
+
+    assert not overlap
+    assert _by_chat(handled) == {chat: list(range(chat, 30, 3)) for chat in range(3)}
+
+
+def test_sync_dispatcher_survives_handler_error():
+    handled = []
+
+    def handler(update):
+        if update["update_id"] == 0:
+            raise RuntimeError("сбой обработчика")
+        handled.append(update["update_id"])
+
+    dispatcher = UpdateDispatcher(handler, max_workers=2)
+    for update_id in range(3):
+        dispatcher.submit(_update(update_id, chat_id=1))
+    assert dispatcher.shutdown(timeout=5)
+    assert handled == [1, 2]
+
+
+def test_async_dispatcher_keeps_order_within_chat():
+    handled, active, overlap = [], set(), []
+
+    async def handler(update):
+        chat_id = update["message"]["chat"]["id"]
+        if chat_id in active:
+            overlap.append(chat_id)
+        active.add(chat_id)
+        await asyncio.sleep(0.01 if update["update_id"] % 3 == 0 else 0)
+        active.discard(chat_id)
+        handled.append(update)
+
+    async def run():
+        dispatcher = AsyncUpdateDispatcher(handler, max_concurrent=4)
+        for update_id in range(30):
+            await dispatcher.submit(_update(update_id, chat_id=update_id % 3))
+        assert await dispatcher.shutdown(timeout=10)
+
+    asyncio.run(run())
+    assert not overlap
+    assert _by_chat(handled) == {chat: list(range(chat, 30, 3)) for chat in range(3)}
+
+
+def test_async_dispatcher_unregisters_cancelled_chat():
+    async def handler(update):
+        await asyncio.sleep(10)
+
+    async def run():
+        dispatcher = AsyncUpdateDispatcher(handler)
+        await dispatcher.submit(_update(1, chat_id=7))
+        await dispatcher.submit(_update(2, chat_id=7))
+        await asyncio.sleep(0)
+        assert not await dispatcher.shutdown(timeout=0.05)
+        # Очередь отменённой задачи не остаётся за чатом
+        assert 7 not in dispatcher._chat_queues
+
+    asyncio.run(run())
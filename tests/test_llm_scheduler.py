@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from services.llm_scheduler import (
+    LlmQueueFullError,
+    LlmScheduler,
+    PRIORITY_ACTION,
+    PRIORITY_BACKGROUND,
+    PRIORITY_NEW_GAME,
+)
+
+
+async def _hold(scheduler: LlmScheduler, release: asyncio.Event):
+    async with scheduler.slot_async(chat_id=0):
+        await release.wait()
+
+
+async def _request(scheduler: LlmScheduler, chat_id: int, priority: int, granted: list, name: str):
+    async with scheduler.slot_async(chat_id, priority):
+        granted.append(name)
+
+
+async def _run_queued(scheduler: LlmScheduler, requests) -> list:
+    """Запросы (chat_id, priority, name) встают в очередь за занятым слотом; порядок выдачи слотов"""
+    release, granted = asyncio.Event(), []
+    holder = asyncio.create_task(_hold(scheduler, release))
+    await asyncio.sleep(0)
+    tasks = []
+    for chat_id, priority, name in requests:
+        tasks.append(asyncio.create_task(_request(scheduler, chat_id, priority, granted, name)))
+        # Запрос встаёт в очередь при первом шаге задачи
+        await asyncio.sleep(0)
+    assert scheduler.waiting == len(requests)
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return granted
+
+
+def test_more_important_priority_goes_first():
+    async def run():
+        scheduler = LlmScheduler(max_concurrent=1, max_queue=10)
+        return await _run_queued(scheduler, [
+            (1, PRIORITY_BACKGROUND, "background"),
+            (2, PRIORITY_NEW_GAME, "new_game"),
+            (3, PRIORITY_ACTION, "action"),
+        ])
+
+    assert asyncio.run(run()) == ["action", "new_game", "background"]
+
+
+def test_round_robin_between_chats():
+    async def run():
+        scheduler = LlmScheduler(max_concurrent=1, max_queue=10)
+        return await _run_queued(scheduler, [
+            (1, PRIORITY_ACTION, "a1"), (1, PRIORITY_ACTION, "a2"), (1, PRIORITY_ACTION, "a3"),
+            (2, PRIORITY_ACTION, "b1"), (3, PRIORITY_ACTION, "c1"),
+        ])
+
+    assert asyncio.run(run()) == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_position_counts_round_robin():
+    async def run():
+        scheduler = LlmScheduler(max_concurrent=1, max_queue=10)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold(scheduler, release))
+        await asyncio.sleep(0)
+        tickets = [scheduler._enqueue(chat_id, PRIORITY_ACTION, asyncio.get_running_loop()) for chat_id in (1, 1, 2)]
+        positions = [scheduler.position(ticket) for ticket in tickets]
+        for ticket in tickets:
+            scheduler._abandon(ticket)
+        release.set()
+        await holder
+        return positions
+
+    # Второй запрос чата 1 ждёт, пока свой запрос получит чат 2
+    assert asyncio.run(run()) == [1, 3, 2]
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def run():
+        scheduler = LlmScheduler(max_concurrent=1, max_queue=10)
+        release, granted = asyncio.Event(), []
+        holder = asyncio.create_task(_hold(scheduler, release))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(_request(scheduler, 1, PRIORITY_ACTION, granted, "cancelled"))
+        waiting = asyncio.create_task(_request(scheduler, 2, PRIORITY_ACTION, granted, "waiting"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert scheduler.waiting == 1
+        release.set()
+        await asyncio.gather(holder, waiting)
+        return scheduler, granted
+
+    scheduler, granted = asyncio.run(run())
+    assert granted == ["waiting"]
+    assert scheduler.active == 0 and scheduler.waiting == 0
+
+
+def test_abort_if_leaves_queue_in_thread():
+    scheduler = LlmScheduler(max_concurrent=0, max_queue=10)
+    with scheduler.slot(1, PRIORITY_BACKGROUND, abort_if=lambda: True) as granted:
+        assert granted is False
+    assert scheduler.waiting == 0
+
+
+def test_full_queue_rejects_player_and_skips_background():
+    scheduler = LlmScheduler(max_concurrent=0, max_queue=0)
+    with pytest.raises(LlmQueueFullError):
+        with scheduler.slot(1, PRIORITY_ACTION):
+            pass
+    with scheduler.slot(1, PRIORITY_BACKGROUND) as granted:
+        assert granted is False
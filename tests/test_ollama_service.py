@@ -0,0 +1,26 @@
+import asyncio
+import pytest
+from models import StateChange
+from services import ollama_service
+from services.ollama_service import OllamaUnavailableError, ollama_with_validation, ollama_with_validation_async
+
+
+@pytest.fixture
+def unavailable(monkeypatch):
+    """Все серверы Ollama недоступны; очередь к LLM трогать нельзя"""
+    monkeypatch.setattr(ollama_service.ollama_backends, "available", lambda model=None: False)
+
+    def no_queue(*args, **kwargs):
+        raise AssertionError("запрос встал в очередь при недоступных серверах")
+    monkeypatch.setattr(ollama_service.llm_scheduler, "slot", no_queue)
+    monkeypatch.setattr(ollama_service.llm_scheduler, "slot_async", no_queue)
+
+
+def test_unavailable_fails_before_queue(unavailable):
+    with pytest.raises(OllamaUnavailableError):
+        ollama_with_validation("Действие игрока", StateChange, chat_id=1)
+
+
+def test_unavailable_fails_before_queue_async(unavailable):
+    with pytest.raises(OllamaUnavailableError):
+        asyncio.run(ollama_with_validation_async("Действие игрока", StateChange, chat_id=1))
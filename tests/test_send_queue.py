@@ -0,0 +1,122 @@
+import threading
+import time
+from services.send_queue import Preview, SendQueue, _SendSchedule, _request, split_message
+from services.telegram_client import TelegramRetryAfter
+
+
+class FakeClient:
+    """Bot API: запоминает вызовы, первые ответы можно задать заранее"""
+
+    def __init__(self, responses=()):
+        self.calls = []
+        self.responses = list(responses)
+        self._message_id = 100
+        self._lock = threading.Lock()
+
+    def call(self, method: str, data: dict) -> dict:
+        with self._lock:
+            self.calls.append((time.monotonic(), method, dict(data)))
+            response = self.responses.pop(0) if self.responses else None
+        if isinstance(response, Exception):
+            raise response
+        if response is not None:
+            return response
+        with self._lock:
+            self._message_id += 1
+            return {"ok": True, "result": {"message_id": self._message_id}}
+
+
+def _queue(client) -> SendQueue:
+    queue = SendQueue(client, workers=1, global_rate=1000)
+    queue._schedule.chat_interval = 0
+    return queue
+
+
+def test_retry_after_delays_resend():
+    client = FakeClient([TelegramRetryAfter(0.3)])
+    queue = _queue(client)
+    queue.start()
+    queue.send_message(1, "привет")
+    assert queue.stop(timeout=5)
+
+    assert [call[1] for call in client.calls] == ["sendMessage", "sendMessage"]
+    assert client.calls[1][0] - client.calls[0][0] >= 0.3
+    assert queue.pending == 0
+
+
+def test_rejected_message_is_not_retried():
+    client = FakeClient([{"ok": False, "description": "Forbidden: bot was blocked by the user"}])
+    queue = _queue(client)
+    queue.start()
+    queue.send_message(1, "привет")
+    queue.send_message(1, "второе")
+    assert queue.stop(timeout=5)
+
+    assert [call[2]["text"] for call in client.calls] == ["привет", "второе"]
+
+
+def test_long_message_is_split_in_order():
+    client = FakeClient()
+    queue = _queue(client)
+    queue.start()
+    text = "\n".join(f"строка {index} " + "x" * 100 for index in range(100))
+    queue.send_message(1, text)
+    assert queue.stop(timeout=5)
+
+    parts = [call[2]["text"] for call in client.calls]
+    assert parts == split_message(text)
+    assert len(parts) > 1
+
+
+def test_preview_updates_coalesce_in_schedule():
+    schedule = _SendSchedule(global_rate=1000, chat_interval=0, max_attempts=3, backoff=1, max_backoff=1)
+    preview = Preview(1)
+    for index in range(5):
+        schedule.push_preview(preview, f"текст {index}")
+
+    assert schedule.pending == 1
+    message, _ = schedule.take(time.monotonic())
+    assert _request(message) == ("sendMessage", {"chat_id": 1, "text": "текст 4"})
+
+
+def test_preview_sends_once_then_edits_latest_text():
+    first_call = threading.Event()
+    proceed = threading.Event()
+
+    class SlowClient(FakeClient):
+        def call(self, method, data):
+            if not first_call.is_set():
+                first_call.set()
+                proceed.wait(5)
+            return super().call(method, data)
+
+    client = SlowClient()
+    queue = _queue(client)
+    queue.start()
+    preview = queue.preview(1)
+    queue.update_preview(preview, "начало …")
+    assert first_call.wait(5)
+    # Пока первое сообщение отправляется, правки и итог копятся в одной задаче
+    for index in range(5):
+        queue.update_preview(preview, f"начало {index} …")
+    queue.finish_preview(preview, "итог")
+    proceed.set()
+    assert queue.stop(timeout=5)
+
+    calls = [(method, data.get("message_id"), data["text"]) for _, method, data in client.calls]
+    assert calls == [("sendMessage", None, "начало …"), ("editMessageText", 101, "итог")]
+
+
+def test_rejected_final_edit_is_sent_as_new_message():
+    client = FakeClient([None, {"ok": False, "description": "Bad Request: message to edit not found"}])
+    queue = _queue(client)
+    queue.start()
+    preview = queue.preview(1)
+    queue.update_preview(preview, "начало …")
+    while queue.pending:
+        time.sleep(0.01)
+    queue.finish_preview(preview, "итог")
+    assert queue.stop(timeout=5)
+
+    assert [(method, data["text"]) for _, method, data in client.calls] == [
+        ("sendMessage", "начало …"), ("editMessageText", "итог"), ("sendMessage", "итог")]
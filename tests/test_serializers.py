@@ -0,0 +1,74 @@
+import json
+import pytest
+from models import StateChange
+from database import serializers
+from database.serializers import (
+    FORMATS,
+    decode_change,
+    decode_legacy_json,
+    decode_state,
+    encode_change,
+    encode_state,
+    resolve_format,
+)
+from benchmarks.dungeon_factory import make_dungeon
+
+
+@pytest.mark.parametrize("fmt", sorted(FORMATS))
+def test_state_round_trip(fmt):
+    state = make_dungeon(5)
+    assert decode_state(encode_state(state, fmt)) == state
+
+
+@pytest.mark.parametrize("fmt", sorted(FORMATS))
+def test_change_round_trip_keeps_only_set_fields(fmt):
+    changes = StateChange(player_hp_change=-3, room_items_remove=["Факел"], last_action_description="Удар")
+    blob = encode_change(changes, fmt)
+    assert decode_change(blob) == changes
+    assert b"inventory_add" not in blob
+
+
+def test_any_format_is_readable_whatever_is_configured():
+    state = make_dungeon(3)
+    blobs = [encode_state(state, fmt) for fmt in FORMATS]
+    assert all(decode_state(blob) == state for blob in blobs)
+
+
+def test_missing_msgpack_falls_back_to_json():
+    assert resolve_format("json+zlib") == "json+zlib"
+    expected = "msgpack+zlib" if "msgpack+zlib" in FORMATS else "json+zlib"
+    assert resolve_format("msgpack+zlib") == expected
+    with pytest.raises(ValueError):
+        resolve_format("xml")
+
+
+def test_legacy_json_save():
+    state = make_dungeon(3)
+    assert decode_legacy_json(json.dumps(state.dict(), ensure_ascii=False)) == state
+
+
+def test_old_version_is_migrated(monkeypatch):
+    state = make_dungeon(3)
+    old_blob = encode_state(state, "json+zlib")
+
+    def rename_story(data):
+        data["story_context"] = "перенесено: " + data["story_context"]
+        return data
+
+    monkeypatch.setattr(serializers, "STATE_SCHEMA_VERSION", 2)
+    monkeypatch.setitem(serializers.STATE_MIGRATIONS, 1, rename_story)
+
+    migrated = decode_state(old_blob)
+    assert migrated.story_context == "перенесено: " + state.story_context
+    # Новое сохранение пишется текущей версией и миграций не требует
+    assert decode_state(encode_state(migrated, "json")) == migrated
+
+
+def test_newer_version_and_damaged_blob_are_rejected(monkeypatch):
+    blob = encode_state(make_dungeon(3), "json")
+    with pytest.raises(ValueError):
+        decode_state(b"XX" + blob[2:])
+    with pytest.raises(ValueError):
+        decode_state(blob[:2] + bytes((99,)) + blob[3:])
+    with pytest.raises(ValueError):
+        decode_state(blob[:3] + bytes((99,)) + blob[4:])
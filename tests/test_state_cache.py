@@ -0,0 +1,79 @@
+from models import StateChange, apply_state_changes
+from database import db_manager
+from database.state_cache import GameStateCache
+from benchmarks.dungeon_factory import make_dungeon
+
+CHAT_ID = 42
+
+
+def _play(cache: GameStateCache, state, changes):
+    """Ходы, как их сохраняет обработчик: применение изменений и save_action"""
+    for change in changes:
+        state = apply_state_changes(state, change)
+        cache.save_action(CHAT_ID, state, change)
+    return state
+
+
+def _moves():
+    return [
+        StateChange(player_hp_change=-2, inventory_add=["Факел"], last_action_description="Вас задела стрела"),
+        StateChange(player_location_change="Room2", last_action_description="Вы проходите в следующий зал"),
+        StateChange(room_items_add=["Кусок мела"], last_action_description="Вы рисуете знак на стене"),
+    ]
+
+
+def test_new_game_and_actions_in_one_flush(db):
+    """Новая игра и её первые ходы попадают в одну запись кеша"""
+    cache = GameStateCache(flush_interval=3600, snapshot_interval=100)
+    cache.start()
+    state = make_dungeon(5)
+    cache.save(CHAT_ID, state)
+    state = _play(cache, state, _moves())
+    cache.stop()
+
+    game = db_manager.load_game(CHAT_ID)
+    assert game is not None
+    assert game.state == state
+    assert game.seq == 3
+    assert [seq for seq, _ in db_manager.load_history(CHAT_ID)] == [1, 2, 3]
+
+
+def test_snapshot_then_actions_across_flushes(db):
+    """Снимок в одной записи, ходы - в следующих; загрузка из БД совпадает с кешем"""
+    cache = GameStateCache(flush_interval=3600, snapshot_interval=2)
+    cache.start()
+    state = make_dungeon(5)
+    cache.save(CHAT_ID, state)
+    assert cache.flush() == 1
+    moves = _moves()
+    state = _play(cache, state, moves[:2])
+    assert cache.flush() == 1
+    state = _play(cache, state, moves[2:])
+    cache.stop()
+
+    game = db_manager.load_game(CHAT_ID)
+    assert game.state == state
+    assert game.seq == 3
+    if db == "snapshot":
+        # Снимок записан после второго хода, третий восстанавливается из журнала
+        assert game.replayed == 1
+
+
+def test_direct_writes_without_flush_thread(db):
+    """Без фонового потока каждое сохранение сразу пишется в БД"""
+    cache = GameStateCache()
+    state = make_dungeon(3)
+    cache.save(CHAT_ID, state)
+    state = _play(cache, state, _moves()[:1])
+
+    assert db_manager.load_game(CHAT_ID).state == state
+
+
+def test_action_for_missing_game_is_skipped(db):
+    """Ход игры, которой нет в хранилище, не ломает запись остальных игр"""
+    state = make_dungeon(3)
+    change = StateChange(player_hp_change=-1)
+    db_manager.write_games([(CHAT_ID, state, 0)], [(7, 1, change), (CHAT_ID, 1, change)])
+
+    game = db_manager.load_game(CHAT_ID)
+    assert game.state.player.hp == state.player.hp - 1
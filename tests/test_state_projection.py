@@ -0,0 +1,37 @@
+import pytest
+from models import StateChange
+from services.state_projection import build_projection, check_state_change_scope
+from benchmarks.dungeon_factory import make_dungeon
+
+
+def test_move_drops_room_changes_of_destination():
+    """При переходе изменения комнаты (в том числе добавления) отбрасываются"""
+    projection = build_projection(make_dungeon(3))
+    changes = StateChange(player_location_change="Room2", room_items_add=["Факел"], room_enemies_add=["Гоблин"],
+                          room_friendly_npcs_add=["Призрак монаха"], room_description_change="Тёмный зал",
+                          inventory_add=["Верёвка"])
+
+    checked = check_state_change_scope(projection, changes)
+
+    assert checked.player_location_change == "Room2"
+    assert checked.room_items_add is None
+    assert checked.room_enemies_add is None
+    assert checked.room_friendly_npcs_add is None
+    assert checked.room_description_change is None
+    assert checked.inventory_add == ["Верёвка"]
+
+
+def test_room_additions_kept_without_move():
+    projection = build_projection(make_dungeon(3))
+    changes = StateChange(room_items_add=["Факел"], room_items_remove=["Несуществующий предмет"])
+
+    checked = check_state_change_scope(projection, changes)
+
+    assert checked.room_items_add == ["Факел"]
+    assert checked.room_items_remove == []
+
+
+def test_move_without_exit_is_rejected():
+    projection = build_projection(make_dungeon(3))
+    with pytest.raises(ValueError):
+        check_state_change_scope(projection, StateChange(player_location_change="Room3"))
@@ -0,0 +1,52 @@
+from services.update_journal import UpdateJournal
+
+
+class Client:
+    offset = 0
+
+
+def _update(update_id: int, chat_id: int = 5) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": f"ход {update_id}"}}
+
+
+def test_new_updates_pass_and_duplicates_in_progress_are_dropped(db):
+    journal = UpdateJournal(enabled=True)
+    fresh, replies = journal.accept([_update(1), _update(2)], offset=3)
+    assert [update["update_id"] for update in fresh] == [1, 2]
+    assert replies == []
+
+    # Повторная доставка, пока обновление обрабатывается
+    fresh, replies = journal.accept([_update(2), _update(3)], offset=4)
+    assert [update["update_id"] for update in fresh] == [3]
+    assert replies == []
+
+
+def test_processed_duplicate_gets_saved_reply(db):
+    journal = UpdateJournal(enabled=True)
+    journal.accept([_update(1), _update(2)])
+    journal.finish(_update(1), "ответ ведущего")
+    journal.finish(_update(2), "")
+
+    fresh, replies = journal.accept([_update(1), _update(2)])
+    assert fresh == []
+    # Обновление без ответа повторно ничего не отправляет
+    assert replies == [(5, "ответ ведущего")]
+
+
+def test_restore_returns_unfinished_updates_and_offset(db):
+    journal = UpdateJournal(enabled=True)
+    journal.accept([_update(1), _update(2), _update(3)], offset=4)
+    journal.finish(_update(2), "готово")
+
+    # Новый процесс после падения
+    client = Client()
+    pending = UpdateJournal(enabled=True).restore(client)
+    assert [update["update_id"] for update in pending] == [1, 3]
+    assert client.offset == 4
+
+
+def test_disabled_journal_passes_everything(db):
+    journal = UpdateJournal(enabled=False)
+    updates = [_update(1), _update(1)]
+    assert journal.accept(updates) == (updates, [])
+    assert journal.restore(Client()) == []